@@ -8,6 +8,10 @@ import os
 # So, '..' should point to /var/task/
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+# Vercel freezes the function once the response is sent, so background worker threads
+# (and their in-memory queue) can't be relied on; run jobs inline unless overridden.
+os.environ.setdefault('BACKGROUND_JOBS_ENABLED', 'false')
+
 from app import create_app # Import your create_app function
 
 # Vercel expects the WSGI application to be named 'app' by default for Python runtimes.
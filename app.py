@@ -7,8 +7,12 @@ import os
 # Assuming config.py, core.models, etc., are in the same root directory or correctly on PYTHONPATH
 from config import Config
 from core.models import db, User # db must be initialized before blueprints that use it
+from core.database import init_database
+from core.migrations import migrate_on_startup, stamp_migrations
+from core.metrics import init_metrics
+from core.jobs import init_jobs
 from core.auth import auth_bp
-from core.knowledge_base import kb_bp
+from core.knowledge_base import kb_bp, warm_up_knowledge_base, start_background_warm_up
 from core.chatbot import chatbot_bp
 from core.ticketing import ticketing_bp
 
@@ -22,7 +26,8 @@ def create_app(config_class=Config):
     # If bundling SQLite, 'instance' folder should be at the project root.
     # Config.py now uses PROJECT_ROOT to make paths absolute.
 
-    db.init_app(app)
+    init_database(app) # db.init_app plus pool sizing and SQLite pragmas (WAL, busy timeout)
+    migrate_on_startup(app) # Pending schema migrations, so new columns/tables exist before the first request
 
     login_manager = LoginManager()
     login_manager.init_app(app)
@@ -36,6 +41,14 @@ def create_app(config_class=Config):
     app.register_blueprint(kb_bp, url_prefix='/kb')
     app.register_blueprint(chatbot_bp, url_prefix='/chat')
     app.register_blueprint(ticketing_bp, url_prefix='/tickets')
+    init_metrics(app)
+    init_jobs(app) # Worker pool starts on the first request and requeues jobs orphaned by a restart
+
+    if app.config.get('CHROMA_WARMUP_ON_STARTUP'):
+        if app.config.get('CHROMA_WARMUP_IN_BACKGROUND'):
+            start_background_warm_up(app) # Serve immediately; KB requests use keyword search until it finishes
+        else:
+            warm_up_knowledge_base(app)
 
     @app.route('/')
     def index():
@@ -123,12 +136,14 @@ if __name__ == '__main__':
                 print(f"Creating directory for local SQLite DB: {db_dir}")
                 os.makedirs(db_dir)
 
-            if not os.path.exists(db_file_path):
+            # create_app may already have opened (and so created) an empty file
+            if not os.path.exists(db_file_path) or not db.inspect(db.engine).get_table_names():
                 print(f"Local SQLite database not found at {db_file_path}. Creating tables...")
                 db.create_all()
+                stamp_migrations()
                 print("Tables created.")
             else:
-                print(f"Local SQLite database found at {db_file_path}.")
+                print(f"Local SQLite database found at {db_file_path}.") # create_app applied any pending migrations
         else:
             print(f"Using non-SQLite database: {db_uri}. Manual schema management recommended.")
             # For cloud DBs, you might run db.create_all() here once during setup
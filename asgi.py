@@ -0,0 +1,15 @@
+# ASGI entry point: serves the chat and copilot endpoints on the async path (core/chat_async.py)
+# and every other route through the regular Flask app.
+#
+# Usage:
+#   uvicorn asgi:app --workers 2 --port 8000
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from app import create_app
+from core.chat_async import create_asgi_app
+
+flask_app = create_app()
+app = create_asgi_app(flask_app)
@@ -20,10 +20,49 @@ class Config:
     SQLITE_DB_PATH = os.path.join(PROJECT_ROOT, 'instance', 'app.db')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or f'sqlite:///{SQLITE_DB_PATH}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Connection tuning applied by create_app (core/database.py); SQLALCHEMY_ENGINE_OPTIONS set here still wins
+    SQLITE_WAL_ENABLED = os.environ.get('SQLITE_WAL_ENABLED', 'true').lower() in ('1', 'true', 'yes') # Readers don't block the writer
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL' # NORMAL is durable across app crashes in WAL mode
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)) # Wait this long for the write lock before "database is locked"
+    SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 16384)) # Page cache per connection
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10)) # Persistent connections per worker process
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20)) # Extra connections under bursts, closed when returned
+    DB_POOL_TIMEOUT_SECONDS = int(os.environ.get('DB_POOL_TIMEOUT_SECONDS', 10)) # Wait for a free connection before erroring
+    DB_POOL_RECYCLE_SECONDS = int(os.environ.get('DB_POOL_RECYCLE_SECONDS', 1800)) # Server DBs: replace connections older than this
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes') # Server DBs: drop dead connections on checkout
+    DB_MIGRATE_ON_STARTUP = os.environ.get('DB_MIGRATE_ON_STARTUP', 'true').lower() in ('1', 'true', 'yes') # create_app applies pending schema migrations
 
     # Groq Configuration
     GROQ_API_KEY = os.environ.get('GROQ_API_KEY') # Must be set in Vercel env vars
     CHAT_MODEL_GROQ = os.environ.get('CHAT_MODEL_GROQ') or "llama3-8b-8192"
+    # Any OpenAI-compatible endpoint works here (e.g. a local stub server for benchmarks)
+    GROQ_BASE_URL = os.environ.get('GROQ_BASE_URL') or "https://api.groq.com/openai/v1"
+    LLM_TIMEOUT_SECONDS = float(os.environ.get('LLM_TIMEOUT_SECONDS', 30)) # Per-request timeout for LLM calls
+    LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 2)) # Retries on connection errors / 429 / 5xx
+    LLM_MAX_CONNECTIONS = int(os.environ.get('LLM_MAX_CONNECTIONS', 20)) # Keep-alive pool size per worker
+    LLM_BATCH_MAX_WORKERS = int(os.environ.get('LLM_BATCH_MAX_WORKERS', 8)) # Threads for query_llm_groq_batch
+    # LLM call coalescing and concurrency limits (core/llm_limits.py); 0 disables a concurrency cap
+    LLM_SINGLE_FLIGHT_ENABLED = os.environ.get('LLM_SINGLE_FLIGHT_ENABLED', 'true').lower() in ('1', 'true', 'yes') # Share identical in-flight calls
+    LLM_MAX_CONCURRENT_CALLS = int(os.environ.get('LLM_MAX_CONCURRENT_CALLS', 16)) # Per worker process
+    LLM_MAX_CONCURRENT_CALLS_PER_COMPANY = int(os.environ.get('LLM_MAX_CONCURRENT_CALLS_PER_COMPANY', 4)) # Per worker process
+    LLM_MAX_QUEUED_CALLS = int(os.environ.get('LLM_MAX_QUEUED_CALLS', 64)) # Waiting calls beyond this get a 429 immediately
+    LLM_MAX_QUEUED_CALLS_PER_COMPANY = int(os.environ.get('LLM_MAX_QUEUED_CALLS_PER_COMPANY', 16))
+    LLM_QUEUE_TIMEOUT_SECONDS = float(os.environ.get('LLM_QUEUE_TIMEOUT_SECONDS', 10)) # Max wait for a slot before a 429
+    # Async chat path (asgi.py / core/chat_async.py): in-flight calls there cost a socket, not a thread
+    LLM_ASYNC_MAX_CONCURRENT_CALLS = int(os.environ.get('LLM_ASYNC_MAX_CONCURRENT_CALLS', 256)) # Per worker process
+    LLM_ASYNC_MAX_CONCURRENT_CALLS_PER_COMPANY = int(os.environ.get('LLM_ASYNC_MAX_CONCURRENT_CALLS_PER_COMPANY', 64)) # Per worker process
+    LLM_ASYNC_MAX_CONNECTIONS = int(os.environ.get('LLM_ASYNC_MAX_CONNECTIONS', 256)) # Async keep-alive pool size per worker
+    ASYNC_CHAT_THREADS = int(os.environ.get('ASYNC_CHAT_THREADS', 32)) # Threads for the DB / Chroma phases of async chat turns
+    # Prompt token budgets (core/prompts.py); budgets are in locally counted tokens
+    LLM_CONTEXT_WINDOW_TOKENS = int(os.environ.get('LLM_CONTEXT_WINDOW_TOKENS', 8192)) # Model context window (prompt + completion)
+    LLM_TOKEN_ESTIMATE_FACTOR = float(os.environ.get('LLM_TOKEN_ESTIMATE_FACTOR', 1.3)) # Model tokens per locally counted token
+    LLM_PROMPT_OVERHEAD_TOKENS = int(os.environ.get('LLM_PROMPT_OVERHEAD_TOKENS', 50)) # Chat template / role markers
+    PROMPT_USER_INPUT_TOKENS = int(os.environ.get('PROMPT_USER_INPUT_TOKENS', 1000)) # Customer message, agent query, ticket text
+    PROMPT_HISTORY_TOKENS = int(os.environ.get('PROMPT_HISTORY_TOKENS', 1500)) # Raw chat messages (oldest dropped first)
+    PROMPT_CONVERSATION_TOKENS = int(os.environ.get('PROMPT_CONVERSATION_TOKENS', 2500)) # Agent copilot conversation_context (tail kept)
+    CHAT_REPLY_MAX_TOKENS = int(os.environ.get('CHAT_REPLY_MAX_TOKENS', 500)) # Completion limits, reserved out of the window
+    AGENT_ASSIST_MAX_TOKENS = int(os.environ.get('AGENT_ASSIST_MAX_TOKENS', 300))
+    TICKET_CATEGORIZATION_MAX_TOKENS = int(os.environ.get('TICKET_CATEGORIZATION_MAX_TOKENS', 60)) # Two short lines
 
     # ChromaDB Configuration
     # For Vercel "Option D: Bundling Chroma Store"
@@ -32,6 +71,88 @@ class Config:
     
     # Sentence Transformers Configuration
     EMBEDDING_MODEL_SENTENCE_TRANSFORMERS = os.environ.get('EMBEDDING_MODEL_SENTENCE_TRANSFORMERS') or "sentence-transformers/all-MiniLM-L6-v2"
+    # Embedding backend (see core/embeddings.py): 'sentence_transformers', 'onnx' (int8 MiniLM on CPU) or 'hash'
+    EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'sentence_transformers')
+    EMBEDDING_ONNX_MODEL_DIR = os.environ.get('EMBEDDING_ONNX_MODEL_DIR') or os.path.join(PROJECT_ROOT, 'instance', 'onnx_embedding_model') # Built by scripts/build_onnx_embedding_model.py
+    EMBEDDING_ONNX_THREADS = int(os.environ.get('EMBEDDING_ONNX_THREADS', 2)) # ONNX Runtime intra-op threads per worker
+    EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', 32)) # Texts per ONNX inference call
+    EMBEDDING_HASH_DIMENSIONS = int(os.environ.get('EMBEDDING_HASH_DIMENSIONS', 384))
+    EMBEDDING_CACHE_ENABLED = os.environ.get('EMBEDDING_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    EMBEDDING_CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH', os.path.join(PROJECT_ROOT, 'instance', 'embedding_cache.sqlite')) # Empty: in-memory LRU only
+    EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.environ.get('EMBEDDING_CACHE_MEMORY_ENTRIES', 4096)) # Per worker, LRU evicted
+    EMBEDDING_CACHE_MAX_DISK_ENTRIES = int(os.environ.get('EMBEDDING_CACHE_MAX_DISK_ENTRIES', 200000)) # ~1.6 KB each at 384 dims
+
+    # Knowledge base warm cache (one Chroma client / embedding model per worker)
+    CHROMA_COLLECTION_CACHE_SIZE = int(os.environ.get('CHROMA_COLLECTION_CACHE_SIZE', 128)) # Max cached per-company collection handles
+    CHROMA_WARMUP_ON_STARTUP = os.environ.get('CHROMA_WARMUP_ON_STARTUP', 'false').lower() in ('1', 'true', 'yes') # Load client + model in create_app
+    CHROMA_WARMUP_IN_BACKGROUND = os.environ.get('CHROMA_WARMUP_IN_BACKGROUND', 'true').lower() in ('1', 'true', 'yes') # Warm up on a daemon thread instead of blocking startup (not for hosts that freeze the process between requests)
+
+    # Semantic answer cache for the customer chatbot (per worker)
+    SEMANTIC_CACHE_ENABLED = os.environ.get('SEMANTIC_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.92)) # Min cosine similarity for a hit
+    SEMANTIC_CACHE_TTL_SECONDS = int(os.environ.get('SEMANTIC_CACHE_TTL_SECONDS', 3600))
+    SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get('SEMANTIC_CACHE_MAX_ENTRIES', 256)) # Per company, LRU evicted
+
+    # Customer chat history in the prompt (rolling summary + recent raw messages, see core/chat_summary.py)
+    CHAT_MAX_CONTEXT_MESSAGES = int(os.environ.get('CHAT_MAX_CONTEXT_MESSAGES', 10)) # Cap on raw messages per prompt
+    CHAT_SUMMARY_ENABLED = os.environ.get('CHAT_SUMMARY_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    CHAT_RECENT_MESSAGES = int(os.environ.get('CHAT_RECENT_MESSAGES', 4)) # Newest messages always kept verbatim
+    CHAT_SUMMARY_BATCH_MESSAGES = int(os.environ.get('CHAT_SUMMARY_BATCH_MESSAGES', 4)) # Older messages folded per summarization
+    CHAT_SUMMARY_MAX_TOKENS = int(os.environ.get('CHAT_SUMMARY_MAX_TOKENS', 250))
+
+    # Bulk knowledge-base import
+    KB_IMPORT_INSERT_BATCH_SIZE = int(os.environ.get('KB_IMPORT_INSERT_BATCH_SIZE', 1000)) # SQL rows per INSERT
+    KB_IMPORT_EMBED_BATCH_SIZE = int(os.environ.get('KB_IMPORT_EMBED_BATCH_SIZE', 256)) # Documents per embedding call / Chroma upsert
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_UPLOAD_MB', 50)) * 1024 * 1024 # Upload size limit (KB import files)
+
+    # KB chunking and retrieval context (token counts are approximate, see utils.count_tokens)
+    KB_CHUNK_TOKENS = int(os.environ.get('KB_CHUNK_TOKENS', 200)) # MiniLM truncates input at 256 word pieces
+    KB_CHUNK_OVERLAP_TOKENS = int(os.environ.get('KB_CHUNK_OVERLAP_TOKENS', 40))
+    KB_CHUNKS_PER_ITEM_FETCHED = int(os.environ.get('KB_CHUNKS_PER_ITEM_FETCHED', 4)) # Chunk hits fetched per KB item wanted
+    KB_CONTEXT_TOKEN_BUDGET = int(os.environ.get('KB_CONTEXT_TOKEN_BUDGET', 1200)) # Max KB tokens put in a prompt
+    KB_CONTEXT_MIN_PARTIAL_TOKENS = int(os.environ.get('KB_CONTEXT_MIN_PARTIAL_TOKENS', 80)) # Don't add a truncated item below this
+
+    # Hybrid KB retrieval (FTS5/tsvector keyword index + Chroma, fused by reciprocal rank)
+    KB_RETRIEVAL_MODE = os.environ.get('KB_RETRIEVAL_MODE', 'hybrid') # 'hybrid', 'vector' or 'keyword'
+    KB_HYBRID_CANDIDATES = int(os.environ.get('KB_HYBRID_CANDIDATES', 10)) # Items taken from each leg before fusion
+    KB_RRF_K = int(os.environ.get('KB_RRF_K', 60))
+    KB_KEYWORD_SEARCH_WHEN_COLD = os.environ.get('KB_KEYWORD_SEARCH_WHEN_COLD', 'true').lower() in ('1', 'true', 'yes') # Serve keyword-only results while the embedding model loads in the background
+
+    # Ticket list keyset pagination
+    TICKETS_PAGE_SIZE = int(os.environ.get('TICKETS_PAGE_SIZE', 25))
+    TICKETS_MAX_PAGE_SIZE = int(os.environ.get('TICKETS_MAX_PAGE_SIZE', 100))
+
+    # Full-text search over tickets and chat messages (core/search.py)
+    SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 20))
+    SEARCH_MAX_CANDIDATES = int(os.environ.get('SEARCH_MAX_CANDIDATES', 1000)) # Only the newest N matches are ranked, so latency doesn't grow with history
+
+    # Precomputed AI-suggested solutions on the ticket view
+    TICKET_SUGGESTIONS_REFRESH_LIMIT = int(os.environ.get('TICKET_SUGGESTIONS_REFRESH_LIMIT', 500)) # Open tickets refreshed per KB change
+
+    # Duplicate / related ticket detection (core/ticket_similarity.py)
+    TICKET_SIMILARITY_ENABLED = os.environ.get('TICKET_SIMILARITY_ENABLED', 'true').lower() in ('1', 'true', 'yes') # Index new tickets in the company_<id>_tickets collection
+    TICKET_DUPLICATE_THRESHOLD = float(os.environ.get('TICKET_DUPLICATE_THRESHOLD', 0.92)) # Cosine similarity to flag a new ticket as a near-duplicate
+    TICKET_DUPLICATE_WINDOW_HOURS = int(os.environ.get('TICKET_DUPLICATE_WINDOW_HOURS', 72)) # Only tickets opened this recently are duplicate candidates
+    TICKET_DUPLICATE_CANDIDATES = int(os.environ.get('TICKET_DUPLICATE_CANDIDATES', 20)) # Nearest recent tickets checked for an open one
+    TICKET_SIMILAR_COUNT = int(os.environ.get('TICKET_SIMILAR_COUNT', 5)) # Similar tickets shown on the ticket view
+    TICKET_SIMILAR_MIN_SCORE = float(os.environ.get('TICKET_SIMILAR_MIN_SCORE', 0.6))
+    TICKET_CLUSTER_THRESHOLD = float(os.environ.get('TICKET_CLUSTER_THRESHOLD', 0.85)) # Open tickets at least this similar share a cluster
+    TICKET_CLUSTER_MAX_TICKETS = int(os.environ.get('TICKET_CLUSTER_MAX_TICKETS', 2000)) # Newest open tickets clustered per run
+    TICKET_CLUSTER_MIN_SIZE = int(os.environ.get('TICKET_CLUSTER_MIN_SIZE', 2))
+    TICKET_CLUSTER_MAX_AGE_SECONDS = int(os.environ.get('TICKET_CLUSTER_MAX_AGE_SECONDS', 300)) # Clusters page re-runs the job when its result is older
+
+    # Background job queue (LLM ticket categorization etc.)
+    BACKGROUND_JOBS_ENABLED = os.environ.get('BACKGROUND_JOBS_ENABLED', 'true').lower() in ('1', 'true', 'yes') # False runs jobs inline
+    BACKGROUND_JOBS_WORKERS = int(os.environ.get('BACKGROUND_JOBS_WORKERS', 2)) # Worker threads per process
+    BACKGROUND_JOBS_QUEUE_SIZE = int(os.environ.get('BACKGROUND_JOBS_QUEUE_SIZE', 1000))
+    BACKGROUND_JOBS_MAX_ATTEMPTS = int(os.environ.get('BACKGROUND_JOBS_MAX_ATTEMPTS', 3))
+    BACKGROUND_JOBS_RETRY_BACKOFF_SECONDS = float(os.environ.get('BACKGROUND_JOBS_RETRY_BACKOFF_SECONDS', 2)) # Doubles per attempt
+    BACKGROUND_JOBS_STALE_AFTER_SECONDS = int(os.environ.get('BACKGROUND_JOBS_STALE_AFTER_SECONDS', 900)) # Queued/running rows older than this are requeued when workers start
+
+    # Metrics and stage timing (Prometheus text format at /metrics, per worker process)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') # /metrics requires "Authorization: Bearer <token>"; without one it is served only in debug/testing
+    SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 2000)) # Log requests slower than this with their stage breakdown; 0 disables
 
     # Flask-Login session protection
     SESSION_COOKIE_SECURE = os.environ.get('VERCEL_ENV') == 'production' # True in Vercel production
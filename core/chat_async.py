@@ -0,0 +1,272 @@
+"""Async execution path for the customer chat and agent copilot endpoints.
+
+With sync workers, a chat turn holds a worker thread for the whole LLM call,
+which is seconds of waiting on a socket. Concurrency then equals the thread
+count. `create_asgi_app(app)` wraps the Flask app for an ASGI server
+(`uvicorn asgi:app`). POST /chat/customer_chat and /chat/agent_assist are
+served by coroutines, and every other route goes to Flask unchanged through
+asgiref's WsgiToAsgi.
+
+A turn runs the same code as the sync views (`prepare_customer_turn`,
+`finish_customer_turn`, ... in core/chatbot.py), in a Flask request context
+built from the ASGI request. Work that touches the DB, Chroma or the
+embedding model stays synchronous. It runs on a bounded thread pool
+(ASYNC_CHAT_THREADS), and the DB session is released at the end of each
+phase. The LLM call is awaited on the event loop through the async client,
+with its own concurrency caps (LLM_ASYNC_*). An in-flight turn therefore holds
+no thread and no pooled DB connection. Hundreds of turns can wait on the LLM
+in one process.
+"""
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g, jsonify
+from flask_login import current_user
+from werkzeug.test import EnvironBuilder
+
+from .models import db
+from .chatbot import (_sse_event, prepare_customer_turn, finish_customer_turn, finish_streamed_customer_turn,
+                      prepare_agent_assist)
+from .utils import async_query_llm_groq, async_stream_llm_groq
+from .llm_limits import LLMCapacityError
+
+_executor = None
+
+
+def _chat_executor(flask_app):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=flask_app.config['ASYNC_CHAT_THREADS'], thread_name_prefix='async-chat')
+    return _executor
+
+
+def _release_db():
+    """Returns the request's DB connection to the pool before the turn goes back to waiting on the LLM."""
+    db.session.remove()
+    g.pop('_login_user', None) # Detached with the session; Flask-Login reloads it in the next phase
+
+
+class FlaskTurnContext:
+    """The Flask request context for one ASGI request. `run()` executes sync work in it on the chat thread pool."""
+
+    def __init__(self, flask_app, environ):
+        self.app = flask_app
+        self.context = flask_app.request_context(environ)
+
+    @classmethod
+    async def from_request(cls, flask_app, request):
+        body = await request.body()
+        client = request.client
+        builder = EnvironBuilder(path=request.url.path, base_url=f"{request.url.scheme}://{request.url.netloc}",
+                                 query_string=request.url.query, method=request.method,
+                                 headers=list(request.headers.items()), data=body,
+                                 environ_base={'REMOTE_ADDR': client.host if client else ''})
+        try:
+            return cls(flask_app, builder.get_environ())
+        finally:
+            builder.close()
+
+    async def __aenter__(self):
+        self.context.push()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.context.pop(exc)
+
+    async def run(self, fn, *args):
+        """Runs `fn(*args)` in a worker thread with this request's context vars (request, g, current_user)."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_chat_executor(self.app), functools.partial(contextvars.copy_context().run, fn, *args))
+
+    def start(self, view):
+        """before_request hooks, the login check, then `view()` -> (result, error response).
+
+        Returns (result, None) to continue the turn, or (None, final Flask response).
+        """
+        try:
+            rv = self.app.preprocess_request()
+            if rv is None and not current_user.is_authenticated:
+                rv = self.app.login_manager.unauthorized()
+            if rv is None:
+                result, rv = view()
+                if rv is None:
+                    return result, None
+            return None, self.finalize(rv)
+        except Exception as e:
+            return None, self.error_response(e)
+        finally:
+            _release_db()
+
+    def finalize(self, rv):
+        """make_response + after_request hooks, as Flask's full_dispatch_request does."""
+        try:
+            return self.app.finalize_request(rv)
+        except Exception as e:
+            return self.app.handle_exception(e)
+
+    def error_response(self, error):
+        """Runs Flask's error handlers (e.g. the chatbot blueprint's 429 for LLMCapacityError)."""
+        db.session.rollback()
+        try:
+            return self.app.finalize_request(self.app.handle_user_exception(error))
+        except Exception as e:
+            return self.app.handle_exception(e)
+
+    def call(self, view):
+        """Runs `view()` and releases the DB session; for phases whose result is not a response."""
+        try:
+            return view()
+        finally:
+            _release_db()
+
+    def finish(self, view):
+        """Final sync phase: `view()` returns the view's return value, which becomes the Flask response."""
+        try:
+            return self.finalize(view())
+        except Exception as e:
+            return self.error_response(e)
+        finally:
+            _release_db()
+
+
+def to_asgi_response(flask_response):
+    from starlette.responses import Response
+    response = Response(content=flask_response.get_data(), status_code=flask_response.status_code)
+    response.raw_headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in flask_response.headers.items()]
+    return response
+
+
+def sse_asgi_response(frames, flask_response):
+    """Streams async SSE `frames` with the headers (session cookie, metrics) of the finalized `flask_response`."""
+    from starlette.responses import StreamingResponse
+    response = StreamingResponse(frames, media_type='text/event-stream')
+    response.raw_headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                            for name, value in flask_response.headers.items() if name.lower() not in ('content-length', 'content-type')]
+    response.raw_headers += [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                             (b'x-accel-buffering', b'no')]
+    return response
+
+
+async def customer_chat(request):
+    flask_app = request.app.state.flask_app
+    turn_context = await FlaskTurnContext.from_request(flask_app, request)
+    async with turn_context:
+        data = turn_context.context.request.get_json(silent=True)
+        turn, error_response = await turn_context.run(turn_context.start, lambda: prepare_customer_turn(data))
+        if error_response is not None:
+            return to_asgi_response(error_response)
+
+        if turn.cached_answer is not None and turn.stream:
+            payload = await turn_context.run(turn_context.call, lambda: finish_customer_turn(turn, turn.cached_answer))
+            frames = _iterate([_sse_event('token', {"token": turn.cached_answer}), _sse_event('done', payload)])
+            return sse_asgi_response(frames, await turn_context.run(turn_context.finalize, ("", 200)))
+        if turn.stream:
+            return await _stream_customer_turn(turn_context, turn)
+
+        bot_response_text = turn.cached_answer
+        if bot_response_text is None:
+            prompt = turn.prompt
+            try:
+                bot_response_text = await async_query_llm_groq(prompt.prompt, system_message=prompt.system,
+                                                               max_tokens=prompt.max_tokens, company_id=turn.company_id)
+            except LLMCapacityError as e:
+                return to_asgi_response(await turn_context.run(turn_context.error_response, e))
+        return to_asgi_response(await turn_context.run(turn_context.finish,
+                                                       lambda: jsonify(finish_customer_turn(turn, bot_response_text))))
+
+
+async def _iterate(frames):
+    for frame in frames:
+        yield frame
+
+
+async def _stream_customer_turn(turn_context, turn):
+    """Streams LLM tokens as SSE; the turn is finished (ticket logic, bot message) in a fresh request context."""
+    prompt = turn.prompt
+    tokens = async_stream_llm_groq(prompt.prompt, system_message=prompt.system, max_tokens=prompt.max_tokens,
+                                   company_id=turn.company_id)
+    try:
+        first_token = await tokens.__anext__() # Capacity errors surface here, while a 429 is still possible
+    except StopAsyncIteration:
+        first_token = None
+    except LLMCapacityError as e:
+        return to_asgi_response(await turn_context.run(turn_context.error_response, e))
+    headers_response = await turn_context.run(turn_context.finalize, ("", 200))
+    environ = turn_context.context.request.environ
+
+    async def frames():
+        chunks = []
+        try:
+            if first_token is not None:
+                chunks.append(first_token)
+                yield _sse_event('token', {"token": first_token})
+                async for token in tokens:
+                    chunks.append(token)
+                    yield _sse_event('token', {"token": token})
+        finally:
+            await tokens.aclose()
+        # The handler's request context is gone by the time the body streams; finish in a new one.
+        async with FlaskTurnContext(turn_context.app, environ) as finish_context:
+            payload = await finish_context.run(finish_context.call, lambda: finish_streamed_customer_turn(turn, "".join(chunks).strip()))
+        yield _sse_event('done', payload)
+
+    return sse_asgi_response(frames(), headers_response)
+
+
+async def agent_assist(request):
+    flask_app = request.app.state.flask_app
+    turn_context = await FlaskTurnContext.from_request(flask_app, request)
+    async with turn_context:
+        data = turn_context.context.request.get_json(silent=True) or {}
+        prepared, error_response = await turn_context.run(turn_context.start, lambda: prepare_agent_assist(data))
+        if error_response is not None:
+            return to_asgi_response(error_response)
+        prompt, retrieved_kb_count, company_id = prepared
+
+        if data.get('stream'):
+            tokens = async_stream_llm_groq(prompt.prompt, system_message=prompt.system, max_tokens=prompt.max_tokens,
+                                           company_id=company_id)
+            try:
+                first_token = await tokens.__anext__()
+            except StopAsyncIteration:
+                first_token = None
+            except LLMCapacityError as e:
+                return to_asgi_response(await turn_context.run(turn_context.error_response, e))
+
+            async def frames():
+                try:
+                    if first_token is not None:
+                        yield _sse_event('token', {"token": first_token})
+                        async for token in tokens:
+                            yield _sse_event('token', {"token": token})
+                finally:
+                    await tokens.aclose()
+                yield _sse_event('done', {"retrieved_kb_count": retrieved_kb_count})
+            return sse_asgi_response(frames(), await turn_context.run(turn_context.finalize, ("", 200)))
+
+        try:
+            assist_response = await async_query_llm_groq(prompt.prompt, system_message=prompt.system,
+                                                         max_tokens=prompt.max_tokens, company_id=company_id)
+        except LLMCapacityError as e:
+            return to_asgi_response(await turn_context.run(turn_context.error_response, e))
+        payload = {"suggestion": assist_response, "retrieved_kb_count": retrieved_kb_count}
+        return to_asgi_response(await turn_context.run(turn_context.finish, lambda: jsonify(payload)))
+
+
+def create_asgi_app(flask_app):
+    """ASGI app serving the chat endpoints asynchronously and everything else through Flask."""
+    from asgiref.wsgi import WsgiToAsgi
+    from starlette.applications import Starlette
+    from starlette.routing import Mount, Route
+
+    prefix = '/chat'
+    asgi_app = Starlette(routes=[
+        Route(f'{prefix}/customer_chat', customer_chat, methods=['POST']),
+        Route(f'{prefix}/agent_assist', agent_assist, methods=['POST']),
+        Mount('/', app=WsgiToAsgi(flask_app)),
+    ])
+    asgi_app.state.flask_app = flask_app
+    return asgi_app
@@ -0,0 +1,113 @@
+"""Rolling per-session summaries that keep customer chat prompts small.
+
+The customer chat prompt is built from the session's stored summary plus the
+raw messages that have not been folded into it yet. After a turn, once more
+than CHAT_RECENT_MESSAGES unsummarized messages have piled up by at least
+CHAT_SUMMARY_BATCH_MESSAGES, a background job asks the LLM to fold the older
+ones into the summary, leaving only the most recent turns verbatim. Long
+sessions keep their early context at a bounded prompt size. A session has at
+most one summarization job queued or running at a time.
+"""
+import json
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from .models import db, ChatMessage, ChatSessionSummary, BackgroundJob
+from .jobs import add_job, register_job_handler
+from .utils import query_llm_groq, count_tokens
+from .prompts import PromptBuilder
+
+SUMMARY_SYSTEM_PROMPT = ("You maintain a running summary of a customer support chat. Merge the new messages into the "
+                         "current summary. Keep the customer's problem, details they gave (products, error codes, "
+                         "order numbers), what was already suggested or tried, and any open questions. Write at most "
+                         "a short paragraph in the third person; no preamble.")
+SUMMARY_JOB_STALE_AFTER = timedelta(minutes=10) # A job still 'running' after this is assumed lost with its worker
+
+
+def load_session_context(session_id, company_id):
+    """Returns (summary, messages): the session summary ('' if none) and the unsummarized messages, oldest first.
+
+    At most CHAT_MAX_CONTEXT_MESSAGES raw messages are returned, newest kept.
+    """
+    max_messages = current_app.config['CHAT_MAX_CONTEXT_MESSAGES']
+    summary_row = None
+    if current_app.config.get('CHAT_SUMMARY_ENABLED'):
+        summary_row = db.session.get(ChatSessionSummary, session_id)
+        if summary_row and summary_row.company_id != company_id:
+            summary_row = None
+    query = ChatMessage.query.filter_by(session_id=session_id, company_id=company_id)
+    if summary_row:
+        query = query.filter(ChatMessage.id > summary_row.summarized_until_id)
+    messages = query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(max_messages).all()
+    messages.reverse()
+    return (summary_row.summary if summary_row else ''), messages
+
+
+def schedule_summary_if_needed(session_id, company_id):
+    """Adds a summarization job once enough messages sit outside the recent window; returns it, or None.
+
+    The job joins the caller's transaction (see `jobs.add_job`); dispatch it after committing.
+    """
+    config = current_app.config
+    if not config.get('CHAT_SUMMARY_ENABLED'):
+        return None
+    summary_row = db.session.get(ChatSessionSummary, session_id)
+    summarized_until_id = summary_row.summarized_until_id if summary_row else 0
+    unsummarized = ChatMessage.query.filter(ChatMessage.session_id == session_id, ChatMessage.company_id == company_id,
+                                            ChatMessage.id > summarized_until_id).count()
+    if unsummarized - config['CHAT_RECENT_MESSAGES'] < config['CHAT_SUMMARY_BATCH_MESSAGES']:
+        return None
+    payload = {'session_id': session_id}
+    if summary_job_pending(company_id, payload):
+        return None # It folds in everything up to the recent window when it runs, including this turn
+    return add_job('summarize_chat_session', company_id=company_id, payload=payload)
+
+
+def summary_job_pending(company_id, payload):
+    """True if a summarization job for the same session is queued or running (and not stale)."""
+    return db.session.query(BackgroundJob.id).filter(
+        BackgroundJob.job_type == 'summarize_chat_session', BackgroundJob.status.in_(('queued', 'running')),
+        BackgroundJob.company_id == company_id, BackgroundJob.payload == json.dumps(payload),
+        BackgroundJob.created_at >= datetime.utcnow() - SUMMARY_JOB_STALE_AFTER).first() is not None
+
+
+@register_job_handler('summarize_chat_session')
+def summarize_chat_session_job(job, payload):
+    """Folds every message older than the recent window into the session's rolling summary."""
+    session_id = payload['session_id']
+    summary_row = db.session.get(ChatSessionSummary, session_id)
+    summarized_until_id = summary_row.summarized_until_id if summary_row else 0
+    messages = ChatMessage.query.filter(ChatMessage.session_id == session_id, ChatMessage.company_id == job.company_id,
+                                        ChatMessage.id > summarized_until_id).order_by(ChatMessage.id).all()
+    to_fold = messages[:max(len(messages) - current_app.config['CHAT_RECENT_MESSAGES'], 0)]
+    if not to_fold:
+        return {"skipped": "nothing to summarize"}
+
+    current_summary = summary_row.summary if summary_row else ''
+    transcript = [f"{message.sender_type}: {message.message_text}\n" for message in to_fold]
+    builder = PromptBuilder('chat_summary', system=SUMMARY_SYSTEM_PROMPT, max_tokens=current_app.config['CHAT_SUMMARY_MAX_TOKENS'])
+    builder.text("Current summary:\n")
+    builder.add('summary', current_summary, priority=2, empty_text="(none yet)")
+    builder.add('history', transcript, priority=1, keep='tail', prefix="\n\nNew messages:\n", separator="")
+    builder.text("\nUpdated summary:")
+    prompt = builder.build()
+    new_summary = query_llm_groq(prompt.prompt, system_message=prompt.system, temperature=0.2, max_tokens=prompt.max_tokens,
+                                 company_id=job.company_id)
+    if new_summary.startswith("Error:"):
+        raise RuntimeError(new_summary) # Retried by the job queue (as is LLMCapacityError); the prompt keeps the raw messages meanwhile
+
+    # Another job may have folded these messages while the LLM was busy; keep whichever got there first.
+    db.session.expire_all()
+    summary_row = db.session.get(ChatSessionSummary, session_id)
+    if (summary_row.summarized_until_id if summary_row else 0) != summarized_until_id:
+        return {"skipped": "summary already advanced"}
+    if summary_row is None:
+        summary_row = ChatSessionSummary(session_id=session_id, company_id=job.company_id)
+        db.session.add(summary_row)
+    summary_row.summary = new_summary
+    summary_row.summarized_until_id = to_fold[-1].id
+    summary_row.summary_tokens = count_tokens(new_summary)
+    db.session.commit()
+    return {"folded_messages": len(to_fold), "summary_tokens": summary_row.summary_tokens,
+            "prompt_tokens": prompt.tokens['total']}
@@ -1,96 +1,206 @@
-from flask import Blueprint, request, jsonify, current_app, session
+from flask import Blueprint, request, jsonify, current_app, session, Response, stream_with_context
 from flask_login import current_user, login_required
 import uuid
+import json
+from dataclasses import dataclass
 from datetime import datetime
 
-from .knowledge_base import init_chroma_client, get_chroma_embedding_function, get_company_collection
-from .utils import query_llm_groq 
+from .knowledge_base import get_chroma_embedding_function, get_kb_search_collection
+from .utils import query_llm_groq, stream_llm_groq
+from .llm_limits import LLMCapacityError, LLMSlot
+from .jobs import add_job, dispatch_jobs
+from .ticketing import DEFAULT_TICKET_CATEGORY, DEFAULT_TICKET_PRIORITY
+from .semantic_cache import get_cached_answer, store_cached_answer
+from .retrieval import retrieve_kb_context
+from .metrics import stage, timed_stage
+from .prompts import PromptBuilder, BuiltPrompt
+from .chat_summary import load_session_context, schedule_summary_if_needed
 from .models import db, ChatMessage, Company, Ticket, User, KnowledgeItem
 # No Pinecone exceptions needed
 
 chatbot_bp = Blueprint('chatbot', __name__)
 
-MAX_CONTEXT_MESSAGES = 10
+HANDOFF_REQUEST_PHRASES = ["talk to human", "speak to agent", "escalate", "human help"]
 
-@chatbot_bp.route('/customer_chat', methods=['POST'])
-@login_required
-def customer_chat_endpoint():
+
+def _sse_event(event, payload):
+    """Formats one Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+@chatbot_bp.errorhandler(LLMCapacityError)
+def _llm_capacity_exceeded(error):
+    """LLM concurrency limits (core/llm_limits.py) surface as 429 with Retry-After."""
+    response = jsonify({"error": str(error), "retry_after": error.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def _sse_response(generator):
+    """Wraps a generator of SSE frames in a streaming response that proxies won't buffer."""
+    return Response(stream_with_context(generator), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@dataclass
+class CustomerTurn:
+    """A customer chat turn up to the LLM call, as plain data, so the async path (core/chat_async.py)
+    can finish it in another thread and app context."""
+    company_id: int
+    session_id: str
+    user_message: str
+    received_at: datetime
+    history_ids: list
+    session_summary: str
+    stream: bool
+    query_embedding: list = None
+    kb_version: int = 0 # Company.kb_version the KB was read at; keys the semantic cache
+    cacheable: bool = False
+    cached_answer: str = None
+    prompt: BuiltPrompt = None
+
+
+def prepare_customer_turn(data):
+    """Validates a customer chat request, then runs retrieval and prompt assembly. Writes nothing;
+    the customer message is saved with the reply in `_complete_customer_turn`.
+
+    Returns (turn, None), or (None, error response). `turn.cached_answer` is set on a semantic cache hit.
+    """
     if current_user.role != 'customer':
-        return jsonify({"error": "Access denied"}), 403
+        return None, (jsonify({"error": "Access denied"}), 403)
 
-    data = request.get_json()
+    data = data or {}
     user_message = data.get('message')
     chat_session_id = data.get('session_id')
 
-    if not user_message: return jsonify({"error": "No message provided"}), 400
+    if not user_message: return None, (jsonify({"error": "No message provided"}), 400)
     if not chat_session_id: chat_session_id = str(uuid.uuid4())
 
     company_id = current_user.company_id
-    if not company_id: return jsonify({"error": "User not associated with a company"}), 400
+    if not company_id: return None, (jsonify({"error": "User not associated with a company"}), 400)
     
     company = db.session.get(Company, company_id)
     if not company: 
-        return jsonify({"error": "Company not configured"}), 500
+        return None, (jsonify({"error": "Company not configured"}), 500)
 
-    db_user_message = ChatMessage(company_id=company_id, user_id=current_user.id, session_id=chat_session_id, sender_type='customer', message_text=user_message)
-    db.session.add(db_user_message)
-    db.session.commit()
+    with stage('history_load'):
+        # Older turns come from the rolling session summary; only unsummarized messages are loaded raw.
+        session_summary, chat_history = load_session_context(chat_session_id, company_id)
 
+    turn = CustomerTurn(company_id=company_id, session_id=chat_session_id, user_message=user_message,
+                        received_at=datetime.utcnow(), history_ids=[msg.id for msg in chat_history],
+                        session_summary=session_summary, stream=bool(data.get('stream')), kb_version=company.kb_version or 0)
     relevant_docs_texts = []
-    chroma_client = init_chroma_client()
-    st_embedding_function = get_chroma_embedding_function()
-
-    if chroma_client and st_embedding_function:
-        collection = get_company_collection(chroma_client, company.id, st_embedding_function)
-        if collection:
-            try:
-                # Chroma will use its configured EF (SentenceTransformer) to embed the query_texts
-                results = collection.query(
-                    query_texts=[user_message], # Text to be embedded by Chroma for query
-                    n_results=3,
-                    include=['documents', 'metadatas'] 
-                )
-                
-                if results and results.get('documents') and results['documents'][0]:
-                    # `results['documents'][0]` contains the original text that was stored and embedded
-                    # `results['metadatas'][0]` contains the corresponding metadata
-                    for doc_text, metadata in zip(results['documents'][0], results['metadatas'][0]):
-                        title = metadata.get('title', 'N/A')
-                        # The 'doc_text' is the full "Title: ... Content: ..." string we added.
-                        # We can use this directly or reconstruct from metadata if preferred.
-                        # For simplicity, let's use the retrieved doc_text.
-                        relevant_docs_texts.append(doc_text) 
-                        # Or if you want to be more precise from metadata:
-                        # content = "Content not found in metadata." # Placeholder
-                        # item_db_id_meta = metadata.get('item_db_id')
-                        # if item_db_id_meta:
-                        #     kb_item = db.session.get(KnowledgeItem, int(item_db_id_meta))
-                        #     if kb_item: content = kb_item.content
-                        # relevant_docs_texts.append(f"Title: {title}\nContent: {content}")
-
-            except Exception as e:
-                current_app.logger.error(f"Error querying ChromaDB for company {company.id}: {e}")
-        else:
-             current_app.logger.warning(f"ChromaDB collection not found for company {company.id} during customer chat.")
+    # None means keyword-only retrieval (embedding backend cold/unavailable or KB_RETRIEVAL_MODE='keyword').
+    collection = get_kb_search_collection(company.id)
+
+    if collection:
+        try:
+            # Embed once: the vector serves both the semantic answer cache and the Chroma query.
+            with stage('embed'):
+                turn.query_embedding = get_chroma_embedding_function()([user_message])[0]
+        except Exception as e:
+            current_app.logger.error(f"Error embedding customer query for company {company.id}: {e}")
+        # Only the opening question of a session is answered from / stored in the semantic cache,
+        # since later answers depend on the earlier turns.
+        turn.cacheable = turn.query_embedding is not None and not chat_history and not session_summary
+        if turn.cacheable:
+            with stage('cache_lookup'):
+                turn.cached_answer = get_cached_answer(company.id, turn.query_embedding, kb_version=turn.kb_version)
+                if turn.cached_answer is not None:
+                    return turn, None
     else:
-        current_app.logger.warning("ChromaDB client or embedding function not available for customer chat.")
+        current_app.logger.info(f"Keyword-only KB retrieval for company {company.id} (embedding backend not ready).")
 
-    chat_history = ChatMessage.query.filter_by(session_id=chat_session_id, company_id=company_id)\
-                                    .order_by(ChatMessage.timestamp.desc()).limit(MAX_CONTEXT_MESSAGES).all()
-    chat_history.reverse()
-    context_str = "\nPrevious conversation:\n" + "".join([f"{msg.sender_type}: {msg.message_text}\n" for msg in chat_history])
+    try:
+        # Keyword + Chroma hits fused by rank, grouped by parent item and trimmed to KB_CONTEXT_TOKEN_BUDGET.
+        relevant_docs_texts = retrieve_kb_context(company.id, user_message, collection=collection,
+                                                  query_embedding=turn.query_embedding, max_items=3)
+    except Exception as e:
+        current_app.logger.error(f"Error retrieving KB context for company {company.id}: {e}")
 
-    kb_context = "\n\nRelevant information from our knowledge base:\n" + "\n---\n".join(relevant_docs_texts) if relevant_docs_texts else "\nNo specific knowledge base articles found for this query."
-    
+    config = current_app.config
     system_prompt = f"You are a helpful customer support assistant for {company.name}. Answer based on KB and history. If unable, or customer asks for human, suggest creating a ticket."
-    full_prompt = f"{context_str}\nCustomer: {user_message}\n{kb_context}\nAssistant:"
-    
-    bot_response_text = query_llm_groq(full_prompt, system_message=system_prompt)
-    
+    builder = PromptBuilder('customer_chat', system=system_prompt, max_tokens=config['CHAT_REPLY_MAX_TOKENS'])
+    # Lowest priority is cut first: oldest raw turns, then the summary, then KB passages; the question last.
+    builder.add('summary', session_summary, budget=config['CHAT_SUMMARY_MAX_TOKENS'] * 2, priority=2,
+                prefix="\nSummary of the earlier conversation:\n", suffix="\n")
+    history_lines = [f"{msg.sender_type}: {msg.message_text}\n" for msg in chat_history] + [f"customer: {user_message}\n"] # Not saved yet
+    builder.add('history', history_lines, budget=config['PROMPT_HISTORY_TOKENS'],
+                priority=1, keep='tail', prefix="\nPrevious conversation:\n", separator="")
+    builder.add('user_input', user_message, budget=config['PROMPT_USER_INPUT_TOKENS'], priority=4, prefix="\nCustomer: ", suffix="\n")
+    builder.add('kb', relevant_docs_texts, priority=3, prefix="\n\nRelevant information from our knowledge base:\n", separator="\n---\n",
+                empty_text="\nNo specific knowledge base articles found for this query.")
+    builder.text("\nAssistant:")
+    turn.prompt = builder.build()
+    return turn, None
+
+
+def finish_customer_turn(turn, bot_response_text):
+    """Caches the answer, runs handoff/ticket logic and saves the bot reply. Returns the response payload."""
+    if turn.cacheable and turn.cached_answer is None:
+        store_cached_answer(turn.company_id, turn.query_embedding, turn.user_message, bot_response_text,
+                            kb_version=turn.kb_version)
+    payload = _complete_customer_turn(turn, bot_response_text)
+    if turn.cached_answer is not None:
+        payload["answer_cached"] = True
+    return payload
+
+
+def finish_streamed_customer_turn(turn, bot_response_text):
+    """finish_customer_turn for a stream whose tokens are already sent: failures become an error payload."""
+    try:
+        return finish_customer_turn(turn, bot_response_text)
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error finalizing streamed chat turn for session {turn.session_id}: {e}")
+        return {"error": "Could not save this chat turn."}
+
+
+@chatbot_bp.route('/customer_chat', methods=['POST'])
+@login_required
+def customer_chat_endpoint():
+    turn, error_response = prepare_customer_turn(request.get_json())
+    if error_response:
+        return error_response
+
+    if turn.cached_answer is not None:
+        payload = finish_customer_turn(turn, turn.cached_answer)
+        if turn.stream:
+            return _sse_response(iter([_sse_event('token', {"token": turn.cached_answer}), _sse_event('done', payload)]))
+        return jsonify(payload)
+
+    prompt = turn.prompt
+    if turn.stream:
+        llm_slot = LLMSlot(turn.company_id) # Reserved now so a full queue is a 429, not an error mid-stream
+        def generate():
+            chunks = []
+            for token in stream_llm_groq(prompt.prompt, system_message=prompt.system, max_tokens=prompt.max_tokens, slot=llm_slot):
+                chunks.append(token)
+                yield _sse_event('token', {"token": token})
+            yield _sse_event('done', finish_streamed_customer_turn(turn, "".join(chunks).strip()))
+        return _sse_response(generate())
+
+    bot_response_text = query_llm_groq(prompt.prompt, system_message=prompt.system, max_tokens=prompt.max_tokens,
+                                       company_id=turn.company_id)
+    return jsonify(finish_customer_turn(turn, bot_response_text))
+
+
+@timed_stage('persist_turn')
+def _complete_customer_turn(turn, bot_response_text):
+    """Runs handoff/ticket logic for a finished bot reply, persists the turn and returns the
+    response payload. Shared by the JSON, streaming and async paths.
+
+    The customer message, any ticket change and the bot message are written in one transaction,
+    after the handoff lookups, so the write lock is held briefly. Follow-up jobs join the
+    transaction and are queued only after it commits.
+    """
+    user_message, chat_session_id, company_id, session_summary = turn.user_message, turn.session_id, turn.company_id, turn.session_summary
+    db_user_message = ChatMessage(company_id=company_id, user_id=current_user.id, session_id=chat_session_id, sender_type='customer',
+                                  message_text=user_message, timestamp=turn.received_at)
+    jobs = []
     ticket = None 
     handoff_triggered = False
     # ... (Handoff logic from previous version - should largely work, ensure db.session.get is used for Ticket)
-    if any(phrase in user_message.lower() for phrase in ["talk to human", "speak to agent", "escalate", "human help"]) or \
+    if any(phrase in user_message.lower() for phrase in HANDOFF_REQUEST_PHRASES) or \
        any(phrase in bot_response_text.lower() for phrase in ["create a ticket", "human agent", "support ticket"]):
         
         linked_ticket_from_chat_history = ChatMessage.query.filter_by(session_id=chat_session_id, ticket_id=db.not_(None)).first()
@@ -114,26 +224,24 @@ def customer_chat_endpoint():
             if not ticket: 
                 ticket_subject = f"Chat Handoff: {user_message[:50]}"
                 ticket_description = f"Chat session ID: {chat_session_id}\nInitial query: {user_message}\n"
+                if session_summary:
+                    ticket_description += f"\n--- Summary of earlier chat ---\n{session_summary}\n"
                 history_for_ticket = ""
+                chat_history = ChatMessage.query.filter(ChatMessage.id.in_(turn.history_ids))\
+                                                .order_by(ChatMessage.timestamp, ChatMessage.id).all()
                 for msg in chat_history: 
                     history_for_ticket += f"{msg.sender_type.capitalize()} ({msg.timestamp.strftime('%H:%M:%S')}): {msg.message_text}\n"
                 if db_user_message.message_text not in history_for_ticket: 
                     history_for_ticket += f"Customer ({db_user_message.timestamp.strftime('%H:%M:%S')}): {db_user_message.message_text}\n"
                 ticket_description += f"\n--- Chat History ---\n{history_for_ticket}"
-                categorization_prompt = f"Based on the following customer query, suggest a category (e.g., Billing, Technical Support, Product Inquiry) and priority (Low, Medium, High) for a support ticket: \"{user_message}\""
-                category_suggestion = query_llm_groq(categorization_prompt, system_message="You are a ticket categorization assistant.")
-                suggested_category = "General Inquiry" 
-                suggested_priority = "Medium" 
-                try:
-                    if "category:" in category_suggestion.lower(): 
-                        cat_part = category_suggestion.lower().split("category:")[1]
-                        suggested_category = cat_part.split("priority:")[0].split(",")[0].strip().title()
-                    if "priority:" in category_suggestion.lower(): 
-                        suggested_priority = category_suggestion.lower().split("priority:")[1].strip().title()
-                except Exception: pass
-                ticket = Ticket(customer_id=current_user.id, company_id=company_id, subject=ticket_subject, description=ticket_description, status='Open', priority=suggested_priority, category=suggested_category, chat_history_reference=chat_session_id)
+                ticket = Ticket(customer_id=current_user.id, company_id=company_id, subject=ticket_subject, description=ticket_description, status='Open', priority=DEFAULT_TICKET_PRIORITY, category=DEFAULT_TICKET_CATEGORY, chat_history_reference=chat_session_id)
                 db.session.add(ticket)
-                db.session.commit() 
+                db.session.flush() # For ticket.id
+                # Category/priority are suggested by the LLM off the request path.
+                jobs.append(add_job('categorize_ticket', ticket_id=ticket.id, company_id=company_id, payload={'text': user_message}))
+                jobs.append(add_job('refresh_ticket_suggestions', ticket_id=ticket.id, company_id=company_id))
+                if current_app.config['TICKET_SIMILARITY_ENABLED']:
+                    jobs.append(add_job('index_ticket', ticket_id=ticket.id, company_id=company_id))
                 ChatMessage.query.filter_by(session_id=chat_session_id).update({"ticket_id": ticket.id})
                 bot_response_text += f"\n\nA support ticket (ID: {ticket.id}) has been created for you."
                 handoff_triggered = True
@@ -146,59 +254,78 @@ def customer_chat_endpoint():
         if ticket: 
              db_user_message.ticket_id = ticket.id
 
+    db.session.add(db_user_message)
     db_bot_message = ChatMessage(company_id=company_id, user_id=None, ticket_id=ticket.id if ticket else None, session_id=chat_session_id, sender_type='bot', message_text=bot_response_text)
     db.session.add(db_bot_message)
+    try:
+        summary_job = schedule_summary_if_needed(chat_session_id, company_id)
+        if summary_job:
+            jobs.append(summary_job)
+    except Exception as e:
+        current_app.logger.error(f"Could not schedule chat summary for session {chat_session_id}: {e}")
     db.session.commit()
+    dispatch_jobs(jobs)
 
-    return jsonify({"bot_response": bot_response_text, "session_id": chat_session_id, "ticket_id": ticket.id if ticket else None, "handoff_triggered": handoff_triggered})
+    return {"bot_response": bot_response_text, "session_id": chat_session_id, "ticket_id": ticket.id if ticket else None, "handoff_triggered": handoff_triggered}
 
 
-@chatbot_bp.route('/agent_assist', methods=['POST'])
-@login_required
-def agent_assist_endpoint():
-    if current_user.role != 'agent': return jsonify({"error": "Access denied"}), 403
+def prepare_agent_assist(data):
+    """Validates an agent copilot request and builds its prompt.
 
-    data = request.get_json()
+    Returns ((prompt, kb_count, company_id), None), or (None, error response).
+    """
+    if current_user.role != 'agent': return None, (jsonify({"error": "Access denied"}), 403)
+
+    data = data or {}
     current_conversation = data.get('conversation_context')
     agent_query = data.get('agent_query')
     
-    if not current_conversation and not agent_query: return jsonify({"error": "No context or query"}), 400
+    if not current_conversation and not agent_query: return None, (jsonify({"error": "No context or query"}), 400)
 
     company_id = current_user.company_id
     company = db.session.get(Company, company_id)
     if not company: 
-        return jsonify({"error": "Company not configured"}), 500
+        return None, (jsonify({"error": "Company not configured"}), 500)
 
     relevant_docs_texts = []
-    chroma_client = init_chroma_client()
-    st_embedding_function = get_chroma_embedding_function()
-    
     search_text = agent_query if agent_query else current_conversation[-200:]
 
-    if chroma_client and st_embedding_function:
-        collection = get_company_collection(chroma_client, company.id, st_embedding_function)
-        if collection:
-            try:
-                results = collection.query(
-                    query_texts=[search_text], 
-                    n_results=3,
-                    include=['documents', 'metadatas']
-                )
-                if results and results.get('documents') and results['documents'][0]:
-                    for doc_text, metadata in zip(results['documents'][0], results['metadatas'][0]):
-                        relevant_docs_texts.append(doc_text)
-            except Exception as e:
-                current_app.logger.error(f"Error querying ChromaDB for agent assist: {e}")
-        else:
-            current_app.logger.warning(f"ChromaDB collection not found for company {company.id} during agent assist.")
-    else:
-        current_app.logger.warning("ChromaDB client or embedding function not available for agent assist.")
+    try:
+        relevant_docs_texts = retrieve_kb_context(company.id, search_text, collection=get_kb_search_collection(company.id), max_items=3)
+    except Exception as e:
+        current_app.logger.error(f"Error retrieving KB context for agent assist: {e}")
 
-    kb_context = "\n\nRelevant Knowledge Base Articles:\n" + "\n---\n".join(relevant_docs_texts) if relevant_docs_texts else "\nNo specific knowledge base articles found for this query."
-    
+    config = current_app.config
     system_prompt = f"You are an AI assistant for support agents at {company.name}. Help agent with customer issues using provided conversation, agent's query, and KB articles. Be concise and provide actionable suggestions or information."
-    prompt = f"Current Customer Conversation (if any):\n{current_conversation}\n\nAgent's Specific Request: {agent_query if agent_query else 'General assistance based on conversation.'}\n{kb_context}\n\nAI Copilot Suggestion:"
-    
-    assist_response = query_llm_groq(prompt, system_message=system_prompt, max_tokens=300)
+    builder = PromptBuilder('agent_assist', system=system_prompt, max_tokens=config['AGENT_ASSIST_MAX_TOKENS'])
+    # conversation_context is pasted by the agent and unbounded: keep its most recent part.
+    builder.text("Current Customer Conversation (if any):\n")
+    builder.add('conversation', current_conversation or "", budget=config['PROMPT_CONVERSATION_TOKENS'], priority=1, keep='tail')
+    builder.add('user_input', agent_query or 'General assistance based on conversation.', budget=config['PROMPT_USER_INPUT_TOKENS'],
+                priority=3, prefix="\n\nAgent's Specific Request: ", suffix="\n")
+    builder.add('kb', relevant_docs_texts, priority=2, prefix="\n\nRelevant Knowledge Base Articles:\n", separator="\n---\n",
+                empty_text="\nNo specific knowledge base articles found for this query.")
+    builder.text("\n\nAI Copilot Suggestion:")
+    return (builder.build(), len(relevant_docs_texts), company_id), None
+
+
+@chatbot_bp.route('/agent_assist', methods=['POST'])
+@login_required
+def agent_assist_endpoint():
+    data = request.get_json()
+    prepared, error_response = prepare_agent_assist(data)
+    if error_response:
+        return error_response
+    prompt, retrieved_kb_count, company_id = prepared
+
+    if data.get('stream'):
+        llm_slot = LLMSlot(company_id)
+        def generate():
+            for token in stream_llm_groq(prompt.prompt, system_message=prompt.system, max_tokens=prompt.max_tokens, slot=llm_slot):
+                yield _sse_event('token', {"token": token})
+            yield _sse_event('done', {"retrieved_kb_count": retrieved_kb_count})
+        return _sse_response(generate())
+
+    assist_response = query_llm_groq(prompt.prompt, system_message=prompt.system, max_tokens=prompt.max_tokens, company_id=company_id)
 
-    return jsonify({"suggestion": assist_response, "retrieved_kb_count": len(relevant_docs_texts)})
+    return jsonify({"suggestion": assist_response, "retrieved_kb_count": retrieved_kb_count})
@@ -0,0 +1,85 @@
+"""Database engine setup: connection pool sizing and SQLite pragmas.
+
+`init_database` replaces a bare `db.init_app(app)` in create_app. Before the
+engine is built, it fills SQLALCHEMY_ENGINE_OPTIONS from the DB_POOL_* settings.
+Server databases (Postgres) get a sized pool with pre-ping and recycling;
+SQLite files get a sized pool only. Options already set in
+SQLALCHEMY_ENGINE_OPTIONS take precedence.
+
+For SQLite it also sets per-connection pragmas as each connection opens:
+- journal_mode=WAL, so readers no longer block the writer (or each other);
+- synchronous=NORMAL, which is safe in WAL mode and saves an fsync per commit;
+- busy_timeout, so a writer waits for the lock instead of failing at once;
+- cache_size, the page cache per connection.
+WAL needs a writable directory for its -wal/-shm files. If the database is
+read-only (e.g. bundled into a serverless image), the journal mode is left
+unchanged and a warning is logged.
+"""
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from .models import db
+
+
+def _is_sqlite(url):
+    return url.get_backend_name() == 'sqlite'
+
+
+def _is_memory_sqlite(url):
+    return _is_sqlite(url) and (url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory')
+
+
+def engine_options(config):
+    """The SQLALCHEMY_ENGINE_OPTIONS for the configured database, explicit settings winning."""
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    options = {}
+    if not _is_memory_sqlite(url): # In-memory SQLite uses a single static connection
+        options.update(pool_size=config['DB_POOL_SIZE'], max_overflow=config['DB_MAX_OVERFLOW'],
+                       pool_timeout=config['DB_POOL_TIMEOUT_SECONDS'])
+    if not _is_sqlite(url):
+        options.update(pool_pre_ping=config['DB_POOL_PRE_PING'], pool_recycle=config['DB_POOL_RECYCLE_SECONDS'])
+    options.update(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    return options
+
+
+def sqlite_pragmas(config):
+    """(pragma, value) pairs applied to every new SQLite connection."""
+    pragmas = []
+    if config.get('SQLITE_WAL_ENABLED'):
+        pragmas.append(('journal_mode', 'WAL'))
+    if config.get('SQLITE_SYNCHRONOUS'):
+        pragmas.append(('synchronous', config['SQLITE_SYNCHRONOUS']))
+    pragmas.append(('busy_timeout', int(config['SQLITE_BUSY_TIMEOUT_MS'])))
+    if config.get('SQLITE_CACHE_SIZE_KB'):
+        pragmas.append(('cache_size', -int(config['SQLITE_CACHE_SIZE_KB']))) # Negative: KiB rather than pages
+    return pragmas
+
+
+def _register_sqlite_pragmas(app, engine):
+    pragmas = sqlite_pragmas(app.config)
+    warned = []
+
+    @event.listens_for(engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas:
+                try:
+                    cursor.execute(f"PRAGMA {name}={value}")
+                except sqlite3.OperationalError as e:
+                    if not warned:
+                        warned.append(name)
+                        app.logger.warning(f"Could not set SQLite PRAGMA {name}={value}: {e}")
+        finally:
+            cursor.close()
+
+
+def init_database(app):
+    """Configures the engine options, initializes Flask-SQLAlchemy and registers the SQLite pragmas."""
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    db.init_app(app)
+    if _is_sqlite(make_url(app.config['SQLALCHEMY_DATABASE_URI'])):
+        with app.app_context():
+            _register_sqlite_pragmas(app, db.engine)
@@ -0,0 +1,235 @@
+"""Persistent embedding cache in front of the Chroma embedding function.
+
+The same texts get embedded again and again: the ticket text for suggestions,
+repeated customer questions, and unchanged KB chunks on every re-index.
+`CachedEmbeddingFunction` keys vectors by the embedding model and a hash of
+the text. It checks a bounded in-memory LRU first, then an on-disk SQLite
+store (EMBEDDING_CACHE_PATH) shared by the workers on the host. Only real
+misses reach the model. Hit rates are exported as
+`voss_cache_requests_total{cache="embedding"}` and the
+`voss_embedding_cache_*` gauges.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, has_app_context
+
+from .metrics import metrics, record_cache_lookup
+
+PRUNE_EVERY_WRITES = 1000 # Disk size is enforced after this many new rows
+
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+class EmbeddingStore:
+    """On-disk embedding cache: a SQLite table of float32 blobs keyed by (model, text hash).
+
+    Shared by every worker on the host (WAL mode, short busy timeout). The table
+    keeps at most `max_entries` rows; the oldest rows are pruned in bulk.
+    """
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache ("
+            " model TEXT NOT NULL, text_hash BLOB NOT NULL, vector BLOB NOT NULL, created_at INTEGER NOT NULL,"
+            " PRIMARY KEY (model, text_hash)) WITHOUT ROWID"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS ix_embedding_cache_created_at ON embedding_cache (created_at)")
+
+    def get_many(self, model, hashes):
+        """Returns {text_hash: float32 bytes} for the hashes present in the store."""
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), 500): # Stay under SQLite's bound-parameter limit
+                chunk = hashes[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._connection.execute(
+                    f"SELECT text_hash, vector FROM embedding_cache WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *chunk],
+                ).fetchall()
+                found.update(rows)
+        return found
+
+    def put_many(self, model, items):
+        """Stores [(text_hash, float32 bytes)] for `model`; existing rows are kept."""
+        now = int(time.time())
+        with self._lock:
+            self._connection.execute("BEGIN")
+            try:
+                self._connection.executemany(
+                    "INSERT OR IGNORE INTO embedding_cache (model, text_hash, vector, created_at) VALUES (?, ?, ?, ?)",
+                    [(model, h, vector, now) for h, vector in items],
+                )
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._writes_since_prune += len(items)
+            if self._writes_since_prune >= PRUNE_EVERY_WRITES:
+                self._writes_since_prune = 0
+                self._prune()
+
+    def _prune(self):
+        count = self._connection.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+        excess = count - self.max_entries
+        if excess > 0:
+            self._connection.execute(
+                "DELETE FROM embedding_cache WHERE (model, text_hash) IN "
+                "(SELECT model, text_hash FROM embedding_cache ORDER BY created_at LIMIT ?)", (excess,)
+            )
+
+    def count(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM embedding_cache").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class CachedEmbeddingFunction:
+    """Chroma-compatible embedding function that serves repeated texts from cache.
+
+    Lookups go to a bounded in-memory LRU first, then to the on-disk store (if
+    any); only the remaining texts reach the wrapped embedding function, in one
+    batch. Vectors are keyed by `model_id` and a hash of the exact text, so a
+    different model or backend never reuses another one's vectors.
+    """
+
+    def __init__(self, embedding_function, model_id, store=None, memory_entries=2048):
+        self.embedding_function = embedding_function
+        self.model_id = model_id
+        self.store = store
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict() # text_hash -> float32 bytes
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.store_errors = 0
+
+    def __call__(self, input):
+        import numpy as np # Deferred to first use, keeping numpy off the cold-start path
+        texts = list(input)
+        hashes = [text_hash(text) for text in texts]
+        vectors = [None] * len(texts)
+
+        with self._lock:
+            for i, h in enumerate(hashes):
+                cached = self._memory.get(h)
+                if cached is not None:
+                    self._memory.move_to_end(h)
+                    vectors[i] = cached
+        memory_hits = sum(v is not None for v in vectors)
+
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        disk_hits = 0
+        if missing and self.store is not None:
+            try:
+                found = self.store.get_many(self.model_id, list({hashes[i] for i in missing}))
+            except Exception as e:
+                found = {}
+                self._store_failed(e)
+            for i in missing:
+                if hashes[i] in found:
+                    vectors[i] = found[hashes[i]]
+                    disk_hits += 1
+
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        new_items = {}
+        if missing:
+            unique = list(OrderedDict((hashes[i], texts[i]) for i in missing).items())
+            computed = self.embedding_function([text for _, text in unique])
+            for (h, _), vector in zip(unique, computed):
+                new_items[h] = np.asarray(vector, dtype=np.float32).tobytes()
+            for i in missing:
+                vectors[i] = new_items[hashes[i]]
+            if self.store is not None:
+                try:
+                    self.store.put_many(self.model_id, list(new_items.items()))
+                except Exception as e:
+                    self._store_failed(e)
+
+        with self._lock:
+            for h, vector in zip(hashes, vectors):
+                self._memory[h] = vector
+                self._memory.move_to_end(h)
+            while len(self._memory) > max(self.memory_entries, 1):
+                self._memory.popitem(last=False)
+            self.memory_hits += memory_hits
+            self.disk_hits += disk_hits
+            self.misses += len(missing)
+
+        record_cache_lookup('embedding', True, count=memory_hits + disk_hits)
+        record_cache_lookup('embedding', False, count=len(missing))
+        return [np.frombuffer(vector, dtype=np.float32).tolist() for vector in vectors]
+
+    def _store_failed(self, error):
+        with self._lock:
+            self.store_errors += 1
+        if has_app_context():
+            current_app.logger.warning(f"Embedding cache store error ({self.store.path}): {error}")
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "model": self.model_id,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "store_errors": self.store_errors,
+            }
+
+
+_active_cache = None # The CachedEmbeddingFunction built most recently in this process
+
+
+def embedding_cache_stats():
+    """Stats of this worker's embedding cache, or None when caching is off."""
+    return _active_cache.stats() if _active_cache is not None else None
+
+
+metrics.gauge('voss_embedding_cache_memory_entries', "Embeddings held in this worker's in-memory LRU.",
+              lambda: embedding_cache_stats()["memory_entries"])
+metrics.gauge('voss_embedding_cache_hit_ratio', "Embedding cache hit ratio (memory + disk) since this worker started.",
+              lambda: embedding_cache_stats()["hit_rate"])
+
+
+def with_embedding_cache(embedding_function, config, model_id):
+    """Wraps `embedding_function` in the embedding cache if EMBEDDING_CACHE_ENABLED is set."""
+    global _active_cache
+    if not config.get('EMBEDDING_CACHE_ENABLED'):
+        return embedding_function
+    store = None
+    if config.get('EMBEDDING_CACHE_PATH'):
+        try:
+            store = EmbeddingStore(config['EMBEDDING_CACHE_PATH'], config['EMBEDDING_CACHE_MAX_DISK_ENTRIES'])
+        except Exception as e: # e.g. read-only filesystem: keep the in-memory LRU only
+            if has_app_context():
+                current_app.logger.warning(f"Embedding cache store unavailable at {config['EMBEDDING_CACHE_PATH']}: {e}")
+    _active_cache = CachedEmbeddingFunction(embedding_function, model_id, store,
+                                            memory_entries=config['EMBEDDING_CACHE_MEMORY_ENTRIES'])
+    return _active_cache
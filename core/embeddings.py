@@ -0,0 +1,120 @@
+"""Pluggable embedding backends for the knowledge base.
+
+EMBEDDING_BACKEND selects how EMBEDDING_MODEL_SENTENCE_TRANSFORMERS is run:
+
+- 'sentence_transformers': the full-precision PyTorch model (previous default).
+- 'onnx': the same MiniLM model exported to ONNX and int8-quantized, run on
+  ONNX Runtime with EMBEDDING_ONNX_THREADS intra-op threads and batches of
+  EMBEDDING_BATCH_SIZE. Build the model directory once with
+  scripts/build_onnx_embedding_model.py.
+- 'hash': a deterministic bag-of-words hash embedding with no model at all,
+  for offline benchmarks and local development.
+
+Every backend is a Chroma-compatible callable (`fn(input) -> list of vectors`),
+so queries, KB indexing and ticket suggestions all use whichever is configured.
+Switching between 'sentence_transformers' and 'onnx' keeps vectors comparable
+(check with scripts/check_embedding_recall.py); switching to another model or to
+'hash' needs a re-index of the KB collections.
+"""
+import hashlib
+import os
+
+ONNX_MODEL_FILENAME = 'model_int8.onnx'
+ONNX_TOKENIZER_FILENAME = 'tokenizer.json'
+
+
+class HashEmbeddingFunction:
+    """Deterministic bag-of-words embedding: each lowercased word hashes to a signed dimension."""
+
+    def __init__(self, dimensions=384):
+        self.dimensions = dimensions
+
+    def __call__(self, input):
+        import numpy as np
+        vectors = []
+        for text in input:
+            vector = np.zeros(self.dimensions, dtype=np.float32)
+            for word in text.lower().split():
+                digest = hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest()
+                index = int.from_bytes(digest[:4], 'little') % self.dimensions
+                vector[index] += 1.0 if digest[4] & 1 else -1.0
+            norm = np.linalg.norm(vector)
+            vectors.append((vector / norm if norm else vector).tolist())
+        return vectors
+
+
+class OnnxEmbeddingFunction:
+    """Sentence-transformers style embeddings (mean pooling + L2 norm) from an ONNX MiniLM on CPU."""
+
+    def __init__(self, model_dir, threads=1, batch_size=32, max_length=256):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        model_path = os.path.join(model_dir, ONNX_MODEL_FILENAME)
+        tokenizer_path = os.path.join(model_dir, ONNX_TOKENIZER_FILENAME)
+        if not os.path.exists(model_path) or not os.path.exists(tokenizer_path):
+            raise FileNotFoundError(f"ONNX embedding model not found in {model_dir}; "
+                                    f"run scripts/build_onnx_embedding_model.py first.")
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(model_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.batch_size = max(1, batch_size)
+
+    def __call__(self, input):
+        import numpy as np
+        vectors = []
+        for start in range(0, len(input), self.batch_size):
+            encoded = self.tokenizer.encode_batch(list(input[start:start + self.batch_size]))
+            input_ids = np.array([e.ids for e in encoded], dtype=np.int64)
+            attention_mask = np.array([e.attention_mask for e in encoded], dtype=np.int64)
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask,
+                     "token_type_ids": np.zeros_like(input_ids)}
+            token_embeddings = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            vectors.extend(pooled.tolist())
+        return vectors
+
+
+def embedding_backend_key(config):
+    """Identifies the configured embedding function; the registry rebuilds it when this changes."""
+    backend = config.get('EMBEDDING_BACKEND', 'sentence_transformers')
+    key = (backend, config.get('EMBEDDING_MODEL_SENTENCE_TRANSFORMERS'))
+    if backend == 'onnx':
+        key += (config.get('EMBEDDING_ONNX_MODEL_DIR'), config.get('EMBEDDING_ONNX_THREADS'), config.get('EMBEDDING_BATCH_SIZE'))
+    elif backend == 'hash':
+        key += (config.get('EMBEDDING_HASH_DIMENSIONS'),)
+    return key
+
+
+def embedding_model_id(config):
+    """Identifies the vectors a backend produces (runtime knobs like threads excluded); used as the embedding cache key."""
+    backend = config.get('EMBEDDING_BACKEND', 'sentence_transformers')
+    model_id = f"{backend}:{config.get('EMBEDDING_MODEL_SENTENCE_TRANSFORMERS')}"
+    if backend == 'onnx':
+        model_id += f":{os.path.abspath(config.get('EMBEDDING_ONNX_MODEL_DIR') or '')}"
+    elif backend == 'hash':
+        model_id += f":{config.get('EMBEDDING_HASH_DIMENSIONS')}"
+    return model_id
+
+
+def build_embedding_function(config):
+    """Creates the embedding function for `config` (a Flask config mapping). Raises on failure."""
+    backend = config.get('EMBEDDING_BACKEND', 'sentence_transformers')
+    if backend == 'sentence_transformers':
+        from chromadb.utils import embedding_functions
+        return embedding_functions.SentenceTransformerEmbeddingFunction(model_name=config['EMBEDDING_MODEL_SENTENCE_TRANSFORMERS'])
+    if backend == 'onnx':
+        return OnnxEmbeddingFunction(config['EMBEDDING_ONNX_MODEL_DIR'], threads=config['EMBEDDING_ONNX_THREADS'],
+                                     batch_size=config['EMBEDDING_BATCH_SIZE'])
+    if backend == 'hash':
+        return HashEmbeddingFunction(config['EMBEDDING_HASH_DIMENSIONS'])
+    raise ValueError(f"Unknown EMBEDDING_BACKEND '{backend}' (expected sentence_transformers, onnx or hash)")
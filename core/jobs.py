@@ -0,0 +1,211 @@
+"""Bounded in-process background job queue.
+
+Jobs are recorded in the `background_job` table so their status is visible to
+every worker and to the UI, and are executed by a small pool of daemon threads
+fed from a local bounded queue. Handlers are registered by job type with
+`register_job_handler` and receive the BackgroundJob row plus its decoded payload.
+A handler that raises is retried with exponential backoff until `max_attempts`.
+
+The queue lives only in this process, so when the workers start they also sweep
+the table for jobs another process left behind (a restart, a deploy): rows still
+queued, or running, for longer than BACKGROUND_JOBS_STALE_AFTER_SECONDS are
+claimed and queued here. An interrupted run counts as an attempt.
+
+When BACKGROUND_JOBS_ENABLED is false (e.g. on serverless hosts that freeze the
+process after the response), jobs run inline in the request instead.
+"""
+import json
+import queue
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from .models import db, BackgroundJob
+
+_job_handlers = {}
+_job_queue = None
+_job_workers = []
+_job_queue_lock = threading.Lock()
+
+
+def register_job_handler(job_type):
+    def register(fn):
+        _job_handlers[job_type] = fn
+        return fn
+    return register
+
+
+def init_jobs(app):
+    """Starts the worker pool (and so the stale-job sweep) on the first request, not only on the first enqueue."""
+    if not app.config.get('BACKGROUND_JOBS_ENABLED'):
+        return
+
+    @app.before_request
+    def _start_job_workers():
+        if _job_queue is None:
+            _ensure_workers(app)
+
+
+def _ensure_workers(app):
+    global _job_queue
+    if _job_queue is not None:
+        return _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            job_queue = queue.Queue(maxsize=app.config['BACKGROUND_JOBS_QUEUE_SIZE'])
+            for i in range(app.config['BACKGROUND_JOBS_WORKERS']):
+                worker = threading.Thread(target=_worker_loop, args=(app, job_queue), name=f"job-worker-{i}", daemon=True)
+                worker.start()
+                _job_workers.append(worker)
+            _job_queue = job_queue
+            app.logger.info(f"Background job workers started: {len(_job_workers)}")
+            threading.Thread(target=_recover_stale_jobs, args=(app, job_queue), name="job-recovery", daemon=True).start()
+    return _job_queue
+
+
+def _recover_stale_jobs(app, job_queue):
+    """Queues jobs orphaned by another process; each row is claimed with a conditional UPDATE so only one process takes it."""
+    with app.app_context():
+        try:
+            cutoff = datetime.utcnow() - timedelta(seconds=app.config['BACKGROUND_JOBS_STALE_AFTER_SECONDS'])
+            last_seen = db.func.coalesce(BackgroundJob.started_at, BackgroundJob.created_at)
+            stale = BackgroundJob.query.filter(BackgroundJob.status.in_(('queued', 'running')), last_seen < cutoff)\
+                                       .order_by(BackgroundJob.id).all()
+            recovered = 0
+            for job in stale:
+                interrupted = job.status == 'running'
+                values = {"started_at": datetime.utcnow()} # Marks the claim, so other sweeps see the row as fresh
+                if interrupted and job.attempts >= job.max_attempts:
+                    values.update(status='failed', last_error="Interrupted by a worker restart.", finished_at=datetime.utcnow())
+                else:
+                    values.update(status='queued')
+                claimed = BackgroundJob.query.filter(BackgroundJob.id == job.id, BackgroundJob.status == job.status,
+                                                     last_seen < cutoff).update(values, synchronize_session=False)
+                db.session.commit()
+                if not claimed or values['status'] != 'queued':
+                    continue
+                try:
+                    job_queue.put_nowait(job.id)
+                except queue.Full:
+                    break # Still queued; a later sweep picks it up
+                recovered += 1
+            if stale:
+                app.logger.info(f"Background job recovery: {recovered} of {len(stale)} stale job(s) requeued.")
+        except Exception as e:
+            db.session.rollback()
+            app.logger.error(f"Background job recovery failed: {e}")
+
+
+def enqueue_job(job_type, ticket_id=None, company_id=None, payload=None):
+    """Records a job and hands it to the worker pool. Returns the BackgroundJob row.
+
+    The job row is committed before it is queued so a worker can always load it.
+    """
+    job = add_job(job_type, ticket_id=ticket_id, company_id=company_id, payload=payload)
+    db.session.commit()
+    dispatch_jobs([job])
+    return job
+
+
+def add_job(job_type, ticket_id=None, company_id=None, payload=None):
+    """Adds a job row to the current transaction without committing or queueing it.
+
+    For callers that write several rows in one transaction: commit, then pass the jobs to
+    `dispatch_jobs`. If the transaction rolls back, the jobs are never run.
+    """
+    if job_type not in _job_handlers:
+        raise ValueError(f"No handler registered for job type '{job_type}'")
+    job = BackgroundJob(job_type=job_type, ticket_id=ticket_id, company_id=company_id,
+                        payload=json.dumps(payload or {}), status='queued',
+                        max_attempts=current_app.config['BACKGROUND_JOBS_MAX_ATTEMPTS'])
+    db.session.add(job)
+    return job
+
+
+def dispatch_jobs(jobs):
+    """Hands committed jobs (from `add_job`) to the worker pool, or runs them inline."""
+    if not current_app.config.get('BACKGROUND_JOBS_ENABLED'):
+        for job in jobs:
+            while _run_job(job) is not None: # Inline mode retries immediately
+                pass
+        return
+
+    app = current_app._get_current_object()
+    job_queue = _ensure_workers(app)
+    for job in jobs:
+        try:
+            job_queue.put_nowait(job.id)
+        except queue.Full:
+            job.status = 'failed'
+            job.last_error = "Background job queue is full."
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+            current_app.logger.warning(f"Background job queue full; dropped {job.job_type} job {job.id}.")
+
+
+def _worker_loop(app, job_queue):
+    while True:
+        job_id = job_queue.get()
+        try:
+            with app.app_context():
+                job = db.session.get(BackgroundJob, job_id)
+                if job is None or job.status != 'queued':
+                    continue
+                retry_delay = _run_job(job)
+                if retry_delay is not None:
+                    timer = threading.Timer(retry_delay, _requeue, args=(app, job_queue, job_id))
+                    timer.daemon = True
+                    timer.start()
+        except Exception as e:
+            app.logger.error(f"Background job worker crashed on job {job_id}: {e}")
+        finally:
+            job_queue.task_done()
+
+
+def _requeue(app, job_queue, job_id):
+    try:
+        job_queue.put_nowait(job_id)
+    except queue.Full:
+        with app.app_context():
+            job = db.session.get(BackgroundJob, job_id)
+            if job:
+                job.status = 'failed'
+                job.last_error = "Background job queue is full (retry dropped)."
+                job.finished_at = datetime.utcnow()
+                db.session.commit()
+
+
+def _run_job(job):
+    """Executes one attempt of `job`. Returns a retry delay in seconds, or None when finished."""
+    handler = _job_handlers[job.job_type]
+    job.status = 'running'
+    job.attempts += 1
+    job.started_at = datetime.utcnow()
+    db.session.commit()
+    try:
+        result = handler(job, json.loads(job.payload or '{}'))
+        job.status = 'succeeded'
+        job.result = json.dumps(result) if result is not None else None
+        job.last_error = None
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return None
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(BackgroundJob, job.id)
+        job.last_error = str(e)
+        current_app.logger.warning(f"Background job {job.id} ({job.job_type}) attempt {job.attempts} failed: {e}")
+        if job.attempts < job.max_attempts:
+            job.status = 'queued'
+            db.session.commit()
+            return current_app.config['BACKGROUND_JOBS_RETRY_BACKOFF_SECONDS'] * (2 ** (job.attempts - 1))
+        job.status = 'failed'
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return None
+
+
+def latest_job_for_ticket(ticket_id, job_type):
+    return BackgroundJob.query.filter_by(ticket_id=ticket_id, job_type=job_type)\
+                              .order_by(BackgroundJob.id.desc()).first()
@@ -0,0 +1,188 @@
+"""Bulk knowledge-base ingestion: CSV, JSONL and markdown sources.
+
+Ingestion runs in two resumable phases:
+
+1. `insert_knowledge_items` bulk-inserts SQL rows, skipping any whose
+   content hash already exists for the company, so re-running an import never
+   duplicates items.
+2. `index_pending_items` embeds every item of the company that has no
+   `vector_id` yet in large batches and upserts their chunks into Chroma under
+   the `kb_<id>[_<n>]` ids (see core/retrieval.py), recording `vector_id` after
+   each batch. An interrupted run picks up where it stopped.
+
+Chroma access is passed in by the caller (see core/knowledge_base.py), so
+this module only depends on the models.
+"""
+import csv
+import io
+import json
+import os
+import time
+import zipfile
+
+from sqlalchemy import insert
+
+from .models import db, KnowledgeItem
+from .retrieval import item_chunk_records
+
+KB_ITEM_TYPES = ['faq', 'product_info', 'troubleshooting_guide', 'policy']
+
+
+def _normalize_record(raw, default_item_type):
+    title = (raw.get('title') or '').strip()
+    content = (raw.get('content') or '').strip()
+    if not title or not content:
+        return None
+    item_type = (raw.get('item_type') or raw.get('type') or default_item_type or '').strip()
+    if item_type not in KB_ITEM_TYPES:
+        item_type = default_item_type
+    return {"title": title[:200], "item_type": item_type, "content": content}
+
+
+def _markdown_record(name, text, default_item_type):
+    """Uses the first '# ' heading as the title (or the file name) and the rest as content."""
+    lines = text.strip().splitlines()
+    title = os.path.splitext(os.path.basename(name))[0].replace('_', ' ').replace('-', ' ').strip()
+    if lines and lines[0].startswith('# '):
+        title = lines[0][2:].strip()
+        lines = lines[1:]
+    return _normalize_record({"title": title, "content": "\n".join(lines)}, default_item_type)
+
+
+def parse_csv(text, default_item_type='faq'):
+    records = (_normalize_record(row, default_item_type) for row in csv.DictReader(io.StringIO(text)))
+    return [r for r in records if r]
+
+
+def parse_jsonl(text, default_item_type='faq'):
+    records = []
+    for line_no, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = _normalize_record(json.loads(line), default_item_type)
+        except (json.JSONDecodeError, AttributeError) as e:
+            raise ValueError(f"Invalid JSON on line {line_no}: {e}")
+        if record:
+            records.append(record)
+    return records
+
+
+def parse_markdown_directory(path, default_item_type='troubleshooting_guide'):
+    records = []
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            if name.lower().endswith(('.md', '.markdown')):
+                with open(os.path.join(root, name), encoding='utf-8') as f:
+                    record = _markdown_record(name, f.read(), default_item_type)
+                if record:
+                    records.append(record)
+    return records
+
+
+def parse_markdown_zip(data, default_item_type='troubleshooting_guide'):
+    records = []
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        for name in sorted(archive.namelist()):
+            if name.lower().endswith(('.md', '.markdown')) and not name.startswith('__MACOSX/'):
+                record = _markdown_record(name, archive.read(name).decode('utf-8'), default_item_type)
+                if record:
+                    records.append(record)
+    return records
+
+
+def load_records_from_path(path, default_item_type=None):
+    """Parses a .csv or .jsonl file, or a directory of markdown files."""
+    if os.path.isdir(path):
+        return parse_markdown_directory(path, default_item_type or 'troubleshooting_guide')
+    with open(path, 'rb') as f:
+        data = f.read()
+    return load_records_from_upload(os.path.basename(path), data, default_item_type)
+
+
+def load_records_from_upload(filename, data, default_item_type=None):
+    """Parses uploaded bytes by file extension: .csv, .jsonl, .md or a .zip of markdown files."""
+    extension = os.path.splitext(filename.lower())[1]
+    if extension == '.csv':
+        return parse_csv(data.decode('utf-8-sig'), default_item_type or 'faq')
+    if extension in ('.jsonl', '.ndjson'):
+        return parse_jsonl(data.decode('utf-8-sig'), default_item_type or 'faq')
+    if extension in ('.md', '.markdown'):
+        record = _markdown_record(filename, data.decode('utf-8-sig'), default_item_type or 'troubleshooting_guide')
+        return [record] if record else []
+    if extension == '.zip':
+        return parse_markdown_zip(data, default_item_type or 'troubleshooting_guide')
+    raise ValueError(f"Unsupported knowledge base file type: {extension or filename}")
+
+
+def insert_knowledge_items(company_id, records, batch_size=1000):
+    """Bulk-inserts records as KnowledgeItem rows, skipping content already in the company's KB.
+
+    Returns (inserted, skipped).
+    """
+    existing_hashes = {h for (h,) in db.session.query(KnowledgeItem.content_hash)
+                                                .filter(KnowledgeItem.company_id == company_id,
+                                                        KnowledgeItem.content_hash != None)}
+    rows = []
+    skipped = 0
+    for record in records:
+        content_hash = KnowledgeItem.hash_document(
+            KnowledgeItem.build_document(record['title'], record['item_type'], record['content']))
+        if content_hash in existing_hashes:
+            skipped += 1
+            continue
+        existing_hashes.add(content_hash) # Also dedupes repeats within the same file
+        rows.append({**record, "company_id": company_id, "content_hash": content_hash})
+
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(insert(KnowledgeItem), rows[start:start + batch_size])
+        db.session.commit()
+    return len(rows), skipped
+
+
+def count_pending_items(company_id):
+    return KnowledgeItem.query.filter_by(company_id=company_id, vector_id=None).count()
+
+
+def index_pending_items(company_id, collection, embedding_function, batch_size=256, progress=None):
+    """Embeds and upserts every not-yet-indexed item for a company, one batch at a time.
+
+    `progress(done, total, elapsed_seconds)` is called after each batch. Returns a stats dict.
+    """
+    total = count_pending_items(company_id)
+    done = 0
+    last_id = 0
+    started = time.perf_counter()
+    while True:
+        items = KnowledgeItem.query.filter(
+            KnowledgeItem.company_id == company_id,
+            KnowledgeItem.vector_id == None,
+            KnowledgeItem.id > last_id
+        ).order_by(KnowledgeItem.id).limit(batch_size).all()
+        if not items:
+            break
+        ids, documents, metadatas = [], [], []
+        for item in items:
+            chunk_ids, chunk_documents, chunk_metadatas = item_chunk_records(item)
+            ids.extend(chunk_ids)
+            documents.extend(chunk_documents)
+            metadatas.extend(chunk_metadatas)
+        embeddings = embedding_function(documents)
+        # upsert keeps a re-run of a half-written batch idempotent under the kb_<id>[_<n>] scheme
+        collection.upsert(
+            ids=ids,
+            embeddings=[list(map(float, e)) for e in embeddings],
+            documents=documents,
+            metadatas=metadatas,
+        )
+        for item in items:
+            item.vector_id = item.chroma_id()
+        db.session.commit()
+        done += len(items)
+        last_id = items[-1].id
+        if progress:
+            progress(done, total, time.perf_counter() - started)
+
+    elapsed = time.perf_counter() - started
+    return {"indexed": done, "seconds": round(elapsed, 3),
+            "items_per_second": round(done / elapsed, 1) if elapsed > 0 else 0.0}
@@ -0,0 +1,239 @@
+"""Full re-index of company knowledge bases into new collections (blue/green).
+
+A company's live Chroma collection is named by `Company.kb_collection`, or
+`company_<id>_kb` when unset (see `knowledge_base.company_collection_name`).
+`reindex_companies` builds a new versioned collection
+(`company_<id>_kb_v<timestamp>`) for each company next to the live one, so
+chat keeps querying the old index while the new one fills. Chunks are
+embedded across a process pool. Embedding is the CPU-bound part, and batches
+from all companies share the pool. This process writes the vectors to Chroma,
+so only one process writes to the Chroma store.
+
+Once a company's collection is complete, a reconcile pass catches edits made
+during the build. A single UPDATE of `Company.kb_collection` then switches
+every worker to it on their next lookup. A second reconcile covers edits that
+reached the old collection just before the switch. The old collection is kept
+for rollback unless `drop_old` is set. A failure before the switch deletes the new
+collection; after it, the new collection is live, so it is kept and a `reconcile_kb`
+job is queued to repair it.
+
+Used by scripts/reindex_kb.py, e.g. after changing the embedding model.
+"""
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+import multiprocessing
+
+from .models import db, Company, KnowledgeItem
+from .jobs import enqueue_job
+from .retrieval import item_chunk_records
+from .embeddings import build_embedding_function, embedding_model_id
+from .embedding_cache import with_embedding_cache
+from .kb_sync import reconcile_company_kb, refresh_content_hash
+
+_worker_embedding_function = None
+
+
+def _init_embedding_worker(config):
+    global _worker_embedding_function
+    _worker_embedding_function = with_embedding_cache(build_embedding_function(config), config, embedding_model_id(config))
+
+
+def _embed_batch(documents):
+    import numpy as np
+    return np.asarray(_worker_embedding_function(documents), dtype=np.float32)
+
+
+class _InlinePool:
+    """Runs batches in this process when processes=0 (small installs, debugging)."""
+
+    def __init__(self, config):
+        _init_embedding_worker(config)
+
+    def submit(self, fn, *args):
+        from concurrent.futures import Future
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+def versioned_collection_name(company_id, version=None):
+    return f"company_{company_id}_kb_v{version or datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
+
+
+class _CompanyBuild:
+    def __init__(self, company, collection_name, collection, previous_name):
+        self.company_id = company.id
+        self.company_name = company.name
+        self.collection_name = collection_name
+        self.collection = collection
+        self.previous_name = previous_name
+        self.items = 0
+        self.chunks = 0
+        self.in_flight = 0
+        self.submitted_all = False
+        self.started = time.perf_counter()
+        self.embed_seconds = 0.0
+        self.error = None
+        self.switched = False # Company.kb_collection points here (committed)
+
+
+def _worker_config(config):
+    """The picklable part of the Flask config, for the embedding worker processes."""
+    return {key: value for key, value in config.items()
+            if key.isupper() and isinstance(value, (str, int, float, bool, type(None)))}
+
+
+def reindex_companies(app, companies, processes=2, batch_size=256, drop_old=False, progress=None):
+    """Rebuilds each company's KB into a new collection and switches to it. Returns one stats dict per company.
+
+    `progress(stats)` is called as each company finishes. A company whose build fails before the
+    switch keeps its live collection; the half-built one is deleted. If the catch-up after the
+    switch fails, the stats carry `switched` and a `reconcile_kb` job is queued.
+    """
+    from .knowledge_base import init_chroma_client, get_chroma_embedding_function, company_collection_name, mark_kb_changed
+
+    config = app.config
+    chroma_client = init_chroma_client()
+    embedding_function = get_chroma_embedding_function()
+    if not chroma_client or not embedding_function:
+        raise RuntimeError("ChromaDB client or embedding function unavailable")
+    model_id = embedding_model_id(config)
+    if processes > 0:
+        pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_init_embedding_worker, initargs=(_worker_config(config),))
+    else:
+        pool = _InlinePool(_worker_config(config))
+    max_in_flight = max(processes, 1) * 2
+    pending = {} # future -> (build, ids, documents, metadatas, submitted_at)
+    results = []
+
+    def finish(build):
+        unfinished.pop(build.company_id, None)
+        if build.error is None:
+            try:
+                stats = _switch_collection(build, embedding_function, batch_size, drop_old, chroma_client)
+                mark_kb_changed(build.company_id)
+            except Exception as e:
+                db.session.rollback()
+                build.error = e
+        if build.error is not None and build.switched:
+            # Live traffic already reads the new collection: never delete it, repair it instead.
+            app.logger.error(f"Re-index of company {build.company_id} switched to {build.collection_name} "
+                             f"but failed afterwards: {build.error}; queueing a KB reconcile.")
+            stats = {"company_id": build.company_id, "error": str(build.error), "switched": True,
+                     "collection": build.collection_name, "previous_collection": build.previous_name}
+            try:
+                mark_kb_changed(build.company_id)
+                enqueue_job('reconcile_kb', company_id=build.company_id)
+            except Exception as e:
+                db.session.rollback()
+                app.logger.error(f"Could not queue a KB reconcile for company {build.company_id}: {e}")
+        elif build.error is not None:
+            try:
+                chroma_client.delete_collection(build.collection_name)
+            except Exception:
+                pass
+            app.logger.error(f"Re-index of company {build.company_id} failed: {build.error}")
+            stats = {"company_id": build.company_id, "error": str(build.error)}
+        stats.update(company_id=build.company_id, company=build.company_name)
+        results.append(stats)
+        if progress:
+            progress(stats)
+
+    def collect(block):
+        if not pending:
+            return
+        done, _ = wait(list(pending), return_when=FIRST_COMPLETED, timeout=None if block else 0)
+        for future in done:
+            build, ids, documents, metadatas, submitted_at = pending.pop(future)
+            build.in_flight -= 1
+            if build.error is None:
+                try:
+                    embeddings = future.result()
+                    build.embed_seconds += time.perf_counter() - submitted_at
+                    build.collection.upsert(ids=ids, embeddings=embeddings.tolist(), documents=documents, metadatas=metadatas)
+                    build.chunks += len(ids)
+                except Exception as e:
+                    build.error = e
+            if build.submitted_all and build.in_flight == 0:
+                finish(build)
+
+    unfinished = {} # company_id -> build, for cleanup if the run aborts
+    try:
+        for company in companies:
+            previous_name = company_collection_name(company.id)
+            collection_name = versioned_collection_name(company.id)
+            collection = chroma_client.create_collection(
+                name=collection_name, embedding_function=embedding_function,
+                metadata={"embedding_model": model_id, "company_id": company.id})
+            build = unfinished[company.id] = _CompanyBuild(company, collection_name, collection, previous_name)
+            last_id = 0
+            while build.error is None:
+                items = KnowledgeItem.query.filter(KnowledgeItem.company_id == company.id, KnowledgeItem.id > last_id)\
+                                           .order_by(KnowledgeItem.id).limit(batch_size).all()
+                if not items:
+                    break
+                last_id = items[-1].id
+                ids, documents, metadatas = [], [], []
+                for item in items:
+                    refresh_content_hash(item)
+                    chunk_ids, chunk_documents, chunk_metadatas = item_chunk_records(item)
+                    ids.extend(chunk_ids)
+                    documents.extend(chunk_documents)
+                    metadatas.extend(chunk_metadatas)
+                build.items += len(items)
+                db.session.rollback() # Nothing to write here; vector ids are the same in every collection
+                while len(pending) >= max_in_flight:
+                    collect(block=True)
+                build.in_flight += 1
+                pending[pool.submit(_embed_batch, documents)] = (build, ids, documents, metadatas, time.perf_counter())
+                collect(block=False)
+            build.submitted_all = True
+            if build.in_flight == 0:
+                finish(build)
+        while pending:
+            collect(block=True)
+    except BaseException:
+        for build in unfinished.values(): # Never switched to; live traffic is still on the previous collections
+            try:
+                chroma_client.delete_collection(build.collection_name)
+            except Exception:
+                pass
+        raise
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    return results
+
+
+def _switch_collection(build, embedding_function, batch_size, drop_old, chroma_client):
+    """Catches up on edits made during the build, points the company at the new collection, then catches up again."""
+    catch_up = reconcile_company_kb(build.company_id, build.collection, embedding_function, batch_size=batch_size)
+    Company.query.filter_by(id=build.company_id).update({Company.kb_collection: build.collection_name})
+    db.session.commit()
+    build.switched = True
+    after_switch = reconcile_company_kb(build.company_id, build.collection, embedding_function, batch_size=batch_size)
+    if drop_old and build.previous_name != build.collection_name:
+        try:
+            chroma_client.delete_collection(build.previous_name)
+        except ValueError: # Never created (company had no KB yet)
+            pass
+    elapsed = time.perf_counter() - build.started
+    return {
+        "collection": build.collection_name,
+        "previous_collection": build.previous_name,
+        "items": build.items,
+        "chunks": build.chunks,
+        "seconds": round(elapsed, 3),
+        "items_per_second": round(build.items / elapsed, 1) if elapsed > 0 else 0.0,
+        "chunks_per_second": round(build.chunks / elapsed, 1) if elapsed > 0 else 0.0,
+        "catch_up_repairs": catch_up["reembedded"] + catch_up["deleted_chunks"]
+                            + after_switch["reembedded"] + after_switch["deleted_chunks"],
+        "dropped_previous": drop_old,
+    }
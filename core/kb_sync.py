@@ -0,0 +1,145 @@
+"""Keeps a company's Chroma chunks in step with its KnowledgeItem rows.
+
+SQL is the source of truth. Chroma is written after the SQL commit, so a
+failed or interrupted Chroma call can leave the two out of step: an item
+with no vectors, vectors for an old version of an item, or vectors for an
+item that was deleted.
+
+- `upsert_item_vectors` / `delete_item_vectors` change only the chunks of the
+  items involved. They are used by the KB edit and delete views.
+- `reconcile_company_kb` diffs every row against the chunks in the company
+  collection and repairs only the differences. Each chunk's metadata carries
+  the `content_hash` of the item version it was embedded from, so comparing
+  hashes (and the expected chunk ids) finds stale items without embedding
+  anything. It runs as the `reconcile_kb` background job and from
+  scripts/reconcile_kb.py.
+
+Chroma access is passed in by the caller, as in core/kb_ingest.py.
+"""
+import time
+
+from .models import db, KnowledgeItem
+from .retrieval import item_chunk_records
+
+CHROMA_PAGE_SIZE = 1000 # Chunks read per collection.get() when listing a collection
+CHROMA_DELETE_BATCH = 500
+
+
+def refresh_content_hash(item):
+    """Recomputes `item.content_hash` from its current title/type/content; returns the hash."""
+    item.content_hash = KnowledgeItem.hash_document(item.to_document())
+    return item.content_hash
+
+
+def upsert_item_vectors(collection, embedding_function, items, trim=True):
+    """Embeds and upserts all chunks of `items`. With `trim`, also drops chunks left over from a longer old version.
+
+    Sets each item's `vector_id`; the caller commits.
+    """
+    ids, documents, metadatas = [], [], []
+    chunk_counts = {}
+    for item in items:
+        refresh_content_hash(item)
+        chunk_ids, chunk_documents, chunk_metadatas = item_chunk_records(item)
+        chunk_counts[item.id] = len(chunk_ids)
+        ids.extend(chunk_ids)
+        documents.extend(chunk_documents)
+        metadatas.extend(chunk_metadatas)
+    if ids:
+        embeddings = embedding_function(documents)
+        collection.upsert(
+            ids=ids,
+            embeddings=[list(map(float, e)) for e in embeddings],
+            documents=documents,
+            metadatas=metadatas,
+        )
+    for item in items:
+        if trim:
+            collection.delete(where={"$and": [{"item_db_id": item.id}, {"chunk_index": {"$gte": chunk_counts[item.id]}}]})
+        item.vector_id = item.chroma_id()
+
+
+def delete_item_vectors(collection, item_ids):
+    """Removes every chunk of the given KnowledgeItem ids from the collection."""
+    for item_id in item_ids:
+        collection.delete(where={"item_db_id": item_id})
+
+
+def _indexed_chunks(collection):
+    """Returns ({item_db_id: {"ids": set, "hashes": set}}, [chunk ids with no item_db_id])."""
+    indexed, unowned = {}, []
+    offset = 0
+    while True:
+        page = collection.get(include=['metadatas'], limit=CHROMA_PAGE_SIZE, offset=offset)
+        if not page['ids']:
+            break
+        for chunk_id, metadata in zip(page['ids'], page['metadatas']):
+            item_id = (metadata or {}).get('item_db_id')
+            if item_id is None:
+                unowned.append(chunk_id)
+                continue
+            entry = indexed.setdefault(item_id, {"ids": set(), "hashes": set()})
+            entry["ids"].add(chunk_id)
+            entry["hashes"].add(metadata.get('content_hash'))
+        offset += len(page['ids'])
+    return indexed, unowned
+
+
+def reconcile_company_kb(company_id, collection, embedding_function, batch_size=256, dry_run=False):
+    """Repairs the differences between the company's KnowledgeItem rows and its Chroma chunks.
+
+    Re-embeds items that are missing or stale (content hash or chunk ids differ),
+    deletes chunks of deleted items and leftover chunks, and fixes `vector_id`.
+    With `dry_run` nothing is changed. Returns a stats dict.
+    """
+    started = time.perf_counter()
+    indexed, delete_ids = _indexed_chunks(collection)
+    chunks_seen = sum(len(entry["ids"]) for entry in indexed.values()) + len(delete_ids)
+    stats = {"items": 0, "chunks": chunks_seen, "missing": 0, "stale": 0, "vector_id_fixed": 0,
+             "orphan_items": 0, "deleted_chunks": 0, "reembedded": 0}
+
+    to_reembed = []
+    last_id = 0
+    while True:
+        items = KnowledgeItem.query.filter(KnowledgeItem.company_id == company_id, KnowledgeItem.id > last_id)\
+                                   .order_by(KnowledgeItem.id).limit(batch_size).all()
+        if not items:
+            break
+        last_id = items[-1].id
+        stats["items"] += len(items)
+        for item in items:
+            entry = indexed.pop(item.id, None)
+            expected_ids = set(item_chunk_records(item)[0])
+            content_hash = KnowledgeItem.hash_document(item.to_document())
+            if entry is None:
+                stats["missing"] += 1
+                to_reembed.append(item.id)
+            elif entry["hashes"] != {content_hash} or entry["ids"] != expected_ids:
+                stats["stale"] += 1
+                to_reembed.append(item.id)
+                delete_ids.extend(entry["ids"] - expected_ids)
+            elif item.vector_id != item.chroma_id() or item.content_hash != content_hash:
+                stats["vector_id_fixed"] += 1
+                if not dry_run:
+                    item.vector_id = item.chroma_id()
+                    item.content_hash = content_hash
+        if not dry_run:
+            db.session.commit()
+
+    # Whatever is left belongs to items that no longer exist in SQL.
+    stats["orphan_items"] = len(indexed)
+    for entry in indexed.values():
+        delete_ids.extend(entry["ids"])
+
+    if not dry_run:
+        for start in range(0, len(delete_ids), CHROMA_DELETE_BATCH):
+            collection.delete(ids=delete_ids[start:start + CHROMA_DELETE_BATCH])
+        for start in range(0, len(to_reembed), batch_size):
+            items = KnowledgeItem.query.filter(KnowledgeItem.id.in_(to_reembed[start:start + batch_size]))\
+                                       .order_by(KnowledgeItem.id).all()
+            upsert_item_vectors(collection, embedding_function, items, trim=False) # Leftover chunks were deleted above
+            db.session.commit()
+            stats["reembedded"] += len(items)
+    stats["deleted_chunks"] = len(delete_ids)
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    return stats
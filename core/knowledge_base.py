@@ -1,16 +1,28 @@
-from flask import Blueprint, render_template, request, flash, redirect, url_for, current_app
+from flask import Blueprint, render_template, request, flash, redirect, url_for, current_app, abort
 from flask_login import login_required, current_user
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms import StringField, TextAreaField, SelectField, SubmitField
 from wtforms.validators import DataRequired
-import chromadb
-from chromadb.utils import embedding_functions
+from collections import OrderedDict
+import threading
+import time
+import zipfile
 
-from .models import db, KnowledgeItem, Company
+from .models import db, KnowledgeItem, Company, BackgroundJob
+from .semantic_cache import invalidate_company_answers
+from .jobs import enqueue_job, register_job_handler
+from .embeddings import embedding_backend_key, embedding_model_id, build_embedding_function
+from .embedding_cache import with_embedding_cache
+from .metrics import timed_stage
+from .kb_ingest import load_records_from_upload, insert_knowledge_items, index_pending_items, count_pending_items
+from .kb_sync import refresh_content_hash, upsert_item_vectors, delete_item_vectors, reconcile_company_kb
 # No Pinecone utilities needed.
 
 kb_bp = Blueprint('kb', __name__)
 
+KB_ITEMS_DISPLAY_LIMIT = 200 # Newest items listed on the manage page
+
 class KnowledgeItemForm(FlaskForm):
     item_type = SelectField('Item Type', choices=[
         ('faq', 'FAQ'),
@@ -22,49 +34,237 @@ class KnowledgeItemForm(FlaskForm):
     content = TextAreaField('Content', validators=[DataRequired()])
     submit = SubmitField('Add Knowledge Item')
 
+class KnowledgeImportForm(FlaskForm):
+    file = FileField('CSV, JSONL, Markdown or .zip of Markdown files', validators=[
+        FileRequired(), FileAllowed(['csv', 'jsonl', 'ndjson', 'md', 'markdown', 'zip'], 'Unsupported file type.')
+    ])
+    item_type = SelectField('Default Item Type', choices=[
+        ('', 'From file (or per-format default)'),
+        ('faq', 'FAQ'),
+        ('product_info', 'Product Information'),
+        ('troubleshooting_guide', 'Troubleshooting Guide'),
+        ('policy', 'Policy')
+    ])
+    submit_import = SubmitField('Import')
+
+class KnowledgeItemDeleteForm(FlaskForm):
+    submit_delete = SubmitField('Delete')
+
+class KnowledgeReconcileForm(FlaskForm):
+    submit_reconcile = SubmitField('Check & Repair Index')
+
 # --- ChromaDB Initialization ---
+class ChromaRegistry:
+    """Process-wide cache of the Chroma client, the embedding function and
+    per-company collection handles.
+
+    Building a PersistentClient and loading the SentenceTransformer model are
+    expensive, so each worker builds them once and shares them across requests.
+    Collection handles are kept in a bounded LRU keyed by collection name.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._client = None
+        self._client_path = None
+        self._embedding_function = None
+        self._embedding_key = None
+        self._collections = OrderedDict()
+
+    def get_client(self, path):
+        with self._lock:
+            if self._client is None or self._client_path != path:
+                import chromadb # Deferred: the chromadb import chain is the bulk of a cold start
+                self._client = chromadb.PersistentClient(path=path)
+                self._client_path = path
+                self._collections.clear()
+            return self._client
+
+    def get_embedding_function(self, key, factory):
+        """Returns the embedding function for `key` (see embeddings.embedding_backend_key), building it with `factory()` on change."""
+        with self._lock:
+            if self._embedding_function is None or self._embedding_key != key:
+                self._embedding_function = factory()
+                self._embedding_key = key
+                self._collections.clear()
+            return self._embedding_function
+
+    def set_embedding_function(self, key, embedding_function):
+        """Installs a ready-made embedding function (e.g. the timed wrapper in scripts/benchmark.py)."""
+        with self._lock:
+            self._embedding_function = embedding_function
+            self._embedding_key = key
+            self._collections.clear()
+
+    def is_warm(self, path, key):
+        """True once the client and embedding model for this config are loaded (no lock: read-only peek)."""
+        return (self._client is not None and self._client_path == path
+                and self._embedding_function is not None and self._embedding_key == key)
+
+    def get_collection(self, chroma_client, collection_name, embedding_function, max_size, metadata=None):
+        """Returns a cached collection handle; `metadata` is only applied when the collection is created."""
+        with self._lock:
+            key = (id(chroma_client), id(embedding_function), collection_name)
+            collection = self._collections.get(key)
+            if collection is not None:
+                self._collections.move_to_end(key)
+                return collection
+            collection = chroma_client.get_or_create_collection(
+                name=collection_name,
+                embedding_function=embedding_function,
+                metadata=metadata, # e.g. {"hnsw:space": "cosine"}; KB collections use Chroma's default (l2)
+            )
+            self._collections[key] = collection
+            while len(self._collections) > max(max_size, 1):
+                self._collections.popitem(last=False)
+            return collection
+
+    def clear(self):
+        with self._lock:
+            self._client = None
+            self._client_path = None
+            self._embedding_function = None
+            self._embedding_key = None
+            self._collections.clear()
+
+
+chroma_registry = ChromaRegistry()
+_background_warm_up = None
+_background_warm_up_lock = threading.Lock()
+
 def init_chroma_client():
-    """Initializes and returns a ChromaDB client."""
+    """Returns the shared ChromaDB client, creating it on first use."""
     try:
-        client = chromadb.PersistentClient(path=current_app.config['CHROMA_DB_PATH'])
-        current_app.logger.info(f"ChromaDB client initialized. Path: {current_app.config['CHROMA_DB_PATH']}")
+        client = chroma_registry.get_client(current_app.config['CHROMA_DB_PATH'])
+        current_app.logger.debug(f"ChromaDB client ready. Path: {current_app.config['CHROMA_DB_PATH']}")
         return client
     except Exception as e:
         current_app.logger.error(f"Failed to initialize ChromaDB client: {e}")
         return None
 
 def get_chroma_embedding_function():
-    """Returns an embedding function configured for Sentence Transformers."""
-    model_name = current_app.config.get('EMBEDDING_MODEL_SENTENCE_TRANSFORMERS')
+    """Returns the shared embedding function for the configured backend (see core/embeddings.py)."""
+    config = current_app.config
+    model_name = config.get('EMBEDDING_MODEL_SENTENCE_TRANSFORMERS')
     if not model_name:
         current_app.logger.error("Sentence Transformers embedding model name not configured.")
         return None
+    backend = config.get('EMBEDDING_BACKEND')
     try:
-        st_ef = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=model_name)
-        current_app.logger.info(f"SentenceTransformer EF initialized with model: {model_name}")
+        st_ef = chroma_registry.get_embedding_function(
+            embedding_backend_key(config),
+            lambda: with_embedding_cache(build_embedding_function(config), config, embedding_model_id(config))
+        )
+        current_app.logger.debug(f"Embedding function ready: backend {backend}, model {model_name}")
         return st_ef
     except Exception as e:
-        current_app.logger.error(f"Failed to initialize SentenceTransformerEmbeddingFunction with model {model_name}: {e}")
+        current_app.logger.error(f"Failed to initialize {backend} embedding function with model {model_name}: {e}")
         return None
 
+def company_collection_name(company_id):
+    """The company's live collection: `company_<id>_kb`, or the versioned one a re-index switched to."""
+    company = db.session.get(Company, company_id) # Usually already in the session's identity map
+    return (company.kb_collection if company and company.kb_collection else None) or f"company_{company_id}_kb"
+
 def get_company_collection(chroma_client, company_id: int, embedding_function):
-    """Gets or creates a ChromaDB collection for a specific company."""
+    """Gets or creates the live ChromaDB collection for a specific company (cached per worker)."""
     if not chroma_client or not company_id or not embedding_function:
         current_app.logger.error(f"Cannot get/create Chroma collection: client_exists={bool(chroma_client)}, company_id={company_id}, ef_exists={bool(embedding_function)}")
         return None
-    collection_name = f"company_{company_id}_kb" # Naming convention for company's KB
+    collection_name = company_collection_name(company_id)
     try:
-        collection = chroma_client.get_or_create_collection(
-            name=collection_name,
-            embedding_function=embedding_function,
-            # metadata={"hnsw:space": "cosine"} # Optional: specify distance metric, cosine is default for ST EFs
+        collection = chroma_registry.get_collection(
+            chroma_client, collection_name, embedding_function,
+            max_size=current_app.config.get('CHROMA_COLLECTION_CACHE_SIZE', 128)
         )
-        current_app.logger.info(f"Retrieved/Created Chroma collection: {collection_name}")
+        current_app.logger.debug(f"Retrieved/Created Chroma collection: {collection_name}")
         return collection
     except Exception as e:
         current_app.logger.error(f"Failed to get/create Chroma collection '{collection_name}': {e}")
         return None
 
+def warm_up_knowledge_base(app):
+    """Loads the Chroma client and embedding model into the registry at startup
+    so the first chat turn does not pay for it."""
+    started = time.perf_counter()
+    with app.app_context():
+        chroma_client = init_chroma_client()
+        st_embedding_function = get_chroma_embedding_function()
+        if not chroma_client or not st_embedding_function:
+            app.logger.warning("Knowledge base warm-up incomplete: ChromaDB client or embedding function unavailable.")
+            return False
+        try:
+            st_embedding_function(["warm-up"]) # Forces the model weights to load
+        except Exception as e:
+            app.logger.warning(f"Embedding model warm-up failed: {e}")
+            return False
+        app.logger.info(f"Knowledge base warm-up complete in {time.perf_counter() - started:.2f}s.")
+        return True
+
+def start_background_warm_up(app):
+    """Starts warm_up_knowledge_base on a daemon thread, unless one is already running."""
+    global _background_warm_up
+    with _background_warm_up_lock:
+        if _background_warm_up is not None and _background_warm_up.is_alive():
+            return _background_warm_up
+        _background_warm_up = threading.Thread(target=warm_up_knowledge_base, args=(app,), name="kb-warm-up", daemon=True)
+        _background_warm_up.start()
+        return _background_warm_up
+
+@timed_stage('kb_collection')
+def get_kb_search_collection(company_id):
+    """The company collection for hybrid retrieval, or None for the keyword-only fast mode.
+
+    When the embedding model isn't loaded yet and KB_KEYWORD_SEARCH_WHEN_COLD is set,
+    the request is served from the keyword index while the model loads in the background.
+    """
+    config = current_app.config
+    if config['KB_RETRIEVAL_MODE'] == 'keyword':
+        return None
+    if config['KB_KEYWORD_SEARCH_WHEN_COLD'] and not chroma_registry.is_warm(
+            config['CHROMA_DB_PATH'], embedding_backend_key(config)):
+        start_background_warm_up(current_app._get_current_object())
+        return None
+    chroma_client = init_chroma_client()
+    st_embedding_function = get_chroma_embedding_function()
+    if not chroma_client or not st_embedding_function:
+        return None
+    return get_company_collection(chroma_client, company_id, st_embedding_function)
+
+def sync_kb_item_vectors(company_id, items=(), deleted_item_ids=()):
+    """Applies committed KB item changes to the company's Chroma collection, touching only those items.
+
+    If Chroma is unavailable or fails, the SQL change stands and a `reconcile_kb` job
+    is queued to repair the index. Returns True when Chroma was updated.
+    """
+    try:
+        st_embedding_function = get_chroma_embedding_function()
+        collection = get_company_collection(init_chroma_client(), company_id, st_embedding_function)
+        if not collection:
+            raise RuntimeError("knowledge base collection unavailable")
+        if deleted_item_ids:
+            delete_item_vectors(collection, deleted_item_ids)
+        if items:
+            upsert_item_vectors(collection, st_embedding_function, items)
+            db.session.commit() # vector_id
+        return True
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Chroma sync failed for company {company_id} (items {[i.id for i in items]}, deleted {list(deleted_item_ids)}): {e}")
+        enqueue_job('reconcile_kb', company_id=company_id)
+        return False
+
+def mark_kb_changed(company_id):
+    """Bumps the company's KB version after items were added or re-indexed.
+
+    Drops cached chatbot answers and queues a refresh of the precomputed
+    suggestions on the company's open tickets (see core/ticket_suggestions.py).
+    """
+    Company.query.filter_by(id=company_id).update({Company.kb_version: db.func.coalesce(Company.kb_version, 0) + 1})
+    db.session.commit()
+    invalidate_company_answers(company_id)
+    enqueue_job('refresh_ticket_suggestions', company_id=company_id)
+
 @kb_bp.route('/manage', methods=['GET', 'POST'])
 @login_required
 def manage_kb():
@@ -78,51 +278,186 @@ def manage_kb():
         flash('Company not found for your user.', 'danger')
         return redirect(url_for('index'))
 
-    chroma_client = init_chroma_client()
-    st_embedding_function = get_chroma_embedding_function()
-
     if form.validate_on_submit():
-        if not chroma_client or not st_embedding_function:
-            flash('ChromaDB service or embedding function is not available. Cannot add item.', 'danger')
-        else:
-            collection = get_company_collection(chroma_client, company.id, st_embedding_function)
-            if not collection:
-                flash(f'Could not access knowledge base collection for company {company.name}.', 'danger')
+        try:
+            new_item = KnowledgeItem(
+                company_id=current_user.company_id,
+                item_type=form.item_type.data,
+                title=form.title.data,
+                content=form.content.data # Store raw content in SQL DB
+            )
+            refresh_content_hash(new_item)
+            db.session.add(new_item)
+            db.session.commit() # Commit to get new_item.id
+
+            # Long items are split into overlapping chunks: "kb_<id>", "kb_<id>_1", ...
+            indexed = sync_kb_item_vectors(company.id, items=[new_item])
+            mark_kb_changed(company.id) # Cached answers and ticket suggestions may now be stale
+            if indexed:
+                flash('Knowledge item added and indexed in ChromaDB!', 'success')
             else:
-                try:
-                    # The document Chroma will embed using its configured SentenceTransformer EF
-                    document_to_embed = f"Title: {form.title.data}\nType: {form.item_type.data}\nContent: {form.content.data}"
-                    
-                    new_item = KnowledgeItem(
-                        company_id=current_user.company_id,
-                        item_type=form.item_type.data,
-                        title=form.title.data,
-                        content=form.content.data # Store raw content in SQL DB
-                    )
-                    db.session.add(new_item)
-                    db.session.commit() # Commit to get new_item.id
-
-                    item_id_str_for_chroma = f"kb_{new_item.id}" # Define ID for Chroma
-                    
-                    collection.add(
-                        documents=[document_to_embed], # Chroma embeds this using its EF
-                        metadatas=[{
-                            "item_db_id": new_item.id, # Store SQL DB ID in metadata
-                            "type": form.item_type.data,
-                            "title": form.title.data,
-                            "company_id": company.id # For potential verification
-                        }],
-                        ids=[item_id_str_for_chroma] # Use our defined ID
-                    )
-                    
-                    new_item.vector_id = item_id_str_for_chroma # Store Chroma ID in our DB
-                    db.session.commit()
-                    flash('Knowledge item added and indexed in ChromaDB!', 'success')
-                    return redirect(url_for('kb.manage_kb'))
-                except Exception as e:
-                    db.session.rollback()
-                    current_app.logger.error(f"Error adding knowledge item to ChromaDB: {e}")
-                    flash(f'Error during ChromaDB operation: {str(e)}', 'danger')
+                flash('Knowledge item saved, but indexing failed; it will be indexed by a background job.', 'warning')
+            return redirect(url_for('kb.manage_kb'))
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Error adding knowledge item: {e}")
+            flash(f'Error adding knowledge item: {str(e)}', 'danger')
             
-    items = KnowledgeItem.query.filter_by(company_id=current_user.company_id).all()
-    return render_template('manage_kb.html', form=form, items=items, title="Manage Knowledge Base")
+    items_query = KnowledgeItem.query.filter_by(company_id=current_user.company_id)
+    total_items = items_query.count()
+    items = items_query.order_by(KnowledgeItem.id.desc()).limit(KB_ITEMS_DISPLAY_LIMIT).all()
+    latest_import_job = BackgroundJob.query.filter_by(company_id=company.id, job_type='index_kb_items')\
+                                           .order_by(BackgroundJob.id.desc()).first()
+    latest_reconcile_job = BackgroundJob.query.filter_by(company_id=company.id, job_type='reconcile_kb')\
+                                              .order_by(BackgroundJob.id.desc()).first()
+    return render_template('manage_kb.html', form=form, import_form=KnowledgeImportForm(), items=items,
+                           total_items=total_items, pending_items=count_pending_items(company.id),
+                           latest_import_job=latest_import_job, latest_reconcile_job=latest_reconcile_job,
+                           delete_form=KnowledgeItemDeleteForm(), reconcile_form=KnowledgeReconcileForm(),
+                           title="Manage Knowledge Base")
+
+
+def _admin_company_item(item_id):
+    """The current admin's KnowledgeItem `item_id`, or None (also for other companies' items)."""
+    if current_user.role != 'admin' or not current_user.company_id:
+        return None
+    return KnowledgeItem.query.filter_by(id=item_id, company_id=current_user.company_id).first()
+
+
+@kb_bp.route('/items/<int:item_id>/edit', methods=['GET', 'POST'])
+@login_required
+def edit_kb_item(item_id):
+    """Updates an item's SQL row, then re-embeds only that item's chunks."""
+    item = _admin_company_item(item_id)
+    if item is None:
+        flash('Knowledge item not found or access denied.', 'danger')
+        return redirect(url_for('kb.manage_kb') if current_user.role == 'admin' else url_for('index'))
+
+    form = KnowledgeItemForm(obj=item)
+    form.submit.label.text = 'Save Changes'
+    if form.validate_on_submit():
+        old_hash = item.content_hash
+        form.populate_obj(item)
+        if refresh_content_hash(item) == old_hash and item.vector_id:
+            flash('No changes to save.', 'info')
+            return redirect(url_for('kb.manage_kb'))
+        item.vector_id = None # Marks it pending until its new chunks are in Chroma
+        db.session.commit()
+        indexed = sync_kb_item_vectors(item.company_id, items=[item])
+        mark_kb_changed(item.company_id)
+        if indexed:
+            flash('Knowledge item updated and re-indexed.', 'success')
+        else:
+            flash('Knowledge item updated, but re-indexing failed; a background job will repair the index.', 'warning')
+        return redirect(url_for('kb.manage_kb'))
+    return render_template('edit_kb_item.html', form=form, item=item, title="Edit Knowledge Item")
+
+
+@kb_bp.route('/items/<int:item_id>/delete', methods=['POST'])
+@login_required
+def delete_kb_item(item_id):
+    """Deletes an item's SQL row, then only that item's chunks from Chroma."""
+    if current_user.role != 'admin' or not current_user.company_id:
+        flash('Access denied.', 'danger')
+        return redirect(url_for('index'))
+    item = _admin_company_item(item_id)
+    if item is None:
+        abort(404)
+
+    delete_form = KnowledgeItemDeleteForm()
+    if not delete_form.validate_on_submit(): # e.g. an expired CSRF token
+        for field, errors in delete_form.errors.items():
+            for error in errors:
+                flash(f'Delete error ({field}): {error}', 'danger')
+        return redirect(url_for('kb.manage_kb'))
+
+    company_id, title = item.company_id, item.title
+    db.session.delete(item)
+    db.session.commit()
+    removed = sync_kb_item_vectors(company_id, deleted_item_ids=[item_id])
+    mark_kb_changed(company_id)
+    if removed:
+        flash(f'Knowledge item "{title}" deleted.', 'success')
+    else:
+        flash(f'Knowledge item "{title}" deleted; its vectors will be removed by a background job.', 'warning')
+    return redirect(url_for('kb.manage_kb'))
+
+
+@kb_bp.route('/reconcile', methods=['POST'])
+@login_required
+def reconcile_kb():
+    """Queues a consistency check/repair of the company's Chroma index against its items."""
+    if current_user.role != 'admin' or not current_user.company_id or not KnowledgeReconcileForm().validate_on_submit():
+        flash('Access denied.', 'danger')
+        return redirect(url_for('index'))
+    job = enqueue_job('reconcile_kb', company_id=current_user.company_id)
+    flash(f'Index check job #{job.id} is {job.status}.', 'info')
+    return redirect(url_for('kb.manage_kb'))
+
+
+@kb_bp.route('/import', methods=['POST'])
+@login_required
+def import_kb():
+    """Bulk import: rows are inserted now, embedding/indexing runs as a background job."""
+    if current_user.role != 'admin' or not current_user.company_id:
+        flash('Access denied.', 'danger')
+        return redirect(url_for('index'))
+
+    import_form = KnowledgeImportForm()
+    if not import_form.validate_on_submit():
+        for field, errors in import_form.errors.items():
+            for error in errors:
+                flash(f'Import error ({field}): {error}', 'danger')
+        return redirect(url_for('kb.manage_kb'))
+
+    upload = import_form.file.data
+    try:
+        records = load_records_from_upload(upload.filename, upload.read(), import_form.item_type.data or None)
+    except (ValueError, UnicodeDecodeError, zipfile.BadZipFile) as e:
+        flash(f'Could not read {upload.filename}: {e}', 'danger')
+        return redirect(url_for('kb.manage_kb'))
+
+    company_id = current_user.company_id
+    inserted, skipped = insert_knowledge_items(company_id, records, batch_size=current_app.config['KB_IMPORT_INSERT_BATCH_SIZE'])
+    current_app.logger.info(f"KB import for company {company_id}: {inserted} inserted, {skipped} duplicates skipped from {upload.filename}")
+    if inserted or count_pending_items(company_id):
+        job = enqueue_job('index_kb_items', company_id=company_id)
+        flash(f'Imported {inserted} items ({skipped} duplicates skipped). Indexing job #{job.id} is {job.status}.', 'success')
+    else:
+        flash(f'No new items found in {upload.filename} ({skipped} duplicates skipped).', 'info')
+    return redirect(url_for('kb.manage_kb'))
+
+
+@register_job_handler('index_kb_items')
+def index_kb_items_job(job, payload):
+    """Embeds every not-yet-indexed KnowledgeItem of the job's company into its Chroma collection."""
+    chroma_client = init_chroma_client()
+    st_embedding_function = get_chroma_embedding_function()
+    collection = get_company_collection(chroma_client, job.company_id, st_embedding_function)
+    if not collection:
+        raise RuntimeError(f"Knowledge base collection unavailable for company {job.company_id}")
+
+    def log_progress(done, total, elapsed):
+        current_app.logger.info(f"KB indexing company {job.company_id}: {done}/{total} items, {done / elapsed if elapsed else 0:.1f} items/s")
+
+    stats = index_pending_items(job.company_id, collection, st_embedding_function,
+                                batch_size=current_app.config['KB_IMPORT_EMBED_BATCH_SIZE'], progress=log_progress)
+    if stats["indexed"]:
+        mark_kb_changed(job.company_id)
+    return stats
+
+
+@register_job_handler('reconcile_kb')
+def reconcile_kb_job(job, payload):
+    """Repairs differences between the company's KnowledgeItem rows and its Chroma chunks (see core/kb_sync.py)."""
+    chroma_client = init_chroma_client()
+    st_embedding_function = get_chroma_embedding_function()
+    collection = get_company_collection(chroma_client, job.company_id, st_embedding_function)
+    if not collection:
+        raise RuntimeError(f"Knowledge base collection unavailable for company {job.company_id}")
+    stats = reconcile_company_kb(job.company_id, collection, st_embedding_function,
+                                 batch_size=current_app.config['KB_IMPORT_EMBED_BATCH_SIZE'])
+    current_app.logger.info(f"KB reconcile company {job.company_id}: {stats}")
+    if stats["reembedded"] or stats["deleted_chunks"]:
+        mark_kb_changed(job.company_id)
+    return stats
@@ -0,0 +1,99 @@
+"""Full-text (keyword) index over KnowledgeItem titles and content.
+
+SQLite uses an external-content FTS5 table kept in sync by triggers; Postgres
+uses a generated `search_vector` tsvector column with a GIN index. Either way
+the index follows every INSERT/UPDATE/DELETE on `knowledge_item`, including
+bulk imports, without application code having to touch it.
+
+The DDL runs after `db.create_all()` creates the table (fresh databases) and
+from migration 5 (existing databases).
+"""
+import re
+
+from sqlalchemy import event, text
+
+from .models import db, KnowledgeItem
+
+FTS_TABLE = 'knowledge_item_fts'
+MAX_QUERY_TERMS = 32
+
+_SQLITE_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(title, content, content='knowledge_item', content_rowid='id')",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON knowledge_item BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON knowledge_item BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF title, content ON knowledge_item BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO {FTS_TABLE}(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END""",
+]
+
+_POSTGRES_DDL = [
+    """ALTER TABLE knowledge_item ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(content, '')), 'B')
+    ) STORED""",
+    "CREATE INDEX IF NOT EXISTS ix_knowledge_item_search_vector ON knowledge_item USING GIN (search_vector)",
+]
+
+
+def create_lexical_index(connection, rebuild=False):
+    """Creates the keyword index for the connection's dialect. Returns False if unsupported."""
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        for statement in _SQLITE_DDL:
+            connection.execute(text(statement))
+        if rebuild: # Index rows that existed before the FTS table
+            connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        return True
+    if dialect == 'postgresql':
+        for statement in _POSTGRES_DDL: # Generated columns are filled for existing rows on creation
+            connection.execute(text(statement))
+        return True
+    return False
+
+
+@event.listens_for(KnowledgeItem.__table__, 'after_create')
+def _create_lexical_index_after_table(target, connection, **kw):
+    create_lexical_index(connection)
+
+
+def query_terms(query_text):
+    """Whitespace-separated terms with surrounding punctuation stripped, so SKUs like 'AB-1234' stay whole."""
+    terms = []
+    for raw in (query_text or '').split():
+        term = raw.strip('.,;:!?()[]{}<>"\'`')
+        if re.search(r'\w', term) and term.lower() not in terms:
+            terms.append(term.lower())
+    return terms[:MAX_QUERY_TERMS]
+
+
+def search_item_ids(company_id, query_text, limit):
+    """Returns KnowledgeItem ids for the company ranked by keyword relevance (best first)."""
+    terms = query_terms(query_text)
+    if not terms:
+        return []
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        # Each term is quoted as an FTS5 string, so punctuation can't break the MATCH syntax;
+        # a hyphenated SKU becomes a phrase of its parts. bm25 weights title matches double.
+        match = " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        rows = db.session.execute(text(
+            f"SELECT k.id FROM {FTS_TABLE} JOIN knowledge_item k ON k.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH :match AND k.company_id = :company_id "
+            f"ORDER BY bm25({FTS_TABLE}, 2.0, 1.0) LIMIT :limit"
+        ), {"match": match, "company_id": company_id, "limit": limit})
+    elif dialect == 'postgresql':
+        params = {f"t{i}": term for i, term in enumerate(terms)}
+        tsquery = " || ".join(f"plainto_tsquery('english', :t{i})" for i in range(len(terms)))
+        rows = db.session.execute(text(
+            f"SELECT id FROM knowledge_item CROSS JOIN (SELECT {tsquery} AS query) q "
+            f"WHERE company_id = :company_id AND search_vector @@ q.query "
+            f"ORDER BY ts_rank_cd(search_vector, q.query) DESC, id LIMIT :limit"
+        ), {**params, "company_id": company_id, "limit": limit})
+    else:
+        return []
+    return [row[0] for row in rows]
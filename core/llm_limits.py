@@ -0,0 +1,335 @@
+"""Single-flight coalescing and concurrency limits for LLM calls.
+
+`SingleFlight` lets identical in-flight `query_llm_groq` calls (same model,
+messages and sampling parameters) share one upstream request: the first caller
+runs it and later callers wait for its result. Coalescing is per worker
+process.
+
+`ConcurrencyLimiter` caps concurrent LLM calls per process and per company,
+with a bounded wait queue and a wait timeout. Because of the per-company cap
+and queue share, one busy company cannot take every slot or fill the whole
+queue. When a call cannot get a slot, `LLMCapacityError` is raised. The chatbot
+blueprint turns it into HTTP 429 with Retry-After, and background jobs retry
+it with backoff.
+
+The async chat path (core/chat_async.py) uses `AsyncConcurrencyLimiter` and
+`AsyncSingleFlight`, one pair per event loop, so waiting calls suspend a task
+rather than block a thread. It has its own, higher caps
+(LLM_ASYNC_MAX_CONCURRENT_CALLS*), because an in-flight call there costs a
+socket, not a worker thread.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+
+from flask import current_app, has_request_context
+
+from .metrics import metrics, record_stage, record_llm_rejection, record_llm_coalesced
+
+
+class LLMCapacityError(Exception):
+    """No LLM slot became available: the wait queue is full or the wait timed out."""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    """Counting semaphore over the whole process plus one per company, with a bounded FIFO-ish wait."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._active_by_company = {}
+        self._waiting_by_company = {}
+
+    def _has_room(self, company_id, max_total, max_per_company):
+        if max_total and self._active >= max_total:
+            return False
+        if company_id is not None and max_per_company and self._active_by_company.get(company_id, 0) >= max_per_company:
+            return False
+        return True
+
+    def _start_waiting(self, company_id, max_queued, max_queued_per_company):
+        """Joins the wait queue, or raises LLMCapacityError when it (or the company's share) is full."""
+        if max_queued is not None and self._waiting >= max_queued:
+            raise self._reject('process', 'queue_full', "Too many LLM requests are waiting; try again shortly.")
+        company_waiting = self._waiting_by_company.get(company_id, 0)
+        if company_id is not None and max_queued_per_company is not None and company_waiting >= max_queued_per_company:
+            raise self._reject('company', 'queue_full', "Too many LLM requests are waiting for your company; try again shortly.")
+        self._waiting += 1
+        self._waiting_by_company[company_id] = company_waiting + 1
+
+    def _stop_waiting(self, company_id):
+        self._waiting -= 1
+        self._waiting_by_company[company_id] -= 1
+        if not self._waiting_by_company[company_id]:
+            del self._waiting_by_company[company_id]
+
+    def _timed_out(self, max_total):
+        return self._reject('process' if max_total and self._active >= max_total else 'company', 'timeout',
+                            "The assistant is busy; try again shortly.")
+
+    def _take(self, company_id):
+        self._active += 1
+        self._active_by_company[company_id] = self._active_by_company.get(company_id, 0) + 1
+
+    def _give(self, company_id):
+        self._active -= 1
+        self._active_by_company[company_id] -= 1
+        if not self._active_by_company[company_id]:
+            del self._active_by_company[company_id]
+
+    def acquire(self, company_id, max_total, max_per_company, max_queued, max_queued_per_company, timeout):
+        """Takes a slot for `company_id` (None: process limit only), waiting up to `timeout` seconds."""
+        with self._condition:
+            if not self._has_room(company_id, max_total, max_per_company):
+                self._start_waiting(company_id, max_queued, max_queued_per_company)
+                try:
+                    deadline = time.monotonic() + timeout
+                    while not self._has_room(company_id, max_total, max_per_company):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise self._timed_out(max_total)
+                        self._condition.wait(remaining)
+                finally:
+                    self._stop_waiting(company_id)
+            self._take(company_id)
+
+    def release(self, company_id):
+        with self._condition:
+            self._give(company_id)
+            self._condition.notify_all()
+
+    @staticmethod
+    def _reject(scope, reason, message):
+        record_llm_rejection(scope, reason)
+        return LLMCapacityError(message)
+
+    def stats(self):
+        with self._condition:
+            return {"active": self._active, "waiting": self._waiting,
+                    "active_by_company": dict(self._active_by_company)}
+
+
+class AsyncConcurrencyLimiter(ConcurrencyLimiter):
+    """The same limits for coroutines on one event loop: a waiting call suspends its task, not a thread."""
+
+    def __init__(self):
+        super().__init__()
+        self._async_condition = asyncio.Condition()
+
+    async def acquire_async(self, company_id, max_total, max_per_company, max_queued, max_queued_per_company, timeout):
+        async with self._async_condition:
+            if not self._has_room(company_id, max_total, max_per_company):
+                self._start_waiting(company_id, max_queued, max_queued_per_company)
+                try:
+                    await asyncio.wait_for(self._async_condition.wait_for(
+                        lambda: self._has_room(company_id, max_total, max_per_company)), timeout)
+                except asyncio.TimeoutError:
+                    raise self._timed_out(max_total) from None
+                finally:
+                    self._stop_waiting(company_id)
+            self._take(company_id)
+
+    async def release_async(self, company_id):
+        async with self._async_condition:
+            self._give(company_id)
+            self._async_condition.notify_all()
+
+    def stats(self):
+        # Only touched from the loop's thread; the gauges read it without the (async) lock.
+        return {"active": self._active, "waiting": self._waiting,
+                "active_by_company": dict(self._active_by_company)}
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs one call per key at a time; concurrent callers with the same key share its outcome."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, fn, wait_timeout):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            if not flight.done.wait(wait_timeout):
+                return fn() # The leader is stuck; don't hang this request on it
+            record_llm_coalesced()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines: followers await the leader's future instead of blocking a thread."""
+
+    def __init__(self):
+        self._flights = {}
+
+    async def do(self, key, fn, wait_timeout):
+        flight = self._flights.get(key)
+        if flight is not None:
+            try:
+                result = await asyncio.wait_for(asyncio.shield(flight), wait_timeout)
+            except asyncio.TimeoutError:
+                return await fn()
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise
+                return await fn() # The leader's client went away mid-call; this request still wants its answer
+            record_llm_coalesced()
+            return result
+        flight = self._flights[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+            flight.set_result(result)
+            return result
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                flight.cancel()
+            else:
+                flight.set_exception(e)
+                flight.exception() # Marks it retrieved when no follower was waiting
+            raise
+        finally:
+            self._flights.pop(key, None)
+
+
+llm_limiter = ConcurrencyLimiter()
+llm_single_flight = SingleFlight()
+# Async counterparts, one per event loop (an ASGI worker runs one loop; see core/chat_async.py).
+_async_limits = weakref.WeakKeyDictionary()
+
+
+def async_llm_limits():
+    """Returns (AsyncConcurrencyLimiter, AsyncSingleFlight) for the running event loop."""
+    loop = asyncio.get_running_loop()
+    limits = _async_limits.get(loop)
+    if limits is None:
+        limits = _async_limits[loop] = (AsyncConcurrencyLimiter(), AsyncSingleFlight())
+    return limits
+
+
+def _llm_limiter_stats(key):
+    return llm_limiter.stats()[key] + sum(limiter.stats()[key] for limiter, _ in list(_async_limits.values()))
+
+
+metrics.gauge('voss_llm_inflight', "LLM calls holding a concurrency slot in this worker.", lambda: _llm_limiter_stats("active"))
+metrics.gauge('voss_llm_queued', "LLM calls waiting for a concurrency slot in this worker.", lambda: _llm_limiter_stats("waiting"))
+
+
+def current_company_id():
+    """The logged-in user's company inside a request, else None (background jobs pass theirs explicitly)."""
+    if not has_request_context():
+        return None
+    from flask_login import current_user
+    return getattr(current_user, 'company_id', None) if current_user and current_user.is_authenticated else None
+
+
+class LLMSlot:
+    """A held LLM concurrency slot. Release is idempotent and also runs if the holder is garbage collected,
+    so a streaming response that is never iterated does not leak its slot."""
+
+    def __init__(self, company_id=None):
+        config = current_app.config
+        self.company_id = company_id if company_id is not None else current_company_id()
+        started = time.perf_counter()
+        llm_limiter.acquire(self.company_id,
+                            max_total=config['LLM_MAX_CONCURRENT_CALLS'],
+                            max_per_company=config['LLM_MAX_CONCURRENT_CALLS_PER_COMPANY'],
+                            max_queued=config['LLM_MAX_QUEUED_CALLS'],
+                            max_queued_per_company=config['LLM_MAX_QUEUED_CALLS_PER_COMPANY'],
+                            timeout=config['LLM_QUEUE_TIMEOUT_SECONDS'])
+        record_stage('llm_queue_wait', time.perf_counter() - started)
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            llm_limiter.release(self.company_id)
+
+    def __del__(self):
+        if not getattr(self, '_released', True):
+            self.release()
+
+
+@contextmanager
+def llm_slot(company_id=None):
+    """Holds one LLM concurrency slot for `company_id` (defaults to the current user's company)."""
+    slot = LLMSlot(company_id)
+    try:
+        yield slot
+    finally:
+        slot.release()
+
+
+def coalesce_key(company_id, model, messages, temperature, max_tokens):
+    # Scoped to the company: a follower shares the leader's outcome, including its per-company capacity error
+    payload = json.dumps([company_id, model, messages, temperature, max_tokens], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def coalesced(key, fn):
+    """Runs `fn()` once for concurrent callers with the same `key` when LLM_SINGLE_FLIGHT_ENABLED is set."""
+    config = current_app.config
+    if not config.get('LLM_SINGLE_FLIGHT_ENABLED'):
+        return fn()
+    wait_timeout = config['LLM_QUEUE_TIMEOUT_SECONDS'] + config['LLM_TIMEOUT_SECONDS'] * (config['LLM_MAX_RETRIES'] + 1)
+    return llm_single_flight.do(key, fn, wait_timeout)
+
+
+@asynccontextmanager
+async def async_llm_slot(company_id):
+    """llm_slot for the async path, capped by LLM_ASYNC_MAX_CONCURRENT_CALLS(_PER_COMPANY)."""
+    config = current_app.config
+    limiter, _ = async_llm_limits()
+    started = time.perf_counter()
+    await limiter.acquire_async(company_id,
+                                max_total=config['LLM_ASYNC_MAX_CONCURRENT_CALLS'],
+                                max_per_company=config['LLM_ASYNC_MAX_CONCURRENT_CALLS_PER_COMPANY'],
+                                max_queued=config['LLM_MAX_QUEUED_CALLS'],
+                                max_queued_per_company=config['LLM_MAX_QUEUED_CALLS_PER_COMPANY'],
+                                timeout=config['LLM_QUEUE_TIMEOUT_SECONDS'])
+    record_stage('llm_queue_wait', time.perf_counter() - started)
+    try:
+        yield
+    finally:
+        await limiter.release_async(company_id)
+
+
+async def async_coalesced(key, fn):
+    """coalesced() for coroutine functions: `await fn()` runs once for concurrent callers with the same key."""
+    config = current_app.config
+    if not config.get('LLM_SINGLE_FLIGHT_ENABLED'):
+        return await fn()
+    _, single_flight = async_llm_limits()
+    wait_timeout = config['LLM_QUEUE_TIMEOUT_SECONDS'] + config['LLM_TIMEOUT_SECONDS'] * (config['LLM_MAX_RETRIES'] + 1)
+    return await single_flight.do(key, fn, wait_timeout)
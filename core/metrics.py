@@ -0,0 +1,247 @@
+"""Lightweight per-request stage timing and Prometheus-format metrics.
+
+`stage(name)` (context manager) and `timed_stage(name)` (decorator) time a
+piece of work, add it to the current request's stage breakdown in `flask.g`
+and observe it in the `voss_stage_duration_seconds` histogram. `init_metrics`
+times every request, logs requests slower than SLOW_REQUEST_MS with their
+stage breakdown, and serves everything at `/metrics` in the Prometheus text
+format. Outside debug/testing, `/metrics` requires METRICS_TOKEN as a bearer
+token and returns 404 when no token is configured. Metrics live in the worker
+process; scrape each worker (or run a single worker per container) for
+complete numbers.
+"""
+import hmac
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Response, current_app, g, has_app_context, has_request_context, request
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values)) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {} # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', repr(bound))])} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]!r}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """A gauge read from a callback at scrape time."""
+
+    def __init__(self, name, documentation, callback):
+        self.name, self.documentation, self.callback = name, documentation, callback
+
+    def render(self):
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {_format_value(value)}"]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, callback):
+        return self.register(Gauge(name, documentation, callback))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+REQUEST_DURATION = metrics.histogram('voss_request_duration_seconds', "HTTP request latency (streamed bodies excluded).",
+                                     ['endpoint', 'method', 'status'])
+STAGE_DURATION = metrics.histogram('voss_stage_duration_seconds', "Time spent in a named stage of a request or job.",
+                                   ['endpoint', 'stage'])
+LLM_REQUESTS = metrics.counter('voss_llm_requests_total', "LLM completions by model and outcome.", ['model', 'mode', 'outcome'])
+LLM_TOKENS = metrics.counter('voss_llm_tokens_total', "LLM tokens by model and kind (prompt/completion).", ['model', 'kind'])
+LLM_LIMITER_REJECTIONS = metrics.counter('voss_llm_limiter_rejections_total', "LLM calls refused a concurrency slot.",
+                                         ['scope', 'reason'])
+LLM_COALESCED = metrics.counter('voss_llm_coalesced_total', "LLM calls answered by an identical in-flight call.")
+PROMPT_TOKENS = metrics.histogram('voss_prompt_tokens', "Approximate tokens per prompt section.", ['prompt', 'section'],
+                                  buckets=(50, 100, 250, 500, 1000, 2000, 4000, 8000))
+PROMPT_TRUNCATIONS = metrics.counter('voss_prompt_truncations_total', "Prompt sections cut to fit their budget or the window.",
+                                     ['prompt', 'section'])
+CACHE_REQUESTS = metrics.counter('voss_cache_requests_total', "Cache lookups by cache and result (hit/miss).", ['cache', 'result'])
+
+
+def _metrics_enabled():
+    return has_app_context() and current_app.config.get('METRICS_ENABLED', False)
+
+
+def record_stage(name, seconds):
+    """Adds `seconds` to the request's stage breakdown and the stage histogram."""
+    if not _metrics_enabled():
+        return
+    endpoint = (request.endpoint or 'unknown') if has_request_context() else 'background'
+    STAGE_DURATION.observe(seconds, endpoint=endpoint, stage=name)
+    timings = g.setdefault('stage_timings', {})
+    timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def timed_stage(name):
+    def decorate(fn):
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return timed
+    return decorate
+
+
+def record_llm_call(model, mode, outcome, prompt_tokens=None, completion_tokens=None):
+    if not _metrics_enabled():
+        return
+    LLM_REQUESTS.inc(model=model, mode=mode, outcome=outcome)
+    if prompt_tokens:
+        LLM_TOKENS.inc(prompt_tokens, model=model, kind='prompt')
+    if completion_tokens:
+        LLM_TOKENS.inc(completion_tokens, model=model, kind='completion')
+
+
+def record_llm_rejection(scope, reason):
+    if _metrics_enabled():
+        LLM_LIMITER_REJECTIONS.inc(scope=scope, reason=reason)
+
+
+def record_llm_coalesced():
+    if _metrics_enabled():
+        LLM_COALESCED.inc()
+
+
+def record_prompt_tokens(prompt, sections):
+    """Observes the token count of each named section of an LLM prompt, e.g. {'history': 120, 'kb': 800}."""
+    if not _metrics_enabled():
+        return
+    for section, tokens in sections.items():
+        PROMPT_TOKENS.observe(tokens, prompt=prompt, section=section)
+
+
+def record_prompt_truncation(prompt, section):
+    if _metrics_enabled():
+        PROMPT_TRUNCATIONS.inc(prompt=prompt, section=section)
+
+
+def record_cache_lookup(cache, hit, count=1):
+    if _metrics_enabled() and count:
+        CACHE_REQUESTS.inc(count, cache=cache, result='hit' if hit else 'miss')
+
+
+def init_metrics(app):
+    """Registers request timing, the slow-request log and the /metrics endpoint."""
+    if not app.config.get('METRICS_ENABLED'):
+        return
+
+    @app.before_request
+    def _start_request_timer():
+        g.request_started = time.perf_counter()
+        g.stage_timings = {}
+
+    @app.after_request
+    def _observe_request(response):
+        started = g.get('request_started')
+        if started is None or request.endpoint == 'metrics':
+            return response
+        elapsed = time.perf_counter() - started
+        REQUEST_DURATION.observe(elapsed, endpoint=request.endpoint or 'unknown', method=request.method,
+                                 status=response.status_code)
+        slow_ms = app.config.get('SLOW_REQUEST_MS')
+        if slow_ms and elapsed * 1000 >= slow_ms:
+            breakdown = ", ".join(f"{name}={seconds * 1000:.0f}ms"
+                                  for name, seconds in sorted(g.get('stage_timings', {}).items(), key=lambda s: -s[1]))
+            app.logger.warning(f"Slow request {request.method} {request.path} ({request.endpoint}) "
+                               f"{elapsed * 1000:.0f}ms -> {response.status_code}; stages: {breakdown or 'none recorded'}")
+        return response
+
+    def metrics_view():
+        token = app.config.get('METRICS_TOKEN')
+        if not token and not (app.debug or app.testing): # Checked per request: app.run(debug=True) sets debug late
+            return Response("Not Found\n", status=404, mimetype='text/plain')
+        if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+            return Response("Unauthorized\n", status=401, mimetype='text/plain')
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
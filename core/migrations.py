@@ -0,0 +1,166 @@
+"""Lightweight, ordered schema migrations for existing SQLite and Postgres databases.
+
+`db.create_all()` only creates missing tables; it never adds indexes or columns
+to tables that already exist. Each migration below is a small idempotent
+function run against an open connection, and applied versions are recorded in
+the `schema_migration` table. Fresh databases built with `db.create_all()` are
+stamped as fully migrated (see scripts/init_db.py). create_app calls
+`migrate_on_startup`, so an existing database is brought up to date before the
+first request rather than only when scripts/migrate_db.py is run.
+"""
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+
+from .models import (db, SchemaMigration, Company, Ticket, ChatMessage, KnowledgeItem, BackgroundJob, TicketSuggestion,
+                     ChatSessionSummary, TicketSimilarity)
+from .lexical_index import create_lexical_index
+from .search import create_search_index
+
+MIGRATIONS = [] # (version, description, fn) in apply order
+
+
+def migration(version, description):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+def _create_indexes(connection, model, *index_names):
+    indexes = {index.name: index for index in model.__table__.indexes}
+    for name in index_names:
+        indexes[name].create(bind=connection, checkfirst=True)
+
+
+def _add_column_if_missing(connection, model, column_name):
+    table = model.__table__
+    existing = {column['name'] for column in inspect(connection).get_columns(table.name)}
+    if column_name in existing:
+        return False
+    column = table.c[column_name]
+    column_type = column.type.compile(dialect=connection.dialect)
+    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+    return True
+
+
+@migration(1, "Composite indexes for chat history, ticket lists and KB lookups")
+def _add_hot_path_indexes(connection):
+    _create_indexes(connection, Ticket, 'ix_ticket_company_status_agent_updated',
+                    'ix_ticket_customer_company_status_updated', 'ix_ticket_company_updated')
+    _create_indexes(connection, ChatMessage, 'ix_chat_message_session_company_ts', 'ix_chat_message_ticket_ts')
+    _create_indexes(connection, KnowledgeItem, 'ix_knowledge_item_company')
+
+
+@migration(2, "Background job table for deferred ticket categorization")
+def _add_background_jobs(connection):
+    BackgroundJob.__table__.create(bind=connection, checkfirst=True)
+
+
+@migration(3, "KnowledgeItem.content_hash for idempotent bulk imports")
+def _add_knowledge_item_content_hash(connection):
+    _add_column_if_missing(connection, KnowledgeItem, 'content_hash')
+    _create_indexes(connection, KnowledgeItem, 'ix_knowledge_item_company_hash')
+    table = KnowledgeItem.__table__
+    rows = connection.execute(table.select().where(table.c.content_hash == None)).fetchall()
+    for row in rows:
+        document = KnowledgeItem.build_document(row.title, row.item_type, row.content)
+        connection.execute(table.update().where(table.c.id == row.id)
+                           .values(content_hash=KnowledgeItem.hash_document(document)))
+
+
+@migration(4, "Company.kb_version and precomputed ticket suggestions")
+def _add_ticket_suggestions(connection):
+    _add_column_if_missing(connection, Company, 'kb_version')
+    connection.execute(Company.__table__.update().where(Company.__table__.c.kb_version == None).values(kb_version=0))
+    TicketSuggestion.__table__.create(bind=connection, checkfirst=True)
+
+
+@migration(5, "Keyword index over knowledge items (FTS5 / tsvector)")
+def _add_knowledge_item_lexical_index(connection):
+    create_lexical_index(connection, rebuild=True)
+
+
+@migration(6, "Rolling chat session summaries")
+def _add_chat_session_summaries(connection):
+    ChatSessionSummary.__table__.create(bind=connection, checkfirst=True)
+
+
+@migration(7, "Company.kb_collection for blue/green KB re-indexing")
+def _add_company_kb_collection(connection):
+    _add_column_if_missing(connection, Company, 'kb_collection')
+
+
+@migration(8, "Full-text search over tickets and chat messages (FTS5 / tsvector)")
+def _add_ticket_and_message_search_index(connection):
+    create_search_index(connection, 'ticket', rebuild=True)
+    create_search_index(connection, 'chat_message', rebuild=True)
+
+
+@migration(9, "Ticket embedding index state for duplicate detection")
+def _add_ticket_similarity(connection):
+    TicketSimilarity.__table__.create(bind=connection, checkfirst=True)
+
+
+@migration(10, "Background job index for pending-job checks")
+def _add_background_job_type_status_index(connection):
+    _create_indexes(connection, BackgroundJob, 'ix_background_job_type_status')
+
+
+def applied_versions():
+    table = SchemaMigration.__table__
+    with db.engine.begin() as connection:
+        table.create(bind=connection, checkfirst=True)
+        return {row.version for row in connection.execute(table.select())}
+
+
+def pending_migrations():
+    applied = applied_versions()
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+
+def apply_migrations(logger=None):
+    """Applies every pending migration, each in its own transaction. Returns the applied versions."""
+    applied_now = []
+    for version, description, fn in pending_migrations():
+        if logger:
+            logger.info(f"Applying migration {version}: {description}")
+        with db.engine.begin() as connection:
+            fn(connection)
+            connection.execute(SchemaMigration.__table__.insert().values(
+                version=version, description=description, applied_at=datetime.utcnow()))
+        applied_now.append(version)
+    return applied_now
+
+
+def stamp_migrations():
+    """Marks every migration as applied, for databases just built by `db.create_all()`."""
+    applied = applied_versions()
+    for version, description, _ in MIGRATIONS:
+        if version not in applied:
+            db.session.add(SchemaMigration(version=version, description=description))
+    db.session.commit()
+
+
+def migrate_on_startup(app):
+    """Applies pending migrations to an existing database when the app starts (DB_MIGRATE_ON_STARTUP).
+
+    An empty database is left alone: scripts/init_db.py (or app.py's local
+    entry point) builds and stamps it. A failure, e.g. a read-only bundled
+    SQLite file, is logged rather than raised, so the app still starts.
+    """
+    if not app.config.get('DB_MIGRATE_ON_STARTUP'):
+        return []
+    with app.app_context():
+        try:
+            if not inspect(db.engine).has_table(Company.__table__.name):
+                return []
+            if not pending_migrations():
+                return []
+            db.create_all() # Brand-new tables; the migrations then add indexes and columns to existing ones
+            return apply_migrations(logger=app.logger)
+        except OperationalError as e:
+            app.logger.error(f"Could not apply schema migrations on startup (run scripts/migrate_db.py): {e}")
+            return []
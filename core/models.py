@@ -2,6 +2,7 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+import hashlib
 
 db = SQLAlchemy()
 
@@ -12,11 +13,14 @@ class Company(db.Model):
     # This field is not strictly needed for ChromaDB integration as implemented.
     # It can be repurposed or removed in a future refactor if not used for other multi-tenant vector store strategies.
     pinecone_namespace = db.Column(db.String(100), unique=True, nullable=False) 
+    kb_version = db.Column(db.Integer, default=0) # Bumped whenever the company's KB changes; keys cached suggestions
+    kb_collection = db.Column(db.String(100)) # Live Chroma collection after a re-index (core/kb_reindex.py); None means company_<id>_kb
     users = db.relationship('User', backref='company', lazy=True)
     knowledge_items = db.relationship('KnowledgeItem', backref='company', lazy=True)
     tickets = db.relationship('Ticket', backref='company', lazy=True)
 
 class User(UserMixin, db.Model):
+    # email is unique, so login lookups by email are already served by its unique index.
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -31,15 +35,52 @@ class User(UserMixin, db.Model):
         return check_password_hash(self.password_hash, password)
 
 class KnowledgeItem(db.Model):
+    __table_args__ = (
+        db.Index('ix_knowledge_item_company', 'company_id'),
+        db.Index('ix_knowledge_item_company_hash', 'company_id', 'content_hash'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
     item_type = db.Column(db.String(50)) 
     title = db.Column(db.String(200))
     content = db.Column(db.Text, nullable=False) 
     vector_id = db.Column(db.String(100)) # ID of the vector in ChromaDB (custom defined, e.g., "kb_ITEMID")
+    content_hash = db.Column(db.String(64)) # sha256 of the embedded document, used for idempotent imports
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    @staticmethod
+    def build_document(title, item_type, content):
+        """The text Chroma embeds for a knowledge item."""
+        return f"Title: {title}\nType: {item_type}\nContent: {content}"
+
+    @staticmethod
+    def hash_document(document):
+        return hashlib.sha256(document.encode('utf-8')).hexdigest()
+
+    def to_document(self):
+        return KnowledgeItem.build_document(self.title, self.item_type, self.content)
+
+    def chroma_id(self):
+        return f"kb_{self.id}"
+
+    def chroma_metadata(self):
+        return {
+            "item_db_id": self.id, # Store SQL DB ID in metadata
+            "type": self.item_type,
+            "title": self.title,
+            "company_id": self.company_id, # For potential verification
+            "content_hash": self.content_hash or "" # Item version the chunks were embedded from (core/kb_sync.py)
+        }
+
 class Ticket(db.Model):
+    __table_args__ = (
+        # Agent queue: company + status (+ assignee), newest first
+        db.Index('ix_ticket_company_status_agent_updated', 'company_id', 'status', 'agent_id', 'updated_at'),
+        # Customer's own tickets / open-ticket lookup during chat handoff
+        db.Index('ix_ticket_customer_company_status_updated', 'customer_id', 'company_id', 'status', 'updated_at'),
+        # Admin list: all company tickets, keyset-paginated on (updated_at, id)
+        db.Index('ix_ticket_company_updated', 'company_id', 'updated_at', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     customer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     agent_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
@@ -52,8 +93,16 @@ class Ticket(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     chat_history_reference = db.Column(db.Text) 
+    customer = db.relationship('User', foreign_keys=[customer_id], lazy='select')
+    agent = db.relationship('User', foreign_keys=[agent_id], lazy='select')
 
 class ChatMessage(db.Model):
+    __table_args__ = (
+        # Chat history for a session, ordered by time
+        db.Index('ix_chat_message_session_company_ts', 'session_id', 'company_id', 'timestamp'),
+        # Ticket conversation view, ordered by time
+        db.Index('ix_chat_message_ticket_ts', 'ticket_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     ticket_id = db.Column(db.Integer, db.ForeignKey('ticket.id'), nullable=True) 
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True) # Nullable for bot messages
@@ -62,3 +111,71 @@ class ChatMessage(db.Model):
     sender_type = db.Column(db.String(20)) 
     message_text = db.Column(db.Text, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    user = db.relationship('User', lazy='select')
+
+
+class SchemaMigration(db.Model):
+    """Records which migrations in core/migrations.py have been applied to this database."""
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200))
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class BackgroundJob(db.Model):
+    """A unit of deferred work (e.g. LLM ticket categorization) run by the worker pool in core/jobs.py."""
+    __table_args__ = (
+        db.Index('ix_background_job_ticket_type', 'ticket_id', 'job_type'),
+        # Pending-job checks, e.g. one summarization job per chat session
+        db.Index('ix_background_job_type_status', 'job_type', 'status'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), default='queued', nullable=False) # 'queued', 'running', 'succeeded', 'failed'
+    ticket_id = db.Column(db.Integer, db.ForeignKey('ticket.id'), nullable=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=True)
+    payload = db.Column(db.Text) # JSON-encoded job arguments
+    result = db.Column(db.Text)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=3, nullable=False)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+class TicketSuggestion(db.Model):
+    """Precomputed KB suggestions for a ticket, valid while `content_key` matches the ticket text + KB version.
+
+    Kept out of the Ticket row so refreshing suggestions never touches `Ticket.updated_at`.
+    """
+    ticket_id = db.Column(db.Integer, db.ForeignKey('ticket.id'), primary_key=True)
+    content_key = db.Column(db.String(64), nullable=False) # sha256 of KB version + subject + description
+    suggestions = db.Column(db.Text, nullable=False) # JSON list of {"title", "content_snippet", "id"}
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class TicketSimilarity(db.Model):
+    """A ticket's entry in the company ticket embedding index (core/ticket_similarity.py).
+
+    `duplicate_of_id` is the earlier open ticket this one nearly duplicates, if any. Kept out of the
+    Ticket row so indexing never touches `Ticket.updated_at`.
+    """
+    __table_args__ = (
+        db.Index('ix_ticket_similarity_duplicate_of', 'duplicate_of_id'),
+    )
+    ticket_id = db.Column(db.Integer, db.ForeignKey('ticket.id'), primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False) # sha256 of the embedded text
+    duplicate_of_id = db.Column(db.Integer, db.ForeignKey('ticket.id'), nullable=True)
+    duplicate_score = db.Column(db.Float) # Cosine similarity to duplicate_of_id
+    indexed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ChatSessionSummary(db.Model):
+    """Rolling summary of a chat session's older messages (see core/chat_summary.py).
+
+    Messages with id <= `summarized_until_id` are represented only by `summary` in the prompt.
+    """
+    session_id = db.Column(db.String(100), primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
+    summary = db.Column(db.Text, nullable=False, default='')
+    summarized_until_id = db.Column(db.Integer, nullable=False, default=0) # Last ChatMessage.id folded into the summary
+    summary_tokens = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
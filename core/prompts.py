@@ -0,0 +1,131 @@
+"""Token-budgeted prompt assembly shared by every LLM call site.
+
+A `PromptBuilder` collects named sections (KB context, history, user input,
+...) with an optional per-section token budget and a priority. `build()`
+first trims each section to its own budget, then, if the prompt still does
+not fit the model window (LLM_CONTEXT_WINDOW_TOKENS minus the completion's
+max_tokens), shrinks the lowest-priority sections first until it does.
+Sections given as a list of blocks (chat messages, KB passages) lose whole
+blocks before any block is cut. Final token counts per section are recorded in
+the `voss_prompt_tokens` histogram, and truncations are counted.
+
+Tokens are counted locally with `utils.count_tokens` (a word/punctuation
+split). LLM_TOKEN_ESTIMATE_FACTOR converts those counts to model tokens when
+checking the window.
+"""
+import math
+from dataclasses import dataclass, field
+
+from flask import current_app
+
+from .metrics import record_prompt_tokens, record_prompt_truncation
+from .utils import count_tokens, truncate_to_tokens
+
+
+@dataclass
+class PromptSection:
+    name: str # None for fixed text, which is never truncated or reported
+    blocks: list
+    budget: int = None # Max counted tokens for this section; None means only the window limits it
+    priority: int = 0 # Lower priorities are shrunk first when the prompt does not fit
+    keep: str = 'head' # Which end survives truncation: 'head' (start) or 'tail' (most recent)
+    prefix: str = "" # Heading emitted before the content (dropped along with an emptied section)
+    suffix: str = ""
+    separator: str = "\n"
+    empty_text: str = "" # Emitted instead when the section ends up empty
+    truncated: bool = False
+
+    def tokens(self):
+        framing = count_tokens(self.prefix) + count_tokens(self.suffix) if self.blocks else 0
+        return sum(count_tokens(block) for block in self.blocks) + framing
+
+    def shrink_to(self, max_tokens):
+        """Drops whole blocks from the far end, then cuts the last surviving block."""
+        if self.tokens() <= max_tokens:
+            return
+        self.truncated = True
+        content_budget = max_tokens - count_tokens(self.prefix) - count_tokens(self.suffix)
+        blocks = self.blocks if self.keep == 'head' else list(reversed(self.blocks))
+        kept, used = [], 0
+        for block in blocks:
+            block_tokens = count_tokens(block)
+            if used + block_tokens <= content_budget:
+                kept.append(block)
+                used += block_tokens
+                continue
+            remainder = truncate_to_tokens(block, content_budget - used, self.keep)
+            if remainder and (not kept or content_budget - used > 20): # Skip slivers of a trailing block
+                kept.append(remainder)
+            break
+        self.blocks = kept if self.keep == 'head' else list(reversed(kept))
+
+    def render(self):
+        if not self.blocks:
+            return self.empty_text
+        return self.prefix + self.separator.join(self.blocks) + self.suffix
+
+
+@dataclass
+class BuiltPrompt:
+    system: str
+    prompt: str
+    max_tokens: int
+    tokens: dict = field(default_factory=dict) # section -> counted tokens, plus 'system' and 'total'
+    truncated: list = field(default_factory=list)
+
+
+class PromptBuilder:
+    """Assembles `system` + ordered sections into a prompt that fits the model's context window."""
+
+    def __init__(self, name, system="", max_tokens=500):
+        self.name = name
+        self.system = system
+        self.max_tokens = max_tokens
+        self.sections = []
+
+    def add(self, name, content, budget=None, priority=0, keep='head', prefix="", suffix="", separator="\n", empty_text=""):
+        """Adds a section. `content` is a string or a list of blocks (e.g. messages, KB passages)."""
+        if isinstance(content, str):
+            blocks = [content] if content else []
+        else:
+            blocks = [block for block in content if block]
+        self.sections.append(PromptSection(name, blocks, budget, priority, keep, prefix, suffix, separator, empty_text))
+        return self
+
+    def text(self, content):
+        """Adds fixed text (instructions, the answer cue) that is never truncated."""
+        return self.add(None, content, priority=math.inf)
+
+    def available_tokens(self):
+        """Counted-token room for system + prompt once the completion is reserved."""
+        config = current_app.config
+        window = config['LLM_CONTEXT_WINDOW_TOKENS'] - self.max_tokens - config['LLM_PROMPT_OVERHEAD_TOKENS']
+        return max(int(window / config['LLM_TOKEN_ESTIMATE_FACTOR']), 0)
+
+    def build(self):
+        for section in self.sections:
+            if section.budget is not None:
+                section.shrink_to(section.budget)
+
+        fixed_tokens = count_tokens(self.system)
+        overflow = fixed_tokens + sum(section.tokens() for section in self.sections) - self.available_tokens()
+        for section in sorted(self.sections, key=lambda s: s.priority):
+            if overflow <= 0 or section.priority == math.inf:
+                break
+            before = section.tokens()
+            section.shrink_to(max(before - overflow, 0))
+            overflow -= before - section.tokens()
+        if overflow > 0:
+            current_app.logger.warning(f"Prompt '{self.name}' exceeds the context window by ~{overflow} tokens after truncation.")
+
+        prompt = "".join(section.render() for section in self.sections)
+        tokens = {section.name: section.tokens() for section in self.sections if section.name}
+        tokens['system'] = fixed_tokens
+        tokens['total'] = fixed_tokens + count_tokens(prompt)
+        truncated = [section.name for section in self.sections if section.truncated]
+        record_prompt_tokens(self.name, tokens)
+        if truncated:
+            for section_name in truncated:
+                record_prompt_truncation(self.name, section_name)
+            current_app.logger.info(f"Prompt '{self.name}' truncated sections {truncated}; tokens {tokens}")
+        return BuiltPrompt(self.system, prompt, self.max_tokens, tokens, truncated)
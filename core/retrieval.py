@@ -0,0 +1,174 @@
+"""Chunk-level knowledge-base indexing and token-budgeted retrieval.
+
+Knowledge items are split into overlapping chunks before they are embedded,
+so long guides are not truncated by MiniLM's input window. Each chunk carries
+its parent `item_db_id`; the first chunk keeps the item's `kb_<id>` id and the
+following ones are `kb_<id>_<n>`. At query time, chunk hits are grouped by
+parent item and the KB context block is assembled to a fixed token budget.
+
+`hybrid_kb_items` fuses those dense hits with the keyword index in
+core/lexical_index.py by reciprocal-rank fusion; with no collection it runs the
+keyword leg alone, which needs no embedding model at all.
+"""
+from collections import OrderedDict
+
+from flask import current_app
+
+from .models import KnowledgeItem
+from .utils import TOKEN_PATTERN, count_tokens, truncate_to_tokens
+from .lexical_index import search_item_ids
+from .metrics import stage, timed_stage
+
+
+def split_into_chunks(text, chunk_tokens, overlap_tokens):
+    """Splits text into windows of ~chunk_tokens tokens overlapping by overlap_tokens, preserving the original text."""
+    spans = [m.span() for m in TOKEN_PATTERN.finditer(text or "")]
+    if not spans:
+        return []
+    if len(spans) <= chunk_tokens:
+        return [text.strip()]
+    step = max(1, chunk_tokens - overlap_tokens)
+    chunks = []
+    for start in range(0, len(spans), step):
+        end = min(start + chunk_tokens, len(spans))
+        chunks.append(text[spans[start][0]:spans[end - 1][1]])
+        if end == len(spans):
+            break
+    return chunks
+
+
+def item_chunk_records(item):
+    """Returns (ids, documents, metadatas) for all chunks of a KnowledgeItem."""
+    chunks = split_into_chunks(item.content, current_app.config['KB_CHUNK_TOKENS'],
+                               current_app.config['KB_CHUNK_OVERLAP_TOKENS']) or [item.content]
+    ids, documents, metadatas = [], [], []
+    for index, chunk in enumerate(chunks):
+        ids.append(item.chroma_id() if index == 0 else f"{item.chroma_id()}_{index}")
+        documents.append(KnowledgeItem.build_document(item.title, item.item_type, chunk))
+        metadatas.append({**item.chroma_metadata(), "chunk_index": index, "chunk_count": len(chunks)})
+    return ids, documents, metadatas
+
+
+def _chunk_content(document):
+    # Stored documents are "Title: ...\nType: ...\nContent: <chunk>"
+    return document.split("\nContent: ", 1)[1] if "\nContent: " in document else document
+
+
+@timed_stage('vector_search')
+def query_kb_items(collection, query_text=None, query_embedding=None, max_items=3):
+    """Queries chunk vectors and groups hits by parent item, best-ranked item first.
+
+    Returns a list of {"item_db_id", "title", "type", "chunks": [(chunk_index, content), ...]}
+    with at most `max_items` entries; chunks are in document order.
+    """
+    n_results = max_items * current_app.config['KB_CHUNKS_PER_ITEM_FETCHED']
+    query_kwargs = {"query_embeddings": [query_embedding]} if query_embedding is not None else {"query_texts": [query_text]}
+    results = collection.query(**query_kwargs, n_results=n_results, include=['documents', 'metadatas'])
+    if not results or not results.get('documents') or not results['documents'][0]:
+        return []
+
+    items = OrderedDict()
+    for document, metadata in zip(results['documents'][0], results['metadatas'][0]):
+        parent_id = metadata.get('item_db_id')
+        if parent_id not in items:
+            if len(items) >= max_items:
+                continue
+            items[parent_id] = {"item_db_id": parent_id, "title": metadata.get('title', 'N/A'),
+                                "type": metadata.get('type'), "chunks": []}
+        items[parent_id]["chunks"].append((metadata.get('chunk_index', 0), _chunk_content(document)))
+    for item in items.values():
+        item["chunks"].sort(key=lambda chunk: chunk[0])
+    return list(items.values())
+
+
+def assemble_kb_context(items, token_budget):
+    """Builds one text block per item, in rank order, until `token_budget` tokens are used.
+
+    An item that doesn't fit whole is truncated if a useful amount of budget remains.
+    Returns (blocks, tokens_used).
+    """
+    blocks = []
+    used = 0
+    for item in items:
+        body = "\n...\n".join(content for _, content in item["chunks"])
+        block = KnowledgeItem.build_document(item["title"], item["type"], body)
+        block_tokens = count_tokens(block)
+        remaining = token_budget - used
+        if block_tokens > remaining:
+            if remaining < current_app.config['KB_CONTEXT_MIN_PARTIAL_TOKENS'] and blocks:
+                break
+            block = truncate_to_tokens(block, remaining)
+            if not block:
+                break
+            block_tokens = count_tokens(block)
+        blocks.append(block)
+        used += block_tokens
+        if used >= token_budget:
+            break
+    return blocks, used
+
+
+def _keyword_item(item, query_text):
+    """Builds a retrieval item for a keyword hit, keeping the chunks that mention the query terms most."""
+    chunks = split_into_chunks(item.content, current_app.config['KB_CHUNK_TOKENS'],
+                               current_app.config['KB_CHUNK_OVERLAP_TOKENS']) or [item.content]
+    terms = {term.lower() for term in TOKEN_PATTERN.findall(query_text or "") if term.isalnum()}
+    scored = [(sum(1 for token in TOKEN_PATTERN.findall(chunk.lower()) if token in terms), index)
+              for index, chunk in enumerate(chunks)]
+    best = sorted(index for score, index in sorted(scored, reverse=True)[:2] if score > 0) or [0]
+    return {"item_db_id": item.id, "title": item.title, "type": item.item_type,
+            "chunks": [(index, chunks[index]) for index in best]}
+
+
+@timed_stage('keyword_search')
+def keyword_kb_items(company_id, query_text, max_items=3):
+    """Keyword-only retrieval from the full-text index; no embedding pass."""
+    item_ids = search_item_ids(company_id, query_text, max_items)
+    rows = {item.id: item for item in KnowledgeItem.query.filter(KnowledgeItem.id.in_(item_ids))} if item_ids else {}
+    return [_keyword_item(rows[item_id], query_text) for item_id in item_ids if item_id in rows]
+
+
+def hybrid_kb_items(company_id, query_text, collection=None, query_embedding=None, max_items=3):
+    """Dense + keyword retrieval fused by reciprocal-rank fusion, best item first.
+
+    Falls back to keyword-only when `collection` is None (embedding backend cold or
+    unavailable) and to dense-only when KB_RETRIEVAL_MODE is 'vector'.
+    """
+    mode = current_app.config['KB_RETRIEVAL_MODE']
+    if collection is None or mode == 'keyword':
+        return keyword_kb_items(company_id, query_text, max_items)
+    if mode == 'vector':
+        return query_kb_items(collection, query_text=query_text, query_embedding=query_embedding, max_items=max_items)
+
+    candidates = current_app.config['KB_HYBRID_CANDIDATES']
+    rrf_k = current_app.config['KB_RRF_K']
+    dense_items = query_kb_items(collection, query_text=query_text, query_embedding=query_embedding,
+                                 max_items=max(candidates, max_items))
+    with stage('keyword_search'):
+        keyword_ids = search_item_ids(company_id, query_text, max(candidates, max_items))
+
+    scores = {}
+    for rank, item in enumerate(dense_items):
+        scores[item["item_db_id"]] = scores.get(item["item_db_id"], 0.0) + 1.0 / (rrf_k + rank + 1)
+    for rank, item_id in enumerate(keyword_ids):
+        scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+    fused_ids = sorted(scores, key=lambda item_id: scores[item_id], reverse=True)[:max_items]
+
+    dense_by_id = {item["item_db_id"]: item for item in dense_items}
+    missing = [item_id for item_id in fused_ids if item_id not in dense_by_id]
+    rows = {item.id: item for item in KnowledgeItem.query.filter(KnowledgeItem.id.in_(missing))} if missing else {}
+    fused = []
+    for item_id in fused_ids:
+        if item_id in dense_by_id:
+            fused.append(dense_by_id[item_id])
+        elif item_id in rows:
+            fused.append(_keyword_item(rows[item_id], query_text))
+    return fused
+
+
+def retrieve_kb_context(company_id, query_text, collection=None, query_embedding=None, max_items=3, token_budget=None):
+    """Convenience wrapper: hybrid retrieval, deduped by parent item, assembled into budgeted context blocks."""
+    with stage('kb_retrieval'):
+        items = hybrid_kb_items(company_id, query_text, collection=collection, query_embedding=query_embedding, max_items=max_items)
+        blocks, _ = assemble_kb_context(items, token_budget or current_app.config['KB_CONTEXT_TOKEN_BUDGET'])
+    return blocks
@@ -0,0 +1,266 @@
+"""Full-text search over tickets (subject, description) and chat messages.
+
+Same approach as the KB keyword index in core/lexical_index.py. SQLite uses
+external-content FTS5 tables kept in sync by triggers. Postgres uses generated
+`search_vector` tsvector columns with GIN indexes. Either way every write to
+`ticket` / `chat_message` updates the index, with no application code involved.
+
+Search is scoped to one company. On SQLite, `company_id` is an indexed FTS
+column, so the company filter is part of the MATCH and is resolved from the
+index, not by joining the base table. To keep latency flat as history grows,
+a search ranks only the SEARCH_MAX_CANDIDATES most recent matches. FTS5 walks
+matches newest first and stops there. On Postgres the bitmap GIN scan still
+finds every match and `ORDER BY id DESC LIMIT` sorts them all, but only the
+candidates are ranked. Those candidates are ranked and paged, and highlights
+are computed only for the rows on the page. Postgres ranks them with
+ts_rank_cd. SQLite scores them in Python (`_term_saturation_scores`), since
+FTS5's bm25() reads every matching doclist in full to compute IDF.
+
+The DDL runs after `db.create_all()` creates each table (fresh databases) and
+from migration 8 (existing databases, applied on startup). Until it has run,
+a search returns an empty page flagged `unavailable` instead of failing.
+"""
+import re
+
+from flask import current_app
+from markupsafe import Markup, escape
+from sqlalchemy import bindparam, event, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from .models import db, Ticket, ChatMessage
+from .lexical_index import query_terms
+
+TICKET_FTS_TABLE = 'ticket_fts'
+MESSAGE_FTS_TABLE = 'chat_message_fts'
+SEARCH_KINDS = ('tickets', 'messages')
+
+# Highlight markers put in by FTS5 snippet() / ts_headline(), swapped for <mark> after HTML-escaping
+_MARK_START, _MARK_END = '\x02', '\x03'
+
+_SQLITE_DDL = {
+    'ticket': [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {TICKET_FTS_TABLE} USING fts5(company_id, subject, description, content='ticket', content_rowid='id')",
+        f"""CREATE TRIGGER IF NOT EXISTS {TICKET_FTS_TABLE}_ai AFTER INSERT ON ticket BEGIN
+            INSERT INTO {TICKET_FTS_TABLE}(rowid, company_id, subject, description) VALUES (new.id, new.company_id, new.subject, new.description);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {TICKET_FTS_TABLE}_ad AFTER DELETE ON ticket BEGIN
+            INSERT INTO {TICKET_FTS_TABLE}({TICKET_FTS_TABLE}, rowid, company_id, subject, description) VALUES ('delete', old.id, old.company_id, old.subject, old.description);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {TICKET_FTS_TABLE}_au AFTER UPDATE OF company_id, subject, description ON ticket BEGIN
+            INSERT INTO {TICKET_FTS_TABLE}({TICKET_FTS_TABLE}, rowid, company_id, subject, description) VALUES ('delete', old.id, old.company_id, old.subject, old.description);
+            INSERT INTO {TICKET_FTS_TABLE}(rowid, company_id, subject, description) VALUES (new.id, new.company_id, new.subject, new.description);
+        END""",
+    ],
+    'chat_message': [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {MESSAGE_FTS_TABLE} USING fts5(company_id, message_text, content='chat_message', content_rowid='id')",
+        f"""CREATE TRIGGER IF NOT EXISTS {MESSAGE_FTS_TABLE}_ai AFTER INSERT ON chat_message BEGIN
+            INSERT INTO {MESSAGE_FTS_TABLE}(rowid, company_id, message_text) VALUES (new.id, new.company_id, new.message_text);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {MESSAGE_FTS_TABLE}_ad AFTER DELETE ON chat_message BEGIN
+            INSERT INTO {MESSAGE_FTS_TABLE}({MESSAGE_FTS_TABLE}, rowid, company_id, message_text) VALUES ('delete', old.id, old.company_id, old.message_text);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {MESSAGE_FTS_TABLE}_au AFTER UPDATE OF company_id, message_text ON chat_message BEGIN
+            INSERT INTO {MESSAGE_FTS_TABLE}({MESSAGE_FTS_TABLE}, rowid, company_id, message_text) VALUES ('delete', old.id, old.company_id, old.message_text);
+            INSERT INTO {MESSAGE_FTS_TABLE}(rowid, company_id, message_text) VALUES (new.id, new.company_id, new.message_text);
+        END""",
+    ],
+}
+
+_POSTGRES_DDL = {
+    'ticket': [
+        """ALTER TABLE ticket ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(subject, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(description, '')), 'B')
+        ) STORED""",
+        "CREATE INDEX IF NOT EXISTS ix_ticket_search_vector ON ticket USING GIN (search_vector)",
+    ],
+    'chat_message': [
+        """ALTER TABLE chat_message ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+            to_tsvector('english', coalesce(message_text, ''))
+        ) STORED""",
+        "CREATE INDEX IF NOT EXISTS ix_chat_message_search_vector ON chat_message USING GIN (search_vector)",
+    ],
+}
+
+_FTS_TABLES = {'ticket': TICKET_FTS_TABLE, 'chat_message': MESSAGE_FTS_TABLE}
+
+RANK_TEXT_CHARS = 1000 # Leading characters of each field scored when ranking SQLite candidates
+_TOKEN_RE = re.compile(r'\w+') # Close to FTS5's unicode61 tokenizer for ranking purposes
+
+
+def create_search_index(connection, table_name, rebuild=False):
+    """Creates the full-text index on `ticket` or `chat_message` for the connection's dialect. Returns False if unsupported."""
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        for statement in _SQLITE_DDL[table_name]:
+            connection.execute(text(statement))
+        if rebuild: # Index rows that existed before the FTS table
+            fts_table = _FTS_TABLES[table_name]
+            connection.execute(text(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')"))
+        return True
+    if dialect == 'postgresql':
+        for statement in _POSTGRES_DDL[table_name]: # Generated columns are filled for existing rows on creation
+            connection.execute(text(statement))
+        return True
+    return False
+
+
+@event.listens_for(Ticket.__table__, 'after_create')
+def _create_ticket_search_index(target, connection, **kw):
+    create_search_index(connection, 'ticket')
+
+
+@event.listens_for(ChatMessage.__table__, 'after_create')
+def _create_message_search_index(target, connection, **kw):
+    create_search_index(connection, 'chat_message')
+
+
+def highlight_markup(fragment):
+    """HTML-escapes an FTS snippet/headline and turns its match markers into <mark> tags."""
+    if not fragment:
+        return Markup('')
+    return Markup(str(escape(fragment)).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>'))
+
+
+class SearchPage:
+    """One page of ranked hits. `total` counts the ranked candidates; `capped` means older matches were not ranked.
+
+    `unavailable` means the search index has not been built (migration 8 not applied).
+    """
+
+    def __init__(self, kind, hits, total, capped, page, page_size, unavailable=False):
+        self.kind = kind
+        self.hits = hits
+        self.total = total
+        self.capped = capped
+        self.page = page
+        self.page_size = page_size
+        self.unavailable = unavailable
+
+    @property
+    def has_next(self):
+        return self.page * self.page_size < self.total
+
+    @property
+    def has_previous(self):
+        return self.page > 1
+
+
+def _sqlite_match(company_id, terms, columns):
+    # Terms are quoted FTS5 strings and must all appear in the text columns; the company
+    # filter is a column-filtered token, so it is resolved from the index like any term.
+    column_filter = "{" + " ".join(columns) + "}"
+    clauses = [f'company_id : "{int(company_id)}"'] + [f'{column_filter} : "' + term.replace('"', '""') + '"' for term in terms]
+    return " AND ".join(clauses)
+
+
+def _term_saturation_scores(documents, terms, weights, k1=1.2, b=0.75):
+    """BM25 without the IDF factor, for candidates that all contain every term (so IDF can't reorder them).
+
+    `documents` holds one tuple of field texts per candidate; `weights` weights each field.
+    Terms are counted as token sequences, as FTS5 matches them.
+    """
+    term_tokens = [tuple(_TOKEN_RE.findall(term)) for term in terms]
+    field_tokens = [[_TOKEN_RE.findall(field.lower()) for field in document] for document in documents]
+    scores = [0.0] * len(documents)
+    for field_index, weight in enumerate(weights):
+        average_length = (sum(len(tokens[field_index]) for tokens in field_tokens) / len(documents)) or 1.0
+        for doc_index, tokens in enumerate(field_tokens):
+            field = tokens[field_index]
+            norm = k1 * (1 - b + b * len(field) / average_length)
+            for phrase in term_tokens:
+                if len(phrase) == 1:
+                    frequency = field.count(phrase[0])
+                elif phrase:
+                    width = len(phrase)
+                    frequency = sum(1 for i, token in enumerate(field) if token == phrase[0] and tuple(field[i:i + width]) == phrase)
+                else:
+                    continue
+                if frequency:
+                    scores[doc_index] += weight * frequency * (k1 + 1) / (frequency + norm)
+    return scores
+
+
+def _ranked_ids(kind, company_id, terms, page, page_size, max_candidates):
+    """Returns ([(id, snippets...)], total) for one page, best first."""
+    dialect = db.engine.dialect.name
+    limit_params = {"company_id": company_id, "cap": max_candidates, "limit": page_size, "offset": (page - 1) * page_size,
+                    "mark_start": _MARK_START, "mark_end": _MARK_END}
+    if dialect == 'sqlite':
+        if kind == 'tickets':
+            fts, table, columns, weights = TICKET_FTS_TABLE, 'ticket', ('subject', 'description'), (2.0, 1.0)
+        else:
+            fts, table, columns, weights = MESSAGE_FTS_TABLE, 'chat_message', ('message_text',), (1.0,)
+        params = {**limit_params, "match": _sqlite_match(company_id, terms, columns), "chars": RANK_TEXT_CHARS}
+        # bm25() would cost a pass over every phrase's full doclist (including the company token) to
+        # compute IDF, so candidates come back unranked, newest first, and are scored in Python.
+        text_columns = ", ".join(f"substr(coalesce(t.{column}, ''), 1, :chars)" for column in columns)
+        candidates = db.session.execute(text(
+            f"SELECT t.id, {text_columns} FROM ("
+            f"  SELECT rowid FROM {fts} WHERE {fts} MATCH :match ORDER BY rowid DESC LIMIT :cap"
+            f") c JOIN {table} t ON t.id = c.rowid"
+        ), params).fetchall()
+        if not candidates:
+            return [], 0
+        scores = _term_saturation_scores([row[1:] for row in candidates], terms, weights)
+        ranked = sorted(zip(scores, (row[0] for row in candidates)), key=lambda pair: (-pair[0], -pair[1]))
+        ids = [item_id for _, item_id in ranked[limit_params["offset"]:limit_params["offset"] + page_size]]
+        if not ids:
+            return [], len(candidates)
+        snippet_columns = ", ".join(
+            f"snippet({fts}, {index}, :mark_start, :mark_end, '…', {24 if column != 'subject' else 64})"
+            for index, column in enumerate(columns, start=1))
+        snippets = {row[0]: tuple(row[1:]) for row in db.session.execute(text(
+            f"SELECT rowid, {snippet_columns} FROM {fts} WHERE {fts} MATCH :match AND rowid IN :ids"
+        ).bindparams(bindparam('ids', expanding=True)), {**params, "ids": ids})}
+        return [(item_id,) + snippets.get(item_id, ()) for item_id in ids], len(candidates)
+
+    if dialect == 'postgresql':
+        table, columns = ('ticket', ('subject', 'description')) if kind == 'tickets' else ('chat_message', ('message_text',))
+        term_params = {f"t{i}": term for i, term in enumerate(terms)}
+        tsquery = " && ".join(f"plainto_tsquery('english', :t{i})" for i in range(len(terms)))
+        headline_options = f"StartSel={_MARK_START}, StopSel={_MARK_END}, MaxWords=30, MinWords=10, MaxFragments=2, FragmentDelimiter=\" … \""
+        headlines = ", ".join(
+            (f"ts_headline('english', coalesce(t.{column}, ''), q.query, :headline_options)" if column != 'subject'
+             else f"ts_headline('english', coalesce(t.{column}, ''), q.query, :subject_options)")
+            for column in columns)
+        rows = db.session.execute(text(
+            f"WITH q AS (SELECT {tsquery} AS query), "
+            f"candidates AS (SELECT t.id, t.search_vector FROM {table} t, q "
+            f"  WHERE t.company_id = :company_id AND t.search_vector @@ q.query ORDER BY t.id DESC LIMIT :cap), "
+            f"page AS (SELECT c.id, count(*) OVER () AS total, ts_rank_cd(c.search_vector, q.query) AS score FROM candidates c, q "
+            f"  ORDER BY score DESC, c.id DESC LIMIT :limit OFFSET :offset) "
+            f"SELECT page.id, page.total, {headlines} FROM page JOIN {table} t ON t.id = page.id, q "
+            f"ORDER BY page.score DESC, page.id DESC"
+        ), {**limit_params, **term_params, "headline_options": headline_options,
+            "subject_options": f"StartSel={_MARK_START}, StopSel={_MARK_END}, HighlightAll=true"}).fetchall()
+        if not rows:
+            return [], 0
+        return [(row[0],) + tuple(row[2:]) for row in rows], rows[0].total
+    return [], 0
+
+
+def search(kind, company_id, query_text, page=1, page_size=20, max_candidates=1000):
+    """Ranked, paginated full-text search over a company's tickets or chat messages. Returns a SearchPage.
+
+    Ticket hits are (ticket, subject_highlight, description_highlight); message hits are
+    (message, text_highlight). Highlights are safe Markup.
+    """
+    if kind not in SEARCH_KINDS:
+        raise ValueError(f"Unknown search kind '{kind}'")
+    page = max(1, page)
+    terms = query_terms(query_text)
+    if not terms:
+        return SearchPage(kind, [], 0, False, page, page_size)
+    try:
+        rows, total = _ranked_ids(kind, company_id, terms, page, page_size, max_candidates)
+    except (OperationalError, ProgrammingError) as e: # No FTS table / search_vector column yet
+        db.session.rollback()
+        current_app.logger.error(f"Full-text search unavailable (run scripts/migrate_db.py): {e}")
+        return SearchPage(kind, [], 0, False, page, page_size, unavailable=True)
+    model = Ticket if kind == 'tickets' else ChatMessage
+    # By primary key only (a company_id filter can steer SQLite onto a company index); the company is checked here.
+    objects = {obj.id: obj for obj in model.query.filter(model.id.in_([row[0] for row in rows])) if obj.company_id == company_id}
+    hits = [(objects[row[0]],) + tuple(highlight_markup(fragment) for fragment in row[1:])
+            for row in rows if row[0] in objects]
+    return SearchPage(kind, hits, total, total >= max_candidates, page, page_size)
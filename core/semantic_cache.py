@@ -0,0 +1,140 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from .metrics import metrics, record_cache_lookup
+
+
+class SemanticAnswerCache:
+    """Per-company cache of chatbot answers keyed by the query embedding.
+
+    A new question whose embedding is within the configured cosine similarity
+    of a cached question is answered from the cache, skipping retrieval and the
+    LLM call. Entries expire after a TTL and each company keeps at most
+    `max_entries` answers, evicting the least recently used. The cache lives in
+    the worker process, so each gunicorn worker warms its own copy.
+
+    Each company's entries belong to one `Company.kb_version`. A lookup or store with
+    another version drops them, so a KB change made by any process (another worker,
+    scripts/import_kb.py, a re-index or reconcile) invalidates every worker's copy.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {} # company_id -> OrderedDict[int, (unit_vector, question, answer, stored_at)]
+        self._kb_versions = {} # company_id -> kb_version the entries were answered from
+        self._next_key = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(embedding):
+        import numpy as np # Deferred to first use, keeping numpy off the cold-start path
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_kb_version(self, company_id, kb_version):
+        """Drops the company's entries if they were answered from another KB version (caller holds the lock)."""
+        if self._kb_versions.get(company_id, kb_version) != kb_version and self._entries.pop(company_id, None):
+            self.invalidations += 1
+        self._kb_versions[company_id] = kb_version
+
+    def lookup(self, company_id, embedding, threshold, ttl_seconds, kb_version=0):
+        """Returns (answer, similarity) for the closest fresh entry above `threshold`, else (None, best_similarity)."""
+        import numpy as np # Deferred to first use, keeping numpy off the cold-start path
+        query = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            self._check_kb_version(company_id, kb_version)
+            entries = self._entries.get(company_id)
+            if entries:
+                for key in [k for k, entry in entries.items() if now - entry[3] > ttl_seconds]:
+                    del entries[key]
+                    self.evictions += 1
+            if not entries:
+                self.misses += 1
+                return None, 0.0
+            keys = list(entries.keys())
+            similarities = np.stack([entries[k][0] for k in keys]) @ query
+            best = int(np.argmax(similarities))
+            best_similarity = float(similarities[best])
+            if best_similarity < threshold:
+                self.misses += 1
+                return None, best_similarity
+            entries.move_to_end(keys[best])
+            self.hits += 1
+            return entries[keys[best]][2], best_similarity
+
+    def store(self, company_id, embedding, question, answer, max_entries, kb_version=0):
+        with self._lock:
+            self._check_kb_version(company_id, kb_version)
+            entries = self._entries.setdefault(company_id, OrderedDict())
+            self._next_key += 1
+            entries[self._next_key] = (self._normalize(embedding), question, answer, time.monotonic())
+            while len(entries) > max(max_entries, 1):
+                entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_company(self, company_id):
+        """Drops every cached answer for a company, e.g. after its knowledge base changes."""
+        with self._lock:
+            if self._entries.pop(company_id, None):
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._kb_versions.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": sum(len(entries) for entries in self._entries.values()),
+            }
+
+
+semantic_answer_cache = SemanticAnswerCache()
+metrics.gauge('voss_semantic_cache_entries', "Answers held in this worker's semantic cache.",
+              lambda: semantic_answer_cache.stats()["entries"])
+metrics.gauge('voss_semantic_cache_hit_ratio', "Semantic cache hit ratio since this worker started.",
+              lambda: semantic_answer_cache.stats()["hit_rate"])
+
+
+def get_cached_answer(company_id, embedding, kb_version=0):
+    """Returns a cached answer for a semantically equivalent question under the current `kb_version`, or None."""
+    if not current_app.config.get('SEMANTIC_CACHE_ENABLED') or embedding is None:
+        return None
+    answer, similarity = semantic_answer_cache.lookup(
+        company_id, embedding,
+        threshold=current_app.config['SEMANTIC_CACHE_THRESHOLD'],
+        ttl_seconds=current_app.config['SEMANTIC_CACHE_TTL_SECONDS'],
+        kb_version=kb_version or 0,
+    )
+    record_cache_lookup('semantic_answer', answer is not None)
+    if answer is not None:
+        current_app.logger.debug(f"Semantic cache hit for company {company_id} (similarity {similarity:.3f}).")
+    return answer
+
+def store_cached_answer(company_id, embedding, question, answer, kb_version=0):
+    """Caches an answer retrieved from the company's KB at `kb_version`."""
+    if not current_app.config.get('SEMANTIC_CACHE_ENABLED') or embedding is None:
+        return
+    if not answer or answer.startswith("Error:"): # Never cache LLM failures
+        return
+    semantic_answer_cache.store(company_id, embedding, question, answer,
+                                max_entries=current_app.config['SEMANTIC_CACHE_MAX_ENTRIES'], kb_version=kb_version or 0)
+
+def invalidate_company_answers(company_id):
+    """Drops this worker's entries at once; other processes drop theirs on seeing the new kb_version."""
+    semantic_answer_cache.invalidate_company(company_id)
@@ -0,0 +1,290 @@
+"""Duplicate and related ticket detection over a per-company ticket embedding index.
+
+Each company has a Chroma collection `company_<id>_tickets`. It uses cosine space
+and holds one vector per ticket, id `ticket_<id>`, with `created_ts` metadata.
+The vector embeds the text the customer reported. For a chat handoff that is the
+initial query; the appended chat transcript and summaries are left out, so a burst
+of tickets about the same incident embeds alike.
+
+- `index_ticket` job: queued when `create_ticket` or the chat handoff creates a
+  ticket. It embeds the ticket and upserts its vector, then compares it with the
+  tickets opened in the preceding TICKET_DUPLICATE_WINDOW_HOURS. The earliest
+  still-open one scoring at least TICKET_DUPLICATE_THRESHOLD is recorded as
+  `TicketSimilarity.duplicate_of_id`.
+- `similar_tickets`: the nearest tickets to one already indexed, for the ticket
+  view. It queries by the stored vector, so the page embeds nothing.
+- `cluster_tickets` job: groups the newest open tickets whose vectors are at
+  least TICKET_CLUSTER_THRESHOLD similar (connected components). The result is
+  stored on the job and shown on /tickets/clusters for bulk handling.
+
+Tickets created before this index existed are picked up by scripts/index_tickets.py,
+or lazily the first time an agent opens them.
+"""
+import calendar
+import hashlib
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from .models import db, Ticket, BackgroundJob, TicketSimilarity
+from .jobs import enqueue_job, register_job_handler, latest_job_for_ticket
+from .embeddings import embedding_model_id
+from .knowledge_base import init_chroma_client, get_chroma_embedding_function, chroma_registry
+from .ticket_suggestions import CLOSED_TICKET_STATUSES
+
+SIMILARITY_TEXT_CHARS = 1000 # Embedded prefix of the reported text
+CHAT_HANDOFF_SUBJECT_PREFIX = "Chat Handoff: "
+INDEX_RETRY_AFTER = timedelta(minutes=10) # A failed index job is re-queued by the ticket view after this
+
+
+def ticket_collection_name(company_id):
+    return f"company_{company_id}_tickets"
+
+
+def ticket_vector_id(ticket_id):
+    return f"ticket_{ticket_id}"
+
+
+def get_ticket_collection(company_id, chroma_client=None, embedding_function=None):
+    """The company's ticket collection (cached per worker), or None if Chroma or the embedding model is unavailable.
+
+    A collection built with a different embedding model is not used; rebuild it with
+    `scripts/index_tickets.py --rebuild`.
+    """
+    chroma_client = chroma_client or init_chroma_client()
+    embedding_function = embedding_function or get_chroma_embedding_function()
+    if not chroma_client or not embedding_function:
+        current_app.logger.error(f"Ticket collection unavailable for company {company_id}: client_exists={bool(chroma_client)}, ef_exists={bool(embedding_function)}")
+        return None
+    model_id = embedding_model_id(current_app.config)
+    collection_name = ticket_collection_name(company_id)
+    try:
+        collection = chroma_registry.get_collection(
+            chroma_client, collection_name, embedding_function,
+            max_size=current_app.config.get('CHROMA_COLLECTION_CACHE_SIZE', 128),
+            metadata={"hnsw:space": "cosine", "embedding_model": model_id, "company_id": company_id})
+    except Exception as e:
+        current_app.logger.error(f"Failed to get/create Chroma collection '{collection_name}': {e}")
+        return None
+    built_with = (collection.metadata or {}).get('embedding_model')
+    if built_with and built_with != model_id:
+        current_app.logger.error(f"Ticket collection '{collection_name}' was built with {built_with}, not {model_id}; "
+                                 f"run scripts/index_tickets.py --rebuild.")
+        return None
+    return collection
+
+
+def ticket_similarity_text(ticket):
+    """The subject and originally reported description, without chat-handoff boilerplate or transcripts."""
+    subject = (ticket.subject or '').strip()
+    if subject.startswith(CHAT_HANDOFF_SUBJECT_PREFIX):
+        subject = subject[len(CHAT_HANDOFF_SUBJECT_PREFIX):].strip()
+    reported = (ticket.description or '').split('\n--- ', 1)[0] # Chat transcript / summary / follow-up sections
+    lines = []
+    for line in reported.splitlines():
+        if line.startswith('Chat session ID:'):
+            continue
+        if line.startswith('Initial query:'):
+            line = line[len('Initial query:'):]
+        lines.append(line.strip())
+    body = "\n".join(line for line in lines if line)
+    if subject and not body.startswith(subject): # A handoff subject is the first 50 characters of the query
+        body = f"{subject}\n{body}" if body else subject
+    return body[:SIMILARITY_TEXT_CHARS]
+
+
+def similarity_content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _timestamp(value):
+    return calendar.timegm((value or datetime.utcnow()).utctimetuple())
+
+
+def _score(distance):
+    return round(1.0 - float(distance), 4) # Cosine space: distance = 1 - cosine similarity
+
+
+def _ticket_ids(vector_ids):
+    return [int(vector_id.rsplit('_', 1)[1]) for vector_id in vector_ids]
+
+
+def index_tickets(tickets, company_id, collection=None, embedding_function=None, force=False):
+    """Embeds and upserts the tickets (one company), then records each one's near-duplicate, if any.
+
+    Tickets whose text is unchanged since they were indexed are skipped unless `force`.
+    Returns {"indexed", "unchanged", "duplicates"}. Raises RuntimeError if the index is unavailable.
+    """
+    embedding_function = embedding_function or get_chroma_embedding_function()
+    collection = collection or get_ticket_collection(company_id, embedding_function=embedding_function)
+    if not collection or not embedding_function:
+        raise RuntimeError(f"Ticket embedding index unavailable for company {company_id}")
+    rows = {row.ticket_id: row for row in TicketSimilarity.query.filter(
+        TicketSimilarity.ticket_id.in_([ticket.id for ticket in tickets]))} if tickets else {}
+    pending = []
+    for ticket in tickets:
+        text = ticket_similarity_text(ticket)
+        content_hash = similarity_content_hash(text)
+        row = rows.get(ticket.id)
+        if row and row.content_hash == content_hash and not force:
+            continue
+        pending.append((ticket, text, content_hash, row or TicketSimilarity(ticket_id=ticket.id)))
+    stats = {"indexed": len(pending), "unchanged": len(tickets) - len(pending), "duplicates": 0}
+    if not pending:
+        return stats
+
+    embeddings = [list(map(float, embedding)) for embedding in embedding_function([text for _, text, _, _ in pending])]
+    # Upsert first, so tickets earlier in the same batch are duplicate candidates for later ones.
+    collection.upsert(ids=[ticket_vector_id(ticket.id) for ticket, _, _, _ in pending], embeddings=embeddings,
+                      metadatas=[{"ticket_id": ticket.id, "created_ts": _timestamp(ticket.created_at)} for ticket, _, _, _ in pending])
+    for (ticket, _, content_hash, row), embedding in zip(pending, embeddings):
+        duplicate = _find_duplicate(ticket, embedding, collection)
+        row.content_hash = content_hash
+        row.duplicate_of_id, row.duplicate_score = duplicate if duplicate else (None, None)
+        row.indexed_at = datetime.utcnow()
+        db.session.add(row)
+        stats["duplicates"] += bool(duplicate)
+    db.session.commit()
+    return stats
+
+
+def _find_duplicate(ticket, embedding, collection):
+    """(ticket_id, score) of the earliest open ticket opened shortly before `ticket` that nearly duplicates it."""
+    config = current_app.config
+    created_ts = _timestamp(ticket.created_at)
+    window_start = created_ts - config['TICKET_DUPLICATE_WINDOW_HOURS'] * 3600
+    result = collection.query(query_embeddings=[embedding], n_results=config['TICKET_DUPLICATE_CANDIDATES'] + 1,
+                              where={"$and": [{"created_ts": {"$gte": window_start}}, {"created_ts": {"$lte": created_ts}}]},
+                              include=['distances'])
+    scores = {ticket_id: _score(distance) for ticket_id, distance in zip(_ticket_ids(result['ids'][0]), result['distances'][0])
+              if ticket_id != ticket.id and _score(distance) >= config['TICKET_DUPLICATE_THRESHOLD']}
+    if not scores:
+        return None
+    candidates = Ticket.query.filter(Ticket.id.in_(list(scores)), Ticket.company_id == ticket.company_id,
+                                     Ticket.status.notin_(CLOSED_TICKET_STATUSES)).all()
+    ticket_key = (ticket.created_at or datetime.utcnow(), ticket.id)
+    earlier = sorted((candidate.created_at, candidate.id) for candidate in candidates if (candidate.created_at, candidate.id) < ticket_key)
+    if not earlier:
+        return None
+    original_id = earlier[0][1] # The first report of the incident, so a burst points at one ticket
+    return original_id, scores[original_id]
+
+
+def similar_tickets(ticket, limit=None, min_score=None):
+    """[(Ticket, score)] nearest to an indexed ticket, most similar first. Empty if it is not indexed yet."""
+    config = current_app.config
+    limit = limit or config['TICKET_SIMILAR_COUNT']
+    min_score = config['TICKET_SIMILAR_MIN_SCORE'] if min_score is None else min_score
+    collection = get_ticket_collection(ticket.company_id)
+    if not collection:
+        return []
+    stored = collection.get(ids=[ticket_vector_id(ticket.id)], include=['embeddings'])
+    if not stored['ids']:
+        return []
+    result = collection.query(query_embeddings=[stored['embeddings'][0]], n_results=limit + 1, include=['distances'])
+    scores = {ticket_id: _score(distance) for ticket_id, distance in zip(_ticket_ids(result['ids'][0]), result['distances'][0])
+              if ticket_id != ticket.id and _score(distance) >= min_score}
+    if not scores:
+        return []
+    tickets = Ticket.query.filter(Ticket.id.in_(list(scores)), Ticket.company_id == ticket.company_id).all()
+    return sorted(((similar, scores[similar.id]) for similar in tickets), key=lambda pair: -pair[1])[:limit]
+
+
+def ensure_ticket_indexed(ticket):
+    """Queues an `index_ticket` job if the ticket is missing from the index or its text changed.
+
+    Returns the TicketSimilarity row (None until the ticket is first indexed).
+    """
+    row = db.session.get(TicketSimilarity, ticket.id)
+    if not current_app.config['TICKET_SIMILARITY_ENABLED']:
+        return row
+    if row and row.content_hash == similarity_content_hash(ticket_similarity_text(ticket)):
+        return row
+    last_job = latest_job_for_ticket(ticket.id, 'index_ticket')
+    if last_job and (last_job.status in ('queued', 'running')
+                     or (last_job.status == 'failed' and last_job.finished_at and datetime.utcnow() - last_job.finished_at < INDEX_RETRY_AFTER)):
+        return row
+    enqueue_job('index_ticket', ticket_id=ticket.id, company_id=ticket.company_id)
+    return db.session.get(TicketSimilarity, ticket.id) # Set already if the job ran inline
+
+
+def duplicates_of(ticket, limit=20):
+    """Open tickets recorded as near-duplicates of `ticket`, oldest first."""
+    return Ticket.query.join(TicketSimilarity, TicketSimilarity.ticket_id == Ticket.id)\
+                       .filter(TicketSimilarity.duplicate_of_id == ticket.id, Ticket.company_id == ticket.company_id,
+                               Ticket.status.notin_(CLOSED_TICKET_STATUSES))\
+                       .order_by(Ticket.created_at, Ticket.id).limit(limit).all()
+
+
+def cluster_open_tickets(company_id, threshold=None, max_tickets=None, min_size=None):
+    """Groups the company's newest open tickets into clusters of near-identical tickets.
+
+    Two tickets are linked when their cosine similarity reaches `threshold`, and a cluster is
+    a connected component of those links. Returns the JSON-ready result stored on the job.
+    """
+    import numpy as np
+
+    config = current_app.config
+    threshold = config['TICKET_CLUSTER_THRESHOLD'] if threshold is None else threshold
+    max_tickets = max_tickets or config['TICKET_CLUSTER_MAX_TICKETS']
+    min_size = max(2, min_size or config['TICKET_CLUSTER_MIN_SIZE'])
+    collection = get_ticket_collection(company_id)
+    if not collection:
+        raise RuntimeError(f"Ticket embedding index unavailable for company {company_id}")
+
+    open_tickets = db.session.query(Ticket.id).filter(Ticket.company_id == company_id, Ticket.status.notin_(CLOSED_TICKET_STATUSES))\
+                                              .order_by(Ticket.created_at.desc(), Ticket.id.desc()).limit(max_tickets).all()
+    open_ids = [ticket_id for ticket_id, in open_tickets]
+    stored = collection.get(ids=[ticket_vector_id(ticket_id) for ticket_id in open_ids], include=['embeddings']) if open_ids else {'ids': []}
+    ticket_ids = _ticket_ids(stored['ids'])
+    clusters = []
+    if len(ticket_ids) >= min_size:
+        vectors = np.asarray(stored['embeddings'], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        linked = (vectors @ vectors.T) >= threshold
+        unassigned = np.ones(len(ticket_ids), dtype=bool)
+        for start in range(len(ticket_ids)):
+            if not unassigned[start]:
+                continue
+            unassigned[start] = False
+            members, frontier = [start], np.array([start])
+            while frontier.size: # Breadth-first, one vectorized step per level
+                frontier = np.nonzero(linked[frontier].any(axis=0) & unassigned)[0]
+                unassigned[frontier] = False
+                members.extend(frontier.tolist())
+            if len(members) >= min_size:
+                clusters.append(sorted(ticket_ids[i] for i in members))
+    clusters.sort(key=lambda members: (-len(members), members[0]))
+    return {
+        "clusters": [{"ticket_ids": members} for members in clusters],
+        "open_tickets": len(open_ids),
+        "unindexed": len(open_ids) - len(ticket_ids),
+        "clustered_tickets": sum(len(members) for members in clusters),
+        "threshold": threshold,
+        "computed_at": datetime.utcnow().isoformat(),
+    }
+
+
+def latest_cluster_job(company_id, status=None):
+    query = BackgroundJob.query.filter_by(ticket_id=None, job_type='cluster_tickets', company_id=company_id)
+    if status:
+        query = query.filter_by(status=status)
+    return query.order_by(BackgroundJob.id.desc()).first()
+
+
+@register_job_handler('index_ticket')
+def index_ticket_job(job, payload):
+    """Indexes one ticket (job.ticket_id) and records whether it nearly duplicates an open one."""
+    ticket = db.session.get(Ticket, job.ticket_id)
+    if not ticket:
+        return {"skipped": "ticket no longer exists"}
+    stats = index_tickets([ticket], ticket.company_id, force=bool(payload.get('force')))
+    row = db.session.get(TicketSimilarity, ticket.id)
+    stats.update(duplicate_of_id=row.duplicate_of_id if row else None, duplicate_score=row.duplicate_score if row else None)
+    return stats
+
+
+@register_job_handler('cluster_tickets')
+def cluster_tickets_job(job, payload):
+    """Clusters the open tickets of job.company_id; the result is read back by the clusters page."""
+    return cluster_open_tickets(job.company_id, threshold=payload.get('threshold'))
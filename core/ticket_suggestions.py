@@ -0,0 +1,108 @@
+"""Precomputed AI-suggested KB solutions for tickets.
+
+Suggestions are stored in `ticket_suggestion` under a key derived from the
+ticket's subject/description and the company's `kb_version`, so the ticket view
+serves them without embedding anything. They are computed in the background
+when a ticket is created, for a company's open tickets whenever its KB changes
+(see `mark_kb_changed` in core/knowledge_base.py), and lazily on the first view
+after a ticket's text is edited.
+"""
+import hashlib
+import json
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from .models import db, Ticket, Company, TicketSuggestion
+from .jobs import register_job_handler
+from .metrics import record_cache_lookup, stage
+from .knowledge_base import init_chroma_client, get_chroma_embedding_function, get_company_collection
+from .retrieval import hybrid_kb_items
+
+CLOSED_TICKET_STATUSES = ('Resolved', 'Closed')
+
+
+def _ticket_search_text(ticket):
+    return f"Subject: {ticket.subject}\nDescription: {ticket.description}"
+
+
+def ticket_suggestions_key(ticket, kb_version):
+    return hashlib.sha256(f"{kb_version or 0}\n{_ticket_search_text(ticket)}".encode('utf-8')).hexdigest()
+
+
+def _suggestions_from_items(kb_items):
+    return [{
+        "title": kb_item["title"],
+        "content_snippet": kb_item["chunks"][0][1][:300] + "...",
+        "id": kb_item["item_db_id"]
+    } for kb_item in kb_items]
+
+
+def compute_ticket_suggestions(tickets, company):
+    """Embeds the tickets in one batch, queries the company KB and stores the suggestions.
+
+    Returns {ticket_id: suggestions}. Without a KB collection, keyword-only results are returned unstored.
+    """
+    if not tickets:
+        return {}
+    chroma_client = init_chroma_client()
+    st_embedding_function = get_chroma_embedding_function()
+    collection = get_company_collection(chroma_client, company.id, st_embedding_function) if chroma_client and st_embedding_function else None
+    if not collection:
+        # Keyword-only results are served but not stored, so the ticket picks up hybrid results later.
+        current_app.logger.warning(f"KB collection unavailable; keyword-only ticket suggestions for company {company.id}.")
+        return {ticket.id: _suggestions_from_items(hybrid_kb_items(company.id, _ticket_search_text(ticket))) for ticket in tickets}
+
+    with stage('embed'):
+        embeddings = st_embedding_function([_ticket_search_text(ticket) for ticket in tickets])
+    computed, content_keys = {}, {}
+    for ticket, embedding in zip(tickets, embeddings):
+        computed[ticket.id] = _suggestions_from_items(hybrid_kb_items(company.id, _ticket_search_text(ticket), collection=collection,
+                                                                      query_embedding=list(map(float, embedding))))
+        content_keys[ticket.id] = ticket_suggestions_key(ticket, company.kb_version)
+
+    # The view and the refresh job can compute the same new ticket at once; whoever inserts
+    # second rolls back and overwrites the other's row instead.
+    for attempt in range(2):
+        existing = {row.ticket_id: row for row in TicketSuggestion.query.filter(TicketSuggestion.ticket_id.in_(list(computed)))}
+        for ticket_id, suggestions in computed.items():
+            row = existing.get(ticket_id) or TicketSuggestion(ticket_id=ticket_id)
+            row.content_key = content_keys[ticket_id]
+            row.suggestions = json.dumps(suggestions)
+            row.computed_at = datetime.utcnow()
+            db.session.add(row)
+        try:
+            db.session.commit()
+            break
+        except IntegrityError:
+            db.session.rollback()
+            if attempt:
+                current_app.logger.warning(f"Could not store ticket suggestions for tickets {list(computed)} (concurrent writes).")
+    return computed
+
+
+def get_ticket_suggestions(ticket, company):
+    """Returns the stored suggestions for a ticket, recomputing them only if its text or the KB changed."""
+    row = db.session.get(TicketSuggestion, ticket.id)
+    hit = bool(row and row.content_key == ticket_suggestions_key(ticket, company.kb_version))
+    record_cache_lookup('ticket_suggestions', hit)
+    if hit:
+        return json.loads(row.suggestions)
+    return compute_ticket_suggestions([ticket], company).get(ticket.id, [])
+
+
+@register_job_handler('refresh_ticket_suggestions')
+def refresh_ticket_suggestions_job(job, payload):
+    """Recomputes suggestions for one ticket (job.ticket_id) or for the company's open tickets."""
+    company = db.session.get(Company, job.company_id)
+    if not company:
+        return {"skipped": "company no longer exists"}
+    if job.ticket_id:
+        tickets = [ticket for ticket in [db.session.get(Ticket, job.ticket_id)] if ticket]
+    else:
+        tickets = Ticket.query.filter(Ticket.company_id == company.id, Ticket.status.notin_(CLOSED_TICKET_STATUSES))\
+                              .order_by(Ticket.updated_at.desc())\
+                              .limit(current_app.config['TICKET_SUGGESTIONS_REFRESH_LIMIT']).all()
+    computed = compute_ticket_suggestions(tickets, company)
+    return {"tickets": len(computed), "kb_version": company.kb_version}
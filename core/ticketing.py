@@ -4,12 +4,21 @@ from flask import Blueprint, render_template, request, flash, redirect, url_for,
 from flask_login import login_required, current_user
 from flask_wtf import FlaskForm
 from wtforms import StringField, TextAreaField, SelectField, SubmitField, HiddenField
-from wtforms.validators import DataRequired
+from wtforms.validators import DataRequired, Optional
+import re
+import json
 from datetime import datetime
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
 
-from .models import db, Ticket, User, Company, ChatMessage, KnowledgeItem
+from .models import db, Ticket, User, Company, ChatMessage, KnowledgeItem, BackgroundJob
 from .utils import query_llm_groq
-from .knowledge_base import init_chroma_client, get_chroma_embedding_function, get_company_collection
+from .prompts import PromptBuilder
+from .jobs import enqueue_job, register_job_handler, latest_job_for_ticket
+from .ticket_suggestions import get_ticket_suggestions, CLOSED_TICKET_STATUSES
+from .ticket_similarity import ensure_ticket_indexed, similar_tickets, duplicates_of, latest_cluster_job
+from .search import search, SEARCH_KINDS
+from .metrics import stage
 
 ticketing_bp = Blueprint('ticketing', __name__)
 
@@ -29,6 +38,19 @@ class AgentTicketNoteForm(FlaskForm):
     submit_note = SubmitField('Add Note')
 
 
+class TicketBulkUpdateForm(FlaskForm):
+    """Applies one status / assignee change and an optional reply to every ticket of a cluster."""
+    ticket_ids = HiddenField(validators=[DataRequired()]) # Comma-separated
+    status = SelectField('Set Status', choices=[('', 'No change')])
+    assignee_id = SelectField('Assign To', coerce=int, choices=[])
+    note_content = TextAreaField('Reply to every ticket', validators=[Optional()])
+    submit_bulk = SubmitField('Apply to Cluster')
+
+
+class TicketClusterRefreshForm(FlaskForm):
+    submit_refresh = SubmitField('Re-cluster Now')
+
+
 def populate_agent_choices(form, company_id):
     if not hasattr(form, 'assignee_id'):
         current_app.logger.warning("Attempted to populate agent choices, but form has no 'assignee_id' field.")
@@ -39,6 +61,63 @@ def populate_agent_choices(form, company_id):
     current_app.logger.debug(f"Populated agent choices for company {company_id}: {form.assignee_id.choices}")
 
 
+TICKET_STATUSES = ['Open', 'In Progress', 'Pending Customer', 'Resolved', 'Closed']
+TICKET_PRIORITIES = ['Low', 'Medium', 'High', 'Urgent']
+DEFAULT_TICKET_CATEGORY = "General Inquiry"
+DEFAULT_TICKET_PRIORITY = "Medium"
+
+
+def suggest_category_and_priority(text, company_id=None):
+    """Asks the LLM for a ticket category and priority. Returns (category, priority); either may be None.
+
+    Raises RuntimeError when the LLM call fails so the background job can retry.
+    """
+    builder = PromptBuilder('categorize_ticket', system="You are a ticket analysis assistant. Provide only Category and Priority.",
+                            max_tokens=current_app.config['TICKET_CATEGORIZATION_MAX_TOKENS'])
+    builder.text("Analyze the following support ticket description and suggest a Category (e.g., Billing, Technical, Feature Request, General Inquiry) and a Priority (Low, Medium, High, Urgent).\n\n")
+    builder.add('user_input', text or "", budget=current_app.config['PROMPT_USER_INPUT_TOKENS'], prefix='Description: "', suffix='"')
+    builder.text("\n\nRespond with 'Category: <category_name>' and 'Priority: <priority_level>' on separate lines or clearly indicated.")
+    prompt = builder.build()
+    ai_suggestions_text = query_llm_groq(prompt.prompt, system_message=prompt.system, max_tokens=prompt.max_tokens,
+                                         company_id=company_id)
+    if ai_suggestions_text.startswith("Error:"):
+        raise RuntimeError(ai_suggestions_text)
+    current_app.logger.info(f"AI suggestions for ticket: {ai_suggestions_text}")
+
+    category_match = re.search(r"category:\s*([^,\n]+)", ai_suggestions_text, re.IGNORECASE)
+    priority_match = re.search(r"priority:\s*([a-z]+)", ai_suggestions_text, re.IGNORECASE)
+    category = category_match.group(1).strip().strip('*"').title()[:100] if category_match else None
+    priority = priority_match.group(1).strip().title() if priority_match else None
+    return category or None, priority if priority in TICKET_PRIORITIES else None
+
+
+@register_job_handler('categorize_ticket')
+def categorize_ticket_job(job, payload):
+    """Fills in the LLM-suggested category/priority on a ticket that was saved with defaults."""
+    ticket = db.session.get(Ticket, job.ticket_id)
+    if not ticket:
+        return {"skipped": "ticket no longer exists"}
+    category, priority = suggest_category_and_priority(payload.get('text') or ticket.description, company_id=ticket.company_id)
+    if category and not payload.get('keep_category'):
+        ticket.category = category
+    if priority and not payload.get('keep_priority'):
+        ticket.priority = priority
+    db.session.commit()
+    return {"category": category, "priority": priority}
+
+
+def _encode_ticket_cursor(ticket):
+    """Keyset cursor for the (updated_at, id) ordering used by the ticket list."""
+    return f"{ticket.updated_at.isoformat()}_{ticket.id}"
+
+def _decode_ticket_cursor(cursor):
+    try:
+        updated_at_str, ticket_id_str = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(updated_at_str), int(ticket_id_str)
+    except (ValueError, AttributeError):
+        return None
+
+
 @ticketing_bp.route('/')
 @login_required
 def list_tickets():
@@ -47,21 +126,102 @@ def list_tickets():
         flash("User not associated with a company.", "danger")
         return redirect(url_for('index'))
 
+    status_filter = request.args.get('status') or None
+    priority_filter = request.args.get('priority') or None
+    agent_filter = request.args.get('agent') or None # 'me', 'unassigned' or an agent user id
+    cursor = request.args.get('cursor') or None
+    per_page = request.args.get('per_page', current_app.config['TICKETS_PAGE_SIZE'], type=int)
+    per_page = max(1, min(per_page, current_app.config['TICKETS_MAX_PAGE_SIZE']))
+
+    query = Ticket.query.options(joinedload(Ticket.customer), joinedload(Ticket.agent))
     if current_user.role == 'customer':
-        tickets = Ticket.query.filter_by(customer_id=current_user.id, company_id=company_id).order_by(Ticket.updated_at.desc()).all()
+        query = query.filter_by(customer_id=current_user.id, company_id=company_id)
     elif current_user.role == 'agent':
-        tickets = Ticket.query.filter(
+        query = query.filter(
             Ticket.company_id == company_id,
             (Ticket.agent_id == current_user.id) | (Ticket.agent_id == None),
             Ticket.status.in_(['Open', 'In Progress', 'Pending Customer'])
-        ).order_by(Ticket.updated_at.desc(), Ticket.priority).all()
+        )
     elif current_user.role == 'admin':
-        tickets = Ticket.query.filter_by(company_id=company_id).order_by(Ticket.updated_at.desc()).all()
+        query = query.filter_by(company_id=company_id)
     else:
-        tickets = []
         flash("Invalid user role for viewing tickets.", "warning")
+        query = None
+
+    tickets = []
+    next_cursor = None
+    if query is not None:
+        if status_filter in TICKET_STATUSES:
+            query = query.filter(Ticket.status == status_filter)
+        if priority_filter in TICKET_PRIORITIES:
+            query = query.filter(Ticket.priority == priority_filter)
+        if agent_filter and current_user.role != 'customer':
+            if agent_filter == 'unassigned':
+                query = query.filter(Ticket.agent_id == None)
+            elif agent_filter == 'me':
+                query = query.filter(Ticket.agent_id == current_user.id)
+            elif agent_filter.isdigit():
+                query = query.filter(Ticket.agent_id == int(agent_filter))
+
+        decoded_cursor = _decode_ticket_cursor(cursor) if cursor else None
+        if decoded_cursor:
+            cursor_updated_at, cursor_id = decoded_cursor
+            query = query.filter(or_(
+                Ticket.updated_at < cursor_updated_at,
+                and_(Ticket.updated_at == cursor_updated_at, Ticket.id < cursor_id)
+            ))
+
+        # Fetch one extra row to know whether another page exists.
+        tickets = query.order_by(Ticket.updated_at.desc(), Ticket.id.desc()).limit(per_page + 1).all()
+        if len(tickets) > per_page:
+            tickets = tickets[:per_page]
+            next_cursor = _encode_ticket_cursor(tickets[-1])
+
+    agents = []
+    if current_user.role in ['agent', 'admin']:
+        agents = User.query.filter_by(company_id=company_id, role='agent').order_by(User.username).all()
 
-    return render_template('list_tickets.html', tickets=tickets, title="Support Tickets", User=User)
+    filters = {'status': status_filter, 'priority': priority_filter, 'agent': agent_filter, 'per_page': per_page}
+    return render_template('list_tickets.html', tickets=tickets, title="Support Tickets",
+                           next_cursor=next_cursor, is_first_page=not cursor, filters=filters, agents=agents,
+                           statuses=TICKET_STATUSES, priorities=TICKET_PRIORITIES)
+
+
+@ticketing_bp.route('/search')
+@login_required
+def search_history():
+    """Full-text search over the company's tickets or chat messages (agents and admins). `format=json` for the API."""
+    wants_json = request.args.get('format') == 'json'
+    company_id = current_user.company_id
+    if current_user.role not in ['agent', 'admin'] or not company_id:
+        if wants_json:
+            return jsonify({"error": "Access denied"}), 403
+        flash("Access denied.", "danger")
+        return redirect(url_for('index'))
+
+    query_text = (request.args.get('q') or '').strip()
+    kind = request.args.get('kind') if request.args.get('kind') in SEARCH_KINDS else 'tickets'
+    page_number = max(1, request.args.get('page', 1, type=int))
+    config = current_app.config
+    with stage('search'):
+        results = search(kind, company_id, query_text, page=page_number, page_size=config['SEARCH_PAGE_SIZE'],
+                         max_candidates=config['SEARCH_MAX_CANDIDATES'])
+
+    if wants_json:
+        if kind == 'tickets':
+            hits = [{"ticket_id": ticket.id, "subject": ticket.subject, "status": ticket.status,
+                     "updated_at": ticket.updated_at.isoformat() if ticket.updated_at else None,
+                     "subject_highlight": str(subject), "description_highlight": str(description)}
+                    for ticket, subject, description in results.hits]
+        else:
+            hits = [{"message_id": message.id, "session_id": message.session_id, "ticket_id": message.ticket_id,
+                     "sender_type": message.sender_type, "timestamp": message.timestamp.isoformat() if message.timestamp else None,
+                     "highlight": str(highlight)}
+                    for message, highlight in results.hits]
+        return jsonify({"query": query_text, "kind": kind, "page": results.page, "page_size": results.page_size,
+                        "total": results.total, "capped": results.capped, "has_next": results.has_next,
+                        "unavailable": results.unavailable, "results": hits})
+    return render_template('search.html', title="Search History", query=query_text, kind=kind, results=results)
 
 
 @ticketing_bp.route('/create', methods=['GET', 'POST'])
@@ -86,30 +246,13 @@ def create_ticket():
     # For now, validate_on_submit() will trigger on any submit within the form
     if form.validate_on_submit() and (request.form.get('create_ticket_submit') or request.form.get('submit_ticket_details')): # Check if either create button was clicked
         current_app.logger.info(f"Create ticket form submitted by user {current_user.id}")
-        description_for_ai = form.description.data
-        category_suggestion_prompt = f"Analyze the following support ticket description and suggest a Category (e.g., Billing, Technical, Feature Request, General Inquiry) and a Priority (Low, Medium, High, Urgent).\n\nDescription: \"{description_for_ai}\"\n\nRespond with 'Category: <category_name>' and 'Priority: <priority_level>' on separate lines or clearly indicated."
-        ai_suggestions_text = query_llm_groq(category_suggestion_prompt, system_message="You are a ticket analysis assistant. Provide only Category and Priority.")
-        current_app.logger.info(f"AI suggestions for new ticket: {ai_suggestions_text}")
-
-        suggested_category = "General Inquiry"
-        suggested_priority = "Medium"
-        try:
-            lines = ai_suggestions_text.lower().split('\n')
-            for line in lines:
-                if line.startswith("category:"):
-                    suggested_category = line.split("category:")[1].strip().title()
-                elif line.startswith("priority:"):
-                    suggested_priority = line.split("priority:")[1].strip().title()
-        except Exception as e:
-            current_app.logger.error(f"Error parsing AI suggestions for ticket: {e} - Raw: {ai_suggestions_text}")
-
         new_ticket_data = {
             'subject': form.subject.data,
             'description': form.description.data, # Description is required and taken from form
             'customer_id': current_user.id,
             'company_id': company_id,
-            'category': form.category.data if hasattr(form, 'category') and form.category.data else suggested_category,
-            'priority': suggested_priority,
+            'category': form.category.data if hasattr(form, 'category') and form.category.data else DEFAULT_TICKET_CATEGORY,
+            'priority': DEFAULT_TICKET_PRIORITY,
             'status': 'Open'
         }
 
@@ -126,6 +269,15 @@ def create_ticket():
         ticket = Ticket(**new_ticket_data)
         db.session.add(ticket)
         db.session.commit()
+        # Category/priority suggestions come from the LLM in the background; the ticket is usable right away.
+        enqueue_job('categorize_ticket', ticket_id=ticket.id, company_id=company_id, payload={
+            'text': form.description.data,
+            'keep_category': bool(hasattr(form, 'category') and form.category.data),
+            'keep_priority': current_user.role in ['admin', 'agent'] and hasattr(form, 'priority') and bool(form.priority.data),
+        })
+        enqueue_job('refresh_ticket_suggestions', ticket_id=ticket.id, company_id=company_id)
+        if current_app.config['TICKET_SIMILARITY_ENABLED']:
+            enqueue_job('index_ticket', ticket_id=ticket.id, company_id=company_id)
         flash('Ticket created successfully!', 'success')
         current_app.logger.info(f"Ticket {ticket.id} created successfully.")
         return redirect(url_for('ticketing.view_ticket', ticket_id=ticket.id))
@@ -140,7 +292,8 @@ def create_ticket():
 @ticketing_bp.route('/<int:ticket_id>', methods=['GET', 'POST'])
 @login_required
 def view_ticket(ticket_id):
-    ticket = db.session.get(Ticket, ticket_id)
+    with stage('ticket_load'):
+        ticket = db.session.get(Ticket, ticket_id, options=[joinedload(Ticket.customer), joinedload(Ticket.agent)])
     if not ticket:
         flash(f"Ticket with ID {ticket_id} not found.", "danger")
         current_app.logger.warning(f"Attempt to view non-existent ticket ID: {ticket_id}")
@@ -187,28 +340,6 @@ def view_ticket(ticket_id):
         if hasattr(form, 'description'): del form.description # Remove description field from form if customer doesn't edit it here
         if hasattr(form, 'submit_ticket_details'): del form.submit_ticket_details
 
-    ai_suggested_solutions = []
-    if current_user.role in ['agent', 'admin'] and ticket_company:
-        # ... (AI suggestion logic remains the same) ...
-        chroma_client = init_chroma_client()
-        st_embedding_function = get_chroma_embedding_function()
-        if chroma_client and st_embedding_function:
-            collection = get_company_collection(chroma_client, ticket_company.id, st_embedding_function)
-            if collection:
-                search_query_text = f"Subject: {ticket.subject}\nDescription: {ticket.description}"
-                try:
-                    results = collection.query(query_texts=[search_query_text], n_results=3, include=['documents', 'metadatas'])
-                    if results and results.get('documents') and results['documents'][0]:
-                        for doc_text, metadata in zip(results['documents'][0], results['metadatas'][0]):
-                            ai_suggested_solutions.append({
-                                "title": metadata.get('title', 'N/A'),
-                                "content_snippet": doc_text[:300] + "...",
-                                "id": metadata.get('item_db_id')
-                            })
-                except Exception as e:
-                    current_app.logger.error(f"Error fetching AI suggestions from ChromaDB for ticket {ticket_id}: {e}")
-
-
     if 'submit_ticket_details' in request.form and current_user.role in ['agent', 'admin']:
         current_app.logger.info(f"Update ticket details submitted for ticket {ticket.id} by user {current_user.id}")
         current_app.logger.debug(f"Form data received for update: {request.form}")
@@ -216,6 +347,7 @@ def view_ticket(ticket_id):
 
         if form.validate_on_submit():
             current_app.logger.info(f"Ticket update form validated successfully for ticket {ticket.id}.")
+            subject_changed = ticket.subject != form.subject.data
             ticket.subject = form.subject.data
             # ticket.description = form.description.data # DO NOT UPDATE from form if not editable in this section
             ticket.status = form.status.data
@@ -231,6 +363,8 @@ def view_ticket(ticket_id):
             ticket.updated_at = datetime.utcnow()
             try:
                 db.session.commit()
+                if subject_changed: # Suggestions are keyed on the ticket text; recompute them off the request path
+                    enqueue_job('refresh_ticket_suggestions', ticket_id=ticket.id, company_id=ticket.company_id)
                 flash('Ticket updated successfully.', 'success')
                 current_app.logger.info(f"Ticket {ticket.id} successfully updated in DB. New agent_id: {ticket.agent_id}, Status: {ticket.status}")
                 return redirect(url_for('ticketing.view_ticket', ticket_id=ticket.id))
@@ -287,8 +421,155 @@ def view_ticket(ticket_id):
         current_app.logger.warning(f"Add note validation failed for ticket {ticket.id}.")
 
 
-    ticket_messages = ChatMessage.query.filter_by(ticket_id=ticket.id).order_by(ChatMessage.timestamp.asc()).all()
+    categorization_job = None
+    ai_suggested_solutions = []
+    similar = []
+    duplicate_of = None
+    duplicate_score = None
+    possible_duplicates = []
+    if current_user.role in ['agent', 'admin']:
+        categorization_job = latest_job_for_ticket(ticket.id, 'categorize_ticket')
+        # Only reached when the page is rendered (successful POSTs redirect first). Suggestions are served
+        # from ticket_suggestion and recomputed only when the ticket text or the company KB changed.
+        if ticket_company:
+            try:
+                with stage('suggestions'):
+                    ai_suggested_solutions = get_ticket_suggestions(ticket, ticket_company)
+            except Exception as e:
+                db.session.rollback() # Keep the session usable for the rest of the page
+                current_app.logger.error(f"Error fetching AI suggestions from ChromaDB for ticket {ticket_id}: {e}")
+        if current_app.config['TICKET_SIMILARITY_ENABLED']:
+            try:
+                with stage('similar_tickets'):
+                    similarity = ensure_ticket_indexed(ticket)
+                    if similarity:
+                        similar = similar_tickets(ticket)
+                        if similarity.duplicate_of_id:
+                            duplicate_of = db.session.get(Ticket, similarity.duplicate_of_id)
+                            duplicate_score = similarity.duplicate_score
+                    possible_duplicates = duplicates_of(ticket)
+            except Exception as e:
+                db.session.rollback() # e.g. the index job's commit failed on a locked database
+                current_app.logger.error(f"Error fetching similar tickets for ticket {ticket_id}: {e}")
+
+    with stage('messages_load'):
+        ticket_messages = ChatMessage.query.options(joinedload(ChatMessage.user))\
+                                           .filter_by(ticket_id=ticket.id).order_by(ChatMessage.timestamp.asc()).all()
 
     return render_template('view_ticket.html', ticket=ticket, form=form, note_form=note_form,
                            ticket_messages=ticket_messages, ai_suggested_solutions=ai_suggested_solutions,
-                           title=f"Ticket #{ticket.id}", User=User)
\ No newline at end of file
+                           categorization_job=categorization_job, similar_tickets=similar, duplicate_of=duplicate_of,
+                           duplicate_score=duplicate_score, possible_duplicates=possible_duplicates, title=f"Ticket #{ticket.id}")
+
+
+def _populate_bulk_choices(form, company_id):
+    form.status.choices = [('', 'No change')] + [(status, status) for status in TICKET_STATUSES]
+    agents = User.query.filter_by(company_id=company_id, role='agent').order_by(User.username).all()
+    form.assignee_id.choices = [(-1, 'No change'), (0, 'Unassigned')] + [(agent.id, agent.username) for agent in agents]
+
+
+@ticketing_bp.route('/clusters', methods=['GET', 'POST'])
+@login_required
+def ticket_clusters():
+    """Groups of near-identical open tickets (from the cluster_tickets job), each with a bulk action."""
+    company_id = current_user.company_id
+    if current_user.role not in ['agent', 'admin'] or not company_id:
+        flash("Access denied.", "danger")
+        return redirect(url_for('index'))
+
+    config = current_app.config
+    refresh_form = TicketClusterRefreshForm()
+    latest_job = latest_cluster_job(company_id)
+    pending = latest_job is not None and latest_job.status in ('queued', 'running')
+    if config['TICKET_SIMILARITY_ENABLED'] and not pending:
+        if request.method == 'POST' and refresh_form.validate_on_submit():
+            enqueue_job('cluster_tickets', company_id=company_id)
+            flash('Re-clustering open tickets.', 'info')
+            return redirect(url_for('ticketing.ticket_clusters'))
+        stale = latest_job is None or latest_job.finished_at is None or \
+            (datetime.utcnow() - latest_job.finished_at).total_seconds() > config['TICKET_CLUSTER_MAX_AGE_SECONDS']
+        if request.method == 'GET' and stale:
+            latest_job = enqueue_job('cluster_tickets', company_id=company_id)
+            pending = latest_job.status in ('queued', 'running')
+
+    done_job = latest_cluster_job(company_id, status='succeeded')
+    result = json.loads(done_job.result) if done_job and done_job.result else None
+    clusters = []
+    if result:
+        cluster_ids = [ticket_id for cluster in result['clusters'] for ticket_id in cluster['ticket_ids']]
+        # Tickets closed (or reassigned elsewhere) since the run drop out of their cluster.
+        tickets = {ticket.id: ticket for ticket in Ticket.query.options(joinedload(Ticket.agent)).filter(
+            Ticket.id.in_(cluster_ids), Ticket.company_id == company_id,
+            Ticket.status.notin_(CLOSED_TICKET_STATUSES)).all()} if cluster_ids else {}
+        for cluster in result['clusters']:
+            members = [tickets[ticket_id] for ticket_id in cluster['ticket_ids'] if ticket_id in tickets]
+            if len(members) >= max(2, config['TICKET_CLUSTER_MIN_SIZE']):
+                clusters.append(members)
+
+    bulk_form = TicketBulkUpdateForm()
+    _populate_bulk_choices(bulk_form, company_id)
+    bulk_form.assignee_id.data = -1
+    return render_template('ticket_clusters.html', title="Related Ticket Clusters", clusters=clusters, result=result,
+                           pending=pending, latest_job=latest_job, bulk_form=bulk_form, refresh_form=refresh_form,
+                           enabled=config['TICKET_SIMILARITY_ENABLED'])
+
+
+@ticketing_bp.route('/clusters/bulk', methods=['POST'])
+@login_required
+def bulk_update_tickets():
+    """Sets status / assignee and optionally adds the same reply on every ticket of a cluster."""
+    company_id = current_user.company_id
+    if current_user.role not in ['agent', 'admin'] or not company_id:
+        flash("Access denied.", "danger")
+        return redirect(url_for('index'))
+
+    form = TicketBulkUpdateForm()
+    _populate_bulk_choices(form, company_id)
+    if not form.validate_on_submit():
+        flash('Error applying the bulk update. Please check the form fields.', 'danger')
+        for field, errors in form.errors.items():
+            for error in errors:
+                current_app.logger.error(f"Bulk update form error in field '{field}': {error}")
+        return redirect(url_for('ticketing.ticket_clusters'))
+
+    ticket_ids = [int(value) for value in form.ticket_ids.data.split(',') if value.strip().isdigit()]
+    tickets = Ticket.query.filter(Ticket.id.in_(ticket_ids), Ticket.company_id == company_id).all() if ticket_ids else []
+    note = (form.note_content.data or '').strip()
+    if not tickets or (not form.status.data and form.assignee_id.data == -1 and not note):
+        flash('Nothing to update.', 'info')
+        return redirect(url_for('ticketing.ticket_clusters'))
+
+    now = datetime.utcnow()
+    for ticket in tickets:
+        if form.status.data:
+            ticket.status = form.status.data
+        if form.assignee_id.data != -1:
+            ticket.agent_id = form.assignee_id.data or None
+        if note:
+            db.session.add(ChatMessage(ticket_id=ticket.id, user_id=current_user.id, company_id=company_id,
+                                       session_id=f"ticket_{ticket.id}", sender_type='agent', message_text=note))
+        ticket.updated_at = now
+    try:
+        db.session.commit()
+        flash(f'Updated {len(tickets)} ticket(s).', 'success')
+        current_app.logger.info(f"Bulk update by user {current_user.id} on tickets {[ticket.id for ticket in tickets]}: "
+                                f"status={form.status.data or '-'}, assignee={form.assignee_id.data}, note={bool(note)}")
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Database error applying the bulk update: {str(e)}', 'danger')
+        current_app.logger.error(f"DB Error on commit for bulk ticket update: {e}")
+    return redirect(url_for('ticketing.ticket_clusters'))
+
+
+@ticketing_bp.route('/jobs/<int:job_id>')
+@login_required
+def job_status(job_id):
+    job = db.session.get(BackgroundJob, job_id)
+    if not job or job.company_id != current_user.company_id or current_user.role not in ['agent', 'admin']:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify({
+        "id": job.id, "job_type": job.job_type, "status": job.status, "ticket_id": job.ticket_id,
+        "attempts": job.attempts, "max_attempts": job.max_attempts, "last_error": job.last_error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    })
\ No newline at end of file
@@ -1,35 +1,300 @@
-import openai 
+import asyncio
+import re
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from flask import current_app
+
+from .metrics import record_llm_call, stage
+from .llm_limits import (LLMSlot, llm_slot, coalesce_key, coalesced, LLMCapacityError, async_llm_slot, async_coalesced,
+                         current_company_id)
 # No Pinecone-specific utilities needed anymore.
 # No client-side embedding generation utility needed here if Chroma handles it.
 
-def query_llm_groq(prompt, system_message=None, model_name=None, temperature=0.7, max_tokens=500):
-    """Queries an LLM via Groq API."""
-    try:
-        api_key = current_app.config.get('GROQ_API_KEY')
-        if not api_key or api_key == "YOUR_GROQ_API_KEY":
-            current_app.logger.error("Groq API key not configured or is a placeholder.")
-            return "Error: Groq API key not configured."
+# Long-lived LLM clients, one per (base_url, api_key, timeout, retries, pool size) per worker,
+# so every prompt reuses pooled keep-alive connections instead of a fresh TLS handshake.
+_llm_clients = {}
+_llm_clients_lock = threading.Lock()
+_async_llm_clients = weakref.WeakKeyDictionary() # event loop -> {key: AsyncOpenAI}; httpx async pools are loop-bound
+_llm_batch_executor = None
+_llm_batch_executor_lock = threading.Lock()
 
-        client = openai.OpenAI(
-            base_url="https://api.groq.com/openai/v1", 
-            api_key=api_key,
+
+def get_llm_client():
+    """Returns the shared, connection-pooled OpenAI-compatible client for the configured base URL."""
+    config = current_app.config
+    key = (
+        config.get('GROQ_BASE_URL'),
+        config.get('GROQ_API_KEY'),
+        config.get('LLM_TIMEOUT_SECONDS'),
+        config.get('LLM_MAX_RETRIES'),
+        config.get('LLM_MAX_CONNECTIONS'),
+    )
+    client = _llm_clients.get(key)
+    if client is not None:
+        return client
+    with _llm_clients_lock:
+        client = _llm_clients.get(key)
+        if client is None:
+            import httpx, openai # Deferred so requests that never call the LLM don't import the SDK
+            base_url, api_key, timeout, max_retries, max_connections = key
+            http_client = httpx.Client(
+                timeout=timeout,
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            )
+            client = openai.OpenAI(
+                base_url=base_url,
+                api_key=api_key,
+                timeout=timeout,
+                max_retries=max_retries,
+                http_client=http_client,
+            )
+            _llm_clients[key] = client
+            current_app.logger.info(f"LLM client initialized. Base URL: {base_url}, pool size: {max_connections}")
+        return client
+
+
+def get_async_llm_client():
+    """AsyncOpenAI counterpart of get_llm_client() for the running event loop, pooled up to LLM_ASYNC_MAX_CONNECTIONS."""
+    config = current_app.config
+    key = (
+        config.get('GROQ_BASE_URL'),
+        config.get('GROQ_API_KEY'),
+        config.get('LLM_TIMEOUT_SECONDS'),
+        config.get('LLM_MAX_RETRIES'),
+        config.get('LLM_ASYNC_MAX_CONNECTIONS'),
+    )
+    clients = _async_llm_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(key)
+    if client is None:
+        import httpx, openai
+        base_url, api_key, timeout, max_retries, max_connections = key
+        http_client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
         )
-        
-        messages = []
-        if system_message:
-            messages.append({"role": "system", "content": system_message})
-        messages.append({"role": "user", "content": prompt})
-
-        chat_model = model_name or current_app.config['CHAT_MODEL_GROQ']
-        
-        response = client.chat.completions.create(
-            model=chat_model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
+        client = clients[key] = openai.AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            timeout=timeout,
+            max_retries=max_retries,
+            http_client=http_client,
         )
-        return response.choices[0].message.content.strip()
+        current_app.logger.info(f"Async LLM client initialized. Base URL: {base_url}, pool size: {max_connections}")
+    return client
+
+
+def _build_llm_messages(prompt, system_message=None):
+    messages = []
+    if system_message:
+        messages.append({"role": "system", "content": system_message})
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+def _llm_api_key_configured():
+    api_key = current_app.config.get('GROQ_API_KEY')
+    if not api_key or api_key == "YOUR_GROQ_API_KEY":
+        current_app.logger.error("Groq API key not configured or is a placeholder.")
+        return False
+    return True
+
+
+def query_llm_groq(prompt, system_message=None, model_name=None, temperature=0.7, max_tokens=500, company_id=None):
+    """Queries an LLM via Groq API.
+
+    Identical concurrent calls are coalesced into one request, and each request
+    holds a concurrency slot for `company_id` (default: the current user's
+    company). Raises LLMCapacityError when no slot frees up in time; other
+    failures come back as an "Error: ..." string.
+    """
+    chat_model = model_name or current_app.config['CHAT_MODEL_GROQ']
+    if not _llm_api_key_configured():
+        return "Error: Groq API key not configured."
+    messages = _build_llm_messages(prompt, system_message)
+    company_id = company_id if company_id is not None else current_company_id()
+
+    def call():
+        with llm_slot(company_id):
+            try:
+                client = get_llm_client()
+                with stage('llm'):
+                    response = client.chat.completions.create(
+                        model=chat_model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                    )
+                usage = getattr(response, 'usage', None)
+                record_llm_call(chat_model, 'sync', 'ok', getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None))
+                return response.choices[0].message.content.strip()
+            except Exception as e:
+                record_llm_call(chat_model, 'sync', 'error')
+                current_app.logger.error(f"Error querying LLM from Groq model {chat_model}: {e}")
+                return f"Error: Could not get response from LLM. Details: {str(e)}"
+
+    return coalesced(coalesce_key(company_id, chat_model, messages, temperature, max_tokens), call)
+
+
+def query_llm_groq_batch(requests):
+    """Sends several prompts concurrently and returns their responses in order.
+
+    `requests` is a list of keyword-argument dicts for `query_llm_groq`, e.g.
+    [{"prompt": ..., "system_message": ...}, ...]. Each request gets its own
+    error string on failure, exactly as `query_llm_groq` would return.
+    """
+    if not requests:
+        return []
+    if len(requests) == 1:
+        return [query_llm_groq(**requests[0])]
+
+    global _llm_batch_executor
+    if _llm_batch_executor is None:
+        with _llm_batch_executor_lock:
+            if _llm_batch_executor is None:
+                _llm_batch_executor = ThreadPoolExecutor(
+                    max_workers=current_app.config.get('LLM_BATCH_MAX_WORKERS', 8),
+                    thread_name_prefix='llm-batch',
+                )
+
+    app = current_app._get_current_object()
+
+    def run(kwargs):
+        with app.app_context():
+            return query_llm_groq(**kwargs)
+
+    futures = [_llm_batch_executor.submit(run, kwargs) for kwargs in requests]
+    return [future.result() for future in futures]
+
+
+def stream_llm_groq(prompt, system_message=None, model_name=None, temperature=0.7, max_tokens=500, company_id=None, slot=None):
+    """Streams an LLM completion via Groq API, yielding text deltas as they arrive.
+
+    Pass a `slot` reserved with LLMSlot() before the response starts so a full
+    queue can still be answered with HTTP 429; it is released when the stream ends.
+    """
+    chat_model = model_name or current_app.config['CHAT_MODEL_GROQ']
+    try:
+        if not _llm_api_key_configured():
+            yield "Error: Groq API key not configured."
+            return
+        if slot is None:
+            slot = LLMSlot(company_id)
+
+        client = get_llm_client()
+        completion_tokens = 0
+        with stage('llm_stream'):
+            stream = client.chat.completions.create(
+                model=chat_model,
+                messages=_build_llm_messages(prompt, system_message),
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+            )
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    completion_tokens += count_tokens(delta)
+                    yield delta
+        # Streamed responses carry no usage block; token counts are the local approximation.
+        record_llm_call(chat_model, 'stream', 'ok', count_tokens(prompt) + count_tokens(system_message), completion_tokens)
+    except LLMCapacityError as e:
+        yield f"Error: {e}"
     except Exception as e:
-        current_app.logger.error(f"Error querying LLM from Groq model {chat_model}: {e}")
-        return f"Error: Could not get response from LLM. Details: {str(e)}"
+        record_llm_call(chat_model, 'stream', 'error')
+        current_app.logger.error(f"Error streaming LLM response from Groq model {chat_model}: {e}")
+        yield f"Error: Could not get response from LLM. Details: {str(e)}"
+    finally:
+        if slot is not None:
+            slot.release()
+
+
+async def async_query_llm_groq(prompt, system_message=None, model_name=None, temperature=0.7, max_tokens=500, company_id=None):
+    """query_llm_groq for the async chat path: awaits the LLM on the event loop instead of holding a thread.
+
+    Coalescing and concurrency limits work the same way, with the LLM_ASYNC_* caps.
+    """
+    chat_model = model_name or current_app.config['CHAT_MODEL_GROQ']
+    if not _llm_api_key_configured():
+        return "Error: Groq API key not configured."
+    messages = _build_llm_messages(prompt, system_message)
+    company_id = company_id if company_id is not None else current_company_id()
+
+    async def call():
+        async with async_llm_slot(company_id):
+            try:
+                client = get_async_llm_client()
+                with stage('llm'):
+                    response = await client.chat.completions.create(
+                        model=chat_model,
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                    )
+                usage = getattr(response, 'usage', None)
+                record_llm_call(chat_model, 'async', 'ok', getattr(usage, 'prompt_tokens', None), getattr(usage, 'completion_tokens', None))
+                return response.choices[0].message.content.strip()
+            except Exception as e:
+                record_llm_call(chat_model, 'async', 'error')
+                current_app.logger.error(f"Error querying LLM from Groq model {chat_model}: {e}")
+                return f"Error: Could not get response from LLM. Details: {str(e)}"
+
+    return await async_coalesced(coalesce_key(company_id, chat_model, messages, temperature, max_tokens), call)
+
+
+async def async_stream_llm_groq(prompt, system_message=None, model_name=None, temperature=0.7, max_tokens=500, company_id=None):
+    """stream_llm_groq for the async chat path. Capacity errors are raised before the first delta,
+    so callers can still answer with HTTP 429."""
+    chat_model = model_name or current_app.config['CHAT_MODEL_GROQ']
+    if not _llm_api_key_configured():
+        yield "Error: Groq API key not configured."
+        return
+    async with async_llm_slot(company_id):
+        try:
+            client = get_async_llm_client()
+            completion_tokens = 0
+            with stage('llm_stream'):
+                stream = await client.chat.completions.create(
+                    model=chat_model,
+                    messages=_build_llm_messages(prompt, system_message),
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True,
+                )
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        completion_tokens += count_tokens(delta)
+                        yield delta
+            record_llm_call(chat_model, 'async_stream', 'ok', count_tokens(prompt) + count_tokens(system_message), completion_tokens)
+        except Exception as e:
+            record_llm_call(chat_model, 'async_stream', 'error')
+            current_app.logger.error(f"Error streaming LLM response from Groq model {chat_model}: {e}")
+            yield f"Error: Could not get response from LLM. Details: {str(e)}"
+
+
+# Rough local token count (words + punctuation), close enough to BPE counts for
+# budgeting prompts without shipping a tokenizer.
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+def count_tokens(text):
+    return len(TOKEN_PATTERN.findall(text or ""))
+
+TRUNCATION_MARKER = "[...]"
+
+def truncate_to_tokens(text, max_tokens, keep='head'):
+    """Cuts `text` to at most `max_tokens` counted tokens, truncation marker included, keeping the
+    start ('head') or the end ('tail'). Returns "" if nothing fits beside the marker."""
+    matches = list(TOKEN_PATTERN.finditer(text or ""))
+    if len(matches) <= max(max_tokens, 0):
+        return text
+    kept = max_tokens - count_tokens(TRUNCATION_MARKER)
+    if kept <= 0:
+        return ""
+    if keep == 'tail':
+        return f"{TRUNCATION_MARKER} " + text[matches[-kept].start():]
+    return text[:matches[kept - 1].end()] + f" {TRUNCATION_MARKER}"
@@ -0,0 +1,420 @@
+import sys
+import os
+import argparse
+import functools
+import json
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the parent directory to sys.path to allow imports from 'core'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import event
+
+from config import Config
+from app import create_app, db
+from core.embeddings import build_embedding_function, embedding_backend_key
+
+# Offline, reproducible benchmark of the chat, copilot, ticket and KB endpoints.
+# Runs the real Flask app (test client, temp SQLite + Chroma) with the deterministic
+# 'hash' embedding backend by default (or --embedding-backend onnx/sentence_transformers
+# to include real embedding cost) and a local stub of the Groq chat-completions API
+# with configurable latency. Nothing leaves the machine.
+#   python scripts/benchmark.py --requests 200 --concurrency 4 --output bench.json
+#   python scripts/benchmark.py --llm-latency-ms 0 --endpoints list_tickets,view_ticket
+#   python scripts/benchmark.py --output new.json --compare old.json
+#   python scripts/benchmark.py --embedding-backend onnx --endpoints customer_chat,agent_assist
+
+ENDPOINTS = ['customer_chat', 'agent_assist', 'list_tickets', 'view_ticket', 'manage_kb']
+
+WORDS = ("account billing invoice refund payment card plan upgrade downgrade subscription router modem firmware "
+         "reset password login email notification device battery charger cable screen display sync backup restore "
+         "export import report dashboard api token webhook integration error timeout network wifi bluetooth pairing "
+         "shipping delivery order tracking return warranty replacement license seat admin permission role team "
+         "settings profile language region tax receipt discount coupon trial cancel renew usage quota limit storage").split()
+PRODUCTS = ['RX-900', 'RX-950', 'HomeHub', 'CloudSync Pro', 'Starter plan', 'Business plan', 'Enterprise plan']
+ERROR_CODES = ['E-4021', 'E-1007', 'E-5310', 'ERR_SYNC_12', 'AUTH-403']
+
+
+class TimedEmbeddingFunction:
+    """Wraps the configured embedding function and books its time under the 'embed' stage."""
+
+    def __init__(self, embedding_function, stage_timer):
+        self.embedding_function = embedding_function
+        self.stage_timer = stage_timer
+
+    def __call__(self, input):
+        started = time.perf_counter()
+        try:
+            return self.embedding_function(input)
+        finally:
+            self.stage_timer.add('embed', time.perf_counter() - started)
+
+
+class StageTimer:
+    """Per-thread accumulator of time spent in named stages during one request (stages may nest)."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def reset(self):
+        self._local.stages = {}
+
+    def add(self, stage, seconds):
+        stages = getattr(self._local, 'stages', None)
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    def snapshot(self):
+        return dict(getattr(self._local, 'stages', None) or {})
+
+    def wrap(self, fn, stage):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - started)
+        return timed
+
+
+def start_llm_stub(latency_ms, jitter_ms, seed):
+    """Serves an OpenAI-compatible /chat/completions on localhost; returns (server, base_url)."""
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            with rng_lock:
+                delay = max(0.0, latency_ms + rng.uniform(-jitter_ms, jitter_ms)) / 1000.0
+            time.sleep(delay)
+            system = next((m['content'] for m in body.get('messages', []) if m['role'] == 'system'), '')
+            answer = ("Category: Technical Support\nPriority: Medium" if 'categor' in system.lower()
+                      else "Thanks for reaching out. Based on our knowledge base, please try resetting the device "
+                           "and checking your plan settings. Let us know if the issue persists.")
+            if body.get('stream'):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                for word in answer.split(' '):
+                    chunk = {"id": "bench", "object": "chat.completion.chunk", "created": 0, "model": body.get('model'),
+                             "choices": [{"index": 0, "delta": {"content": word + ' '}, "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+                return
+            payload = json.dumps({
+                "id": "bench", "object": "chat.completion", "created": 0, "model": body.get('model'),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    class StubServer(ThreadingHTTPServer):
+        request_queue_size = 1024 # Concurrency benchmarks open hundreds of connections at once
+
+    server = StubServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='llm-stub', daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def sentence(rng, words=12):
+    text = " ".join(rng.choice(WORDS) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def seed_data(app, rng, kb_items, tickets):
+    from core.models import Company, User, KnowledgeItem, Ticket, ChatMessage
+    from core.knowledge_base import init_chroma_client, get_chroma_embedding_function, get_company_collection
+    from core.kb_ingest import index_pending_items
+    from core.ticket_suggestions import compute_ticket_suggestions
+
+    with app.app_context():
+        db.create_all()
+        company = Company(name='Benchmark Co', pinecone_namespace='benchmark-co')
+        db.session.add(company)
+        db.session.commit()
+        users = {}
+        for role in ['admin', 'agent', 'customer']:
+            user = User(username=f'bench_{role}', email=f'{role}@bench.example.com', role=role, company_id=company.id)
+            user.set_password('benchmark')
+            db.session.add(user)
+            users[role] = user
+        db.session.commit()
+
+        item_types = ['faq', 'product_info', 'troubleshooting_guide', 'policy']
+        for i in range(kb_items):
+            product, code = rng.choice(PRODUCTS), rng.choice(ERROR_CODES)
+            paragraphs = [sentence(rng, rng.randint(10, 25)) for _ in range(rng.randint(3, 30))]
+            paragraphs.insert(rng.randrange(len(paragraphs)), f"For {product}, error {code} is resolved by the steps below.")
+            db.session.add(KnowledgeItem(company_id=company.id, item_type=item_types[i % len(item_types)],
+                                         title=f"{product} {rng.choice(WORDS)} guide {i}", content="\n".join(paragraphs)))
+        db.session.commit()
+
+        for i in range(tickets):
+            ticket = Ticket(customer_id=users['customer'].id, company_id=company.id,
+                            agent_id=users['agent'].id if i % 3 else None,
+                            subject=f"{rng.choice(PRODUCTS)} {rng.choice(WORDS)} issue {rng.choice(ERROR_CODES)}",
+                            description=sentence(rng, 30), status=rng.choice(['Open', 'In Progress', 'Resolved']),
+                            priority=rng.choice(['Low', 'Medium', 'High']), category='General Inquiry')
+            db.session.add(ticket)
+            db.session.flush()
+            for j in range(3):
+                db.session.add(ChatMessage(ticket_id=ticket.id, company_id=company.id, session_id=f"bench-{ticket.id}",
+                                           user_id=users['customer'].id if j % 2 == 0 else None,
+                                           sender_type='customer' if j % 2 == 0 else 'bot', message_text=sentence(rng)))
+        db.session.commit()
+
+        st_embedding_function = get_chroma_embedding_function()
+        collection = get_company_collection(init_chroma_client(), company.id, st_embedding_function)
+        stats = index_pending_items(company.id, collection, st_embedding_function, batch_size=256)
+        # In the app these are computed when a ticket is created; view_ticket then serves them stored.
+        compute_ticket_suggestions(Ticket.query.filter_by(company_id=company.id).all(), company)
+        return {"company_id": company.id, "ticket_ids": [t.id for t in Ticket.query.with_entities(Ticket.id)],
+                "kb_items": kb_items, "kb_chunks": collection.count(), "index_seconds": stats['seconds']}
+
+
+def make_request(endpoint, rng, ticket_ids):
+    """Returns (role, method, path, json_body) for one request to `endpoint`."""
+    question = f"My {rng.choice(PRODUCTS)} shows {rng.choice(ERROR_CODES)} after {rng.choice(WORDS)} {rng.choice(WORDS)}, what should I do?"
+    if endpoint == 'customer_chat':
+        return 'customer', 'POST', '/chat/customer_chat', {"message": question}
+    if endpoint == 'agent_assist':
+        return 'agent', 'POST', '/chat/agent_assist', {"agent_query": question,
+                                                        "conversation_context": f"customer: {sentence(rng)}\nbot: {sentence(rng)}"}
+    if endpoint == 'list_tickets':
+        return 'agent', 'GET', '/tickets/', None
+    if endpoint == 'view_ticket':
+        return 'agent', 'GET', f"/tickets/{rng.choice(ticket_ids)}", None
+    if endpoint == 'manage_kb':
+        return 'admin', 'GET', '/kb/manage', None
+    raise ValueError(f"Unknown endpoint {endpoint}")
+
+
+def login(app, role):
+    client = app.test_client()
+    response = client.post('/auth/login', data={'email': f'{role}@bench.example.com', 'password': 'benchmark'})
+    if response.status_code != 302: # The login page re-renders with 200 on failure
+        raise RuntimeError(f"Login failed for {role}: HTTP {response.status_code}")
+    return client
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * pct / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def run_endpoint(app, endpoint, stage_timer, seed, ticket_ids, requests, concurrency, warmup):
+    """Drives `requests` calls to one endpoint from `concurrency` threads, each with its own logged-in client."""
+    samples = []
+    samples_lock = threading.Lock()
+
+    def worker(worker_index, count, record):
+        rng = random.Random(f"{seed}-{endpoint}-{worker_index}-{record}")
+        clients = {}
+        for _ in range(count):
+            role, method, path, body = make_request(endpoint, rng, ticket_ids)
+            client = clients.get(role) or clients.setdefault(role, login(app, role))
+            stage_timer.reset()
+            started = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            elapsed = time.perf_counter() - started
+            if record:
+                with samples_lock:
+                    samples.append((elapsed, response.status_code, stage_timer.snapshot()))
+
+    worker(0, warmup, record=False)
+    per_worker = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+    threads = [threading.Thread(target=worker, args=(i, n, True)) for i, n in enumerate(per_worker)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies = sorted(elapsed * 1000 for elapsed, _, _ in samples)
+    stage_totals = {}
+    for _, _, stages in samples:
+        for stage, seconds in stages.items():
+            stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for _, status, _ in samples if status >= 300), # Redirects mean access denied / login
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(samples) / wall, 2) if wall else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(latencies[-1], 2) if latencies else 0.0,
+        },
+        "stages_ms": {stage: round(total * 1000 / len(samples), 2) for stage, total in sorted(stage_totals.items())},
+    }
+
+
+def instrument(app, stage_timer):
+    """Times the expensive stages of a request: DB statements, vector/keyword search and LLM calls."""
+    import core.retrieval
+    import core.chatbot
+    import core.ticketing
+
+    core.retrieval.query_kb_items = stage_timer.wrap(core.retrieval.query_kb_items, 'vector_search')
+    core.retrieval.search_item_ids = stage_timer.wrap(core.retrieval.search_item_ids, 'keyword_search')
+    for module in (core.chatbot, core.ticketing):
+        module.query_llm_groq = stage_timer.wrap(module.query_llm_groq, 'llm')
+
+    with app.app_context():
+        engine = db.engine
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('bench_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        stage_timer.add('db', time.perf_counter() - conn.info['bench_started'].pop())
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(report, baseline=None):
+    print(f"\n{'endpoint':<15}{'req':>6}{'err':>5}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  stages (mean ms)")
+    for endpoint, result in report['results'].items():
+        latency = result['latency_ms']
+        stages = ", ".join(f"{stage} {ms}" for stage, ms in result['stages_ms'].items())
+        print(f"{endpoint:<15}{result['requests']:>6}{result['errors']:>5}{result['throughput_rps']:>9}"
+              f"{latency['p50']:>10}{latency['p95']:>10}{latency['p99']:>10}  {stages}")
+        previous = (baseline or {}).get('results', {}).get(endpoint)
+        if previous:
+            deltas = []
+            for key in ('p50', 'p95', 'p99'):
+                before = previous['latency_ms'][key]
+                deltas.append(f"{key} {((latency[key] - before) / before * 100 if before else 0):+.1f}%")
+            print(f"{'':<15}vs {baseline['meta'].get('git_revision') or 'baseline'}: {', '.join(deltas)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline latency/throughput benchmark for the main endpoints.")
+    parser.add_argument('--endpoints', default=",".join(ENDPOINTS), help=f"Comma-separated subset of {ENDPOINTS}")
+    parser.add_argument('--requests', type=int, default=100, help="Measured requests per endpoint")
+    parser.add_argument('--concurrency', type=int, default=1, help="Client threads per endpoint")
+    parser.add_argument('--warmup', type=int, default=5, help="Unmeasured requests per endpoint before measuring")
+    parser.add_argument('--kb-items', type=int, default=200)
+    parser.add_argument('--tickets', type=int, default=300)
+    parser.add_argument('--llm-latency-ms', type=float, default=300.0, help="Stub Groq API response latency")
+    parser.add_argument('--llm-jitter-ms', type=float, default=50.0)
+    parser.add_argument('--embedding-backend', choices=['hash', 'onnx', 'sentence_transformers'], default='hash',
+                        help="EMBEDDING_BACKEND to benchmark with (onnx/sentence_transformers need the model locally)")
+    parser.add_argument('--embedding-dim', type=int, default=384, help="Dimensions of the hash embedding backend")
+    parser.add_argument('--no-semantic-cache', action='store_true', help="Disable the chatbot semantic answer cache")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Write JSON results to this file")
+    parser.add_argument('--compare', help="Print latency deltas against an earlier JSON result")
+    parser.add_argument('--keep-data', action='store_true', help="Keep the temporary database/Chroma directory")
+    args = parser.parse_args()
+
+    endpoints = [e.strip() for e in args.endpoints.split(',') if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        sys.exit(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix='voss-bench-')
+    llm_server, llm_base_url = start_llm_stub(args.llm_latency_ms, args.llm_jitter_ms, args.seed)
+
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        CHROMA_DB_PATH = os.path.join(workdir, 'chroma')
+        WTF_CSRF_ENABLED = False
+        GROQ_API_KEY = 'benchmark'
+        GROQ_BASE_URL = llm_base_url
+        BACKGROUND_JOBS_ENABLED = False # Jobs run inline so every run does the same work
+        CHROMA_WARMUP_ON_STARTUP = False
+        SEMANTIC_CACHE_ENABLED = not args.no_semantic_cache
+        EMBEDDING_BACKEND = args.embedding_backend
+        EMBEDDING_HASH_DIMENSIONS = args.embedding_dim
+
+    try:
+        from core.knowledge_base import chroma_registry, warm_up_knowledge_base
+        stage_timer = StageTimer()
+        app = create_app(BenchmarkConfig)
+        app.logger.setLevel('WARNING')
+        chroma_registry.clear()
+        chroma_registry.set_embedding_function(embedding_backend_key(app.config),
+                                               TimedEmbeddingFunction(build_embedding_function(app.config), stage_timer))
+        warm_up_knowledge_base(app)
+
+        rng = random.Random(args.seed)
+        print(f"Seeding {args.kb_items} KB items and {args.tickets} tickets in {workdir} ...", flush=True)
+        dataset = seed_data(app, rng, args.kb_items, args.tickets)
+        print(f"Indexed {dataset['kb_chunks']} chunks in {dataset['index_seconds']}s.", flush=True)
+        instrument(app, stage_timer)
+
+        results = {}
+        for endpoint in endpoints:
+            print(f"Running {endpoint} ({args.requests} requests, concurrency {args.concurrency}) ...", flush=True)
+            results[endpoint] = run_endpoint(app, endpoint, stage_timer, args.seed, dataset['ticket_ids'],
+                                             args.requests, args.concurrency, args.warmup)
+
+        report = {
+            "meta": {
+                "git_revision": git_revision(),
+                "timestamp": datetime.utcnow().isoformat() + "Z",
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "args": vars(args),
+                "dataset": {k: v for k, v in dataset.items() if k != 'ticket_ids'},
+            },
+            "results": results,
+        }
+        baseline = None
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+        print_report(report, baseline)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"\nResults written to {args.output}")
+    finally:
+        llm_server.shutdown()
+        if args.keep_data:
+            print(f"Benchmark data kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import sys
+import os
+import argparse
+import asyncio
+import json
+import logging
+import random
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+# Add the parent directory to sys.path to allow imports from 'core'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import Config
+from app import create_app
+from scripts.benchmark import start_llm_stub, seed_data, make_request, percentile
+
+# Sync vs async execution of the chat endpoints under many concurrent chat turns.
+# Serves the same app two ways on localhost, against a stub Groq API with a fixed latency:
+#   sync:  the Flask app on a threaded WSGI server, capped at --sync-threads concurrent
+#          requests (what gunicorn workers x threads would allow)
+#   async: asgi.py's app (core/chat_async.py) under uvicorn, one process
+# and drives each with --concurrency simultaneous clients over real HTTP. Reports throughput,
+# latency percentiles and status codes per mode and concurrency level. LLM concurrency caps
+# are lifted in both modes so the execution model is what's measured; client and servers
+# share this process.
+#   python scripts/benchmark_concurrency.py --concurrency 50,200,400 --llm-latency-ms 1000
+#   python scripts/benchmark_concurrency.py --modes async --endpoint agent_assist --output async.json
+
+
+class ConcurrencyCap:
+    """WSGI middleware admitting at most `limit` requests at a time; the rest queue, as at a busy worker pool."""
+
+    def __init__(self, app, limit):
+        self.app = app
+        self.slots = threading.BoundedSemaphore(limit)
+
+    def __call__(self, environ, start_response):
+        with self.slots:
+            return list(self.app(environ, start_response))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve_sync(app, threads):
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', free_port(), ConcurrencyCap(app, threads), threaded=True)
+    server.socket.listen(1024)
+    threading.Thread(target=server.serve_forever, name='sync-server', daemon=True).start()
+    return server.shutdown, f"http://127.0.0.1:{server.server_port}"
+
+
+def serve_async(app):
+    import uvicorn
+    from core.chat_async import create_asgi_app
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(create_asgi_app(app), host='127.0.0.1', port=port, log_level='warning',
+                                           backlog=2048, timeout_keep_alive=30))
+    thread = threading.Thread(target=server.run, name='async-server', daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError("uvicorn failed to start")
+        time.sleep(0.05)
+
+    def shutdown():
+        server.should_exit = True
+        thread.join(timeout=10)
+    return shutdown, f"http://127.0.0.1:{port}"
+
+
+async def drive(base_url, endpoint, seed, requests, concurrency):
+    """`concurrency` clients send `requests` calls in total as fast as responses come back."""
+    import httpx
+    rng = random.Random(seed)
+    role = make_request(endpoint, rng, [])[0]
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        response = await client.post('/auth/login', data={'email': f'{role}@bench.example.com', 'password': 'benchmark'})
+        if response.status_code != 302:
+            raise RuntimeError(f"Login failed for {role}: HTTP {response.status_code}")
+        bodies = [make_request(endpoint, rng, [])[3] for _ in range(requests)]
+        latencies, statuses, errors = [], {}, 0
+        next_index = 0
+
+        async def client_loop():
+            nonlocal next_index, errors
+            while next_index < len(bodies):
+                body = bodies[next_index]
+                next_index += 1
+                started = time.perf_counter()
+                try:
+                    response = await client.post(make_request(endpoint, rng, [])[2], json=body)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                    if response.status_code == 200:
+                        latencies.append(time.perf_counter() - started)
+                except Exception:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[client_loop() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync vs async chat execution under concurrent load.")
+    parser.add_argument('--modes', default='sync,async', help="Comma-separated subset of sync,async")
+    parser.add_argument('--endpoint', choices=['customer_chat', 'agent_assist'], default='customer_chat')
+    parser.add_argument('--concurrency', default='50,200', help="Comma-separated concurrent client counts")
+    parser.add_argument('--requests', type=int, default=0, help="Requests per level (default: 2x the concurrency)")
+    parser.add_argument('--sync-threads', type=int, default=16, help="Concurrent requests the sync server admits")
+    parser.add_argument('--async-threads', type=int, default=Config.ASYNC_CHAT_THREADS, help="ASYNC_CHAT_THREADS for the async server")
+    parser.add_argument('--kb-items', type=int, default=100)
+    parser.add_argument('--llm-latency-ms', type=float, default=1000.0, help="Stub Groq API response latency")
+    parser.add_argument('--llm-jitter-ms', type=float, default=100.0)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    if set(modes) - {'sync', 'async'}:
+        sys.exit("--modes takes sync and/or async")
+    levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+
+    workdir = tempfile.mkdtemp(prefix='voss-bench-concurrency-')
+    llm_server, llm_base_url = start_llm_stub(args.llm_latency_ms, args.llm_jitter_ms, args.seed)
+
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+        CHROMA_DB_PATH = os.path.join(workdir, 'chroma')
+        EMBEDDING_CACHE_PATH = os.path.join(workdir, 'embedding_cache.sqlite')
+        WTF_CSRF_ENABLED = False
+        GROQ_API_KEY = 'benchmark'
+        GROQ_BASE_URL = llm_base_url
+        LLM_MAX_RETRIES = 0
+        BACKGROUND_JOBS_ENABLED = False
+        CHROMA_WARMUP_ON_STARTUP = False
+        SEMANTIC_CACHE_ENABLED = False # Every turn calls the LLM
+        CHAT_SUMMARY_ENABLED = False
+        EMBEDDING_BACKEND = 'hash'
+        METRICS_ENABLED = False
+        # No LLM concurrency caps (0) and a pool large enough for every in-flight call
+        LLM_MAX_CONCURRENT_CALLS = LLM_MAX_CONCURRENT_CALLS_PER_COMPANY = 0
+        LLM_ASYNC_MAX_CONCURRENT_CALLS = LLM_ASYNC_MAX_CONCURRENT_CALLS_PER_COMPANY = 0
+        LLM_MAX_CONNECTIONS = LLM_ASYNC_MAX_CONNECTIONS = max(levels + [args.sync_threads])
+        ASYNC_CHAT_THREADS = args.async_threads
+
+    try:
+        from core.knowledge_base import warm_up_knowledge_base
+        app = create_app(BenchmarkConfig)
+        app.logger.setLevel('ERROR')
+        logging.getLogger('werkzeug').setLevel('WARNING') # No per-request access log from the sync server
+        warm_up_knowledge_base(app)
+        print(f"Seeding {args.kb_items} KB items in {workdir} ...", flush=True)
+        seed_data(app, random.Random(args.seed), args.kb_items, 0)
+
+        results = {}
+        for mode in modes:
+            shutdown, base_url = serve_sync(app, args.sync_threads) if mode == 'sync' else serve_async(app)
+            try:
+                for level in levels:
+                    requests = args.requests or level * 2
+                    print(f"{mode}: {requests} x {args.endpoint} at concurrency {level} ...", flush=True)
+                    results.setdefault(mode, []).append(asyncio.run(drive(base_url, args.endpoint, args.seed, requests, level)))
+            finally:
+                shutdown()
+
+        print(f"\n{'mode':<6} {'conc':>5} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}  statuses")
+        for mode, rows in results.items():
+            for row in rows:
+                print(f"{mode:<6} {row['concurrency']:>5} {row['throughput_rps']:>8} {row['p50_ms']:>9} {row['p95_ms']:>9} "
+                      f"{row['max_ms']:>9}  {row['statuses']}{' errors=' + str(row['errors']) if row['errors'] else ''}")
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({"args": vars(args), "results": results}, f, indent=2)
+            print(f"\nResults written to {args.output}")
+    finally:
+        llm_server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+import sys
+import os
+import argparse
+import json
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+# Add the parent directory to sys.path to allow imports from 'core'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy.exc import OperationalError
+
+from config import Config
+from app import create_app
+from core.models import db, BackgroundJob, ChatMessage, Company, Ticket, User
+from scripts.benchmark import percentile
+
+# Concurrent chat-turn writers against a file SQLite database, in three configurations:
+#   legacy:     rollback journal, synchronous=FULL, and the old commit pattern of a chat
+#               turn (customer message, ticket, each job and the bot message committed
+#               separately)
+#   wal:        the pragmas create_app now sets (WAL, synchronous=NORMAL, busy timeout,
+#               page cache), same commit pattern
+#   wal_single: the pragmas plus one short transaction per turn after its reads, as
+#               core/chatbot.py now writes it
+# Each writer thread runs chat turns (history read, then writes; every --handoff-every-th
+# turn creates a ticket with its follow-up jobs) while --readers threads page through the
+# ticket list. Reports turns/s, turn latency, "database is locked" failures and reader
+# queries/s per configuration and writer count. Each configuration gets a fresh database.
+#   python scripts/benchmark_db_writes.py --writers 1,8,32 --turns 200
+#   python scripts/benchmark_db_writes.py --modes legacy,wal_single --readers 8 --output writes.json
+
+MODES = ['legacy', 'wal', 'wal_single']
+
+
+def mode_config(mode, workdir, pool_size):
+    class WriteBenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, mode + '.db')}"
+        CHROMA_DB_PATH = os.path.join(workdir, 'chroma')
+        EMBEDDING_CACHE_PATH = os.path.join(workdir, 'embedding_cache.sqlite')
+        BACKGROUND_JOBS_ENABLED = False
+        CHROMA_WARMUP_ON_STARTUP = False
+        METRICS_ENABLED = False
+        DB_POOL_SIZE = pool_size
+        DB_MAX_OVERFLOW = 0
+    if mode == 'legacy': # SQLite's defaults, with the same 5 s busy timeout the driver used before
+        WriteBenchmarkConfig.SQLITE_WAL_ENABLED = False
+        WriteBenchmarkConfig.SQLITE_SYNCHRONOUS = 'FULL'
+        WriteBenchmarkConfig.SQLITE_CACHE_SIZE_KB = 0
+    return WriteBenchmarkConfig
+
+
+def seed(app, customers):
+    with app.app_context():
+        db.create_all()
+        company = Company(name='Bench Co', pinecone_namespace='bench')
+        db.session.add(company)
+        db.session.commit()
+        users = [User(username=f'customer{i}', email=f'customer{i}@bench.example.com', role='customer', company_id=company.id)
+                 for i in range(customers)]
+        for user in users:
+            user.set_password('benchmark')
+        db.session.add_all(users)
+        db.session.commit()
+        return company.id, [user.id for user in users]
+
+
+def chat_turn(company_id, customer_id, session_id, text, handoff, single):
+    """The writes of one customer chat turn. `single` reads first and commits once (as now);
+    otherwise the customer message is saved up front and every step commits (as before)."""
+    def step():
+        db.session.flush() if single else db.session.commit()
+
+    user_message = ChatMessage(company_id=company_id, user_id=customer_id, session_id=session_id,
+                               sender_type='customer', message_text=text)
+    if not single:
+        db.session.add(user_message)
+        db.session.commit()
+    ChatMessage.query.filter_by(session_id=session_id, company_id=company_id)\
+                     .order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(10).all()
+    if single:
+        db.session.add(user_message) # The write transaction starts here
+    ticket = None
+    if handoff:
+        ticket = Ticket(customer_id=customer_id, company_id=company_id, subject=f"Chat Handoff: {text[:50]}",
+                        description=f"Chat session ID: {session_id}\nInitial query: {text}\n", status='Open',
+                        chat_history_reference=session_id)
+        db.session.add(ticket)
+        step()
+        for job_type in ('categorize_ticket', 'refresh_ticket_suggestions'):
+            db.session.add(BackgroundJob(job_type=job_type, ticket_id=ticket.id, company_id=company_id, payload='{}'))
+            step()
+        ChatMessage.query.filter_by(session_id=session_id).update({"ticket_id": ticket.id})
+    db.session.add(ChatMessage(company_id=company_id, user_id=None, ticket_id=ticket.id if ticket else None,
+                               session_id=session_id, sender_type='bot', message_text=f"Answer to: {text}"))
+    db.session.commit()
+
+
+def run_level(app, mode, company_id, customer_ids, writers, turns, readers, handoff_every, seed_value):
+    latencies, lock_errors, reader_queries = [], [0], [0]
+    lock = threading.Lock()
+    stop_readers = threading.Event()
+    single = mode == 'wal_single'
+
+    def writer(index):
+        rng = random.Random(seed_value * 1000 + index)
+        with app.app_context():
+            for turn in range(turns):
+                customer_id = customer_ids[index % len(customer_ids)]
+                started = time.perf_counter()
+                try:
+                    chat_turn(company_id, customer_id, f"w{index}-s{turn // 4}", f"question {rng.random():.6f} from writer {index}",
+                              handoff_every > 0 and turn % handoff_every == handoff_every - 1, single)
+                    elapsed = time.perf_counter() - started
+                    with lock:
+                        latencies.append(elapsed)
+                except OperationalError:
+                    db.session.rollback()
+                    with lock:
+                        lock_errors[0] += 1
+            db.session.remove()
+
+    def reader():
+        with app.app_context():
+            while not stop_readers.is_set():
+                try:
+                    Ticket.query.filter_by(company_id=company_id).order_by(Ticket.updated_at.desc(), Ticket.id.desc()).limit(25).all()
+                    db.session.rollback()
+                    with lock:
+                        reader_queries[0] += 1
+                except OperationalError:
+                    db.session.rollback()
+            db.session.remove()
+
+    reader_threads = [threading.Thread(target=reader, daemon=True) for _ in range(readers)]
+    writer_threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for thread in reader_threads:
+        thread.start()
+    started = time.perf_counter()
+    for thread in writer_threads:
+        thread.start()
+    for thread in writer_threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop_readers.set()
+    for thread in reader_threads:
+        thread.join()
+
+    latencies.sort()
+    return {
+        "writers": writers,
+        "turns": writers * turns,
+        "seconds": round(elapsed, 3),
+        "turns_per_second": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        "lock_errors": lock_errors[0],
+        "reader_queries_per_second": round(reader_queries[0] / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent chat-turn writers on SQLite: old vs tuned settings.")
+    parser.add_argument('--modes', default=','.join(MODES), help=f"Comma-separated subset of {','.join(MODES)}")
+    parser.add_argument('--writers', default='1,8,32', help="Comma-separated writer thread counts")
+    parser.add_argument('--turns', type=int, default=100, help="Chat turns per writer")
+    parser.add_argument('--readers', type=int, default=4, help="Threads listing tickets while the writers run")
+    parser.add_argument('--handoff-every', type=int, default=5, help="Every Nth turn creates a ticket (0: never)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Write JSON results to this file")
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(',') if m.strip()]
+    if set(modes) - set(MODES):
+        sys.exit(f"--modes takes {', '.join(MODES)}")
+    levels = [int(w) for w in args.writers.split(',') if w.strip()]
+
+    workdir = tempfile.mkdtemp(prefix='voss-bench-writes-')
+    results = {}
+    try:
+        for mode in modes:
+            app = create_app(mode_config(mode, workdir, max(levels) + args.readers))
+            app.logger.setLevel('ERROR')
+            company_id, customer_ids = seed(app, customers=16)
+            for level in levels:
+                print(f"{mode}: {level} writer(s) x {args.turns} turns, {args.readers} reader(s) ...", flush=True)
+                results.setdefault(mode, []).append(
+                    run_level(app, mode, company_id, customer_ids, level, args.turns, args.readers, args.handoff_every, args.seed))
+            with app.app_context():
+                db.engine.dispose()
+
+        print(f"\n{'mode':<11} {'writers':>7} {'turns/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'locked':>7} {'reads/s':>8}")
+        for mode, rows in results.items():
+            for row in rows:
+                print(f"{mode:<11} {row['writers']:>7} {row['turns_per_second']:>8} {row['p50_ms']:>8} {row['p95_ms']:>8} "
+                      f"{row['max_ms']:>8} {row['lock_errors']:>7} {row['reader_queries_per_second']:>8}")
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({"args": vars(args), "results": results}, f, indent=2)
+            print(f"\nResults written to {args.output}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
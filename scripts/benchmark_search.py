@@ -0,0 +1,146 @@
+import sys
+import os
+import argparse
+import json
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# Add the parent directory to sys.path to allow imports from 'core'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import Config
+from app import create_app
+from core.models import db, ChatMessage, Company, Ticket, User
+from core.search import search
+from scripts.benchmark import WORDS, PRODUCTS, ERROR_CODES, percentile
+
+# Ticket / chat message search latency as history grows. Builds a temp SQLite database
+# and, for each size in --messages, grows the chat history to that many messages
+# (--companies tenants, one ticket per --messages-per-ticket messages), then times
+# core.search.search() for a set of query shapes: a very common word,
+# a rare error code, a multi-word query, a miss and page 5 of a common word. Only the newest
+# SEARCH_MAX_CANDIDATES matches are ranked, so once a query has more matches than that its
+# latency stops growing with history; rarer terms and AND-ed common words still pay for
+# walking their posting lists.
+#   python scripts/benchmark_search.py --messages 10000,100000,1000000
+#   python scripts/benchmark_search.py --messages 50000 --max-candidates 500 --output search.json
+
+
+def grow_history(company_ids, customer_ids, target, messages_per_ticket, rng, batch_size=5000):
+    """Inserts messages (and their tickets) until the chat_message table holds `target` rows."""
+    current = db.session.query(db.func.count(ChatMessage.id)).scalar()
+    started_at = datetime.utcnow() - timedelta(days=365)
+    message_table, ticket_table = ChatMessage.__table__, Ticket.__table__
+    while current < target:
+        count = min(batch_size, target - current)
+        tickets, messages = [], []
+        for i in range(count):
+            n = current + i
+            company_index = n % len(company_ids)
+            words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 24)))
+            if rng.random() < 0.01:
+                words += f" {rng.choice(ERROR_CODES)}"
+            if rng.random() < 0.05:
+                words += f" {rng.choice(PRODUCTS)}"
+            timestamp = started_at + timedelta(seconds=n * 10)
+            messages.append({"company_id": company_ids[company_index], "user_id": customer_ids[company_index],
+                             "session_id": f"bench-{n // 8}", "sender_type": rng.choice(['customer', 'bot']),
+                             "message_text": words, "timestamp": timestamp})
+            if n % messages_per_ticket == 0:
+                tickets.append({"company_id": company_ids[company_index], "customer_id": customer_ids[company_index],
+                                "subject": " ".join(rng.choice(WORDS) for _ in range(5)), "description": words,
+                                "status": rng.choice(['Open', 'Resolved', 'Closed']), "created_at": timestamp, "updated_at": timestamp})
+        db.session.execute(message_table.insert(), messages)
+        if tickets:
+            db.session.execute(ticket_table.insert(), tickets)
+        db.session.commit()
+        current += count
+
+
+def time_queries(company_id, repeats, page_size, max_candidates):
+    shapes = {
+        "common word": ("tickets", "router", 1),
+        "common word (messages)": ("messages", "router", 1),
+        "rare error code": ("messages", ERROR_CODES[0], 1),
+        "three words": ("messages", "refund invoice card", 1),
+        "no match": ("messages", "zzyzx", 1),
+        "common word, page 5": ("messages", "billing", 5),
+    }
+    results = {}
+    for name, (kind, query_text, page) in shapes.items():
+        latencies, total = [], 0
+        for _ in range(repeats):
+            started = time.perf_counter()
+            page_result = search(kind, company_id, query_text, page=page, page_size=page_size, max_candidates=max_candidates)
+            latencies.append((time.perf_counter() - started) * 1000)
+            total = page_result.total
+            db.session.rollback()
+        latencies.sort()
+        results[name] = {"p50_ms": round(percentile(latencies, 50), 2), "p95_ms": round(percentile(latencies, 95), 2),
+                         "ranked_matches": total}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-text search latency vs history size.")
+    parser.add_argument('--messages', default='10000,100000,1000000', help="Comma-separated total chat message counts")
+    parser.add_argument('--companies', type=int, default=4)
+    parser.add_argument('--messages-per-ticket', type=int, default=8)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--page-size', type=int, default=Config.SEARCH_PAGE_SIZE)
+    parser.add_argument('--max-candidates', type=int, default=Config.SEARCH_MAX_CANDIDATES)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Write JSON results to this file")
+    args = parser.parse_args()
+    sizes = sorted(int(s) for s in args.messages.split(',') if s.strip())
+
+    workdir = tempfile.mkdtemp(prefix='voss-bench-search-')
+
+    class SearchBenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(workdir, 'search.db')}"
+        CHROMA_DB_PATH = os.path.join(workdir, 'chroma')
+        EMBEDDING_CACHE_PATH = os.path.join(workdir, 'embedding_cache.sqlite')
+        BACKGROUND_JOBS_ENABLED = False
+        CHROMA_WARMUP_ON_STARTUP = False
+        METRICS_ENABLED = False
+
+    rng = random.Random(args.seed)
+    results = []
+    try:
+        app = create_app(SearchBenchmarkConfig)
+        with app.app_context():
+            db.create_all()
+            companies = [Company(name=f'Bench Co {i}', pinecone_namespace=f'bench{i}') for i in range(args.companies)]
+            db.session.add_all(companies)
+            db.session.commit()
+            customers = [User(username=f'customer{c.id}', email=f'customer{c.id}@bench.example.com', role='customer',
+                              company_id=c.id, password_hash='-') for c in companies]
+            db.session.add_all(customers)
+            db.session.commit()
+            company_ids, customer_ids = [c.id for c in companies], [u.id for u in customers]
+
+            for size in sizes:
+                print(f"Growing history to {size} messages ...", flush=True)
+                started = time.perf_counter()
+                grow_history(company_ids, customer_ids, size, args.messages_per_ticket, rng)
+                print(f"  inserted in {time.perf_counter() - started:.1f}s (index updated by triggers)", flush=True)
+                results.append({"messages": size, "queries": time_queries(company_ids[0], args.repeats, args.page_size,
+                                                                          args.max_candidates)})
+
+        names = list(results[0]["queries"]) if results else []
+        print(f"\n{'query':<24}" + "".join(f"{row['messages']:>14}" for row in results) + "   (p50 / p95 ms)")
+        for name in names:
+            print(f"{name:<24}" + "".join(f"{row['queries'][name]['p50_ms']:>7}/{row['queries'][name]['p95_ms']:<6}" for row in results))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({"args": vars(args), "results": results}, f, indent=2)
+            print(f"\nResults written to {args.output}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
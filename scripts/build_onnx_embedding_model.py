@@ -0,0 +1,52 @@
+import sys
+import os
+import argparse
+import shutil
+
+# Add the parent directory to sys.path to allow imports from 'core'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import Config
+from core.embeddings import ONNX_MODEL_FILENAME, ONNX_TOKENIZER_FILENAME
+
+# Builds the int8-quantized ONNX MiniLM used by EMBEDDING_BACKEND=onnx.
+# By default the fp32 all-MiniLM-L6-v2 ONNX export published for Chroma is
+# downloaded (checksum-verified by chromadb) and dynamically quantized to int8.
+# Any other sentence-transformers model exported to ONNX (model.onnx +
+# tokenizer.json, e.g. with `optimum-cli export onnx`) can be passed with --source.
+# Quantization needs the `onnx` package (pip install onnx); serving does not.
+#   python scripts/build_onnx_embedding_model.py
+#   python scripts/build_onnx_embedding_model.py --source exported_model/ --output instance/onnx_embedding_model
+
+parser = argparse.ArgumentParser(description="Quantize a MiniLM ONNX export to int8 for the ONNX embedding backend.")
+parser.add_argument('--source', help="Directory with model.onnx and tokenizer.json (default: download all-MiniLM-L6-v2)")
+parser.add_argument('--output', default=Config.EMBEDDING_ONNX_MODEL_DIR, help="Target directory (EMBEDDING_ONNX_MODEL_DIR)")
+args = parser.parse_args()
+
+try:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+except ImportError as e:
+    sys.exit(f"Quantization needs onnxruntime and onnx ({e}). Install with: pip install onnx")
+
+source_dir = args.source
+if not source_dir:
+    if 'all-MiniLM-L6-v2' not in Config.EMBEDDING_MODEL_SENTENCE_TRANSFORMERS:
+        sys.exit(f"No published ONNX export for {Config.EMBEDDING_MODEL_SENTENCE_TRANSFORMERS}; export it and pass --source.")
+    from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+    downloader = ONNXMiniLM_L6_V2()
+    downloader._download_model_if_not_exists()
+    source_dir = os.path.join(downloader.DOWNLOAD_PATH, downloader.EXTRACTED_FOLDER_NAME)
+
+source_model = os.path.join(source_dir, 'model.onnx')
+source_tokenizer = os.path.join(source_dir, ONNX_TOKENIZER_FILENAME)
+for path in (source_model, source_tokenizer):
+    if not os.path.exists(path):
+        sys.exit(f"Missing {path}")
+
+os.makedirs(args.output, exist_ok=True)
+target_model = os.path.join(args.output, ONNX_MODEL_FILENAME)
+quantize_dynamic(source_model, target_model, weight_type=QuantType.QInt8)
+shutil.copyfile(source_tokenizer, os.path.join(args.output, ONNX_TOKENIZER_FILENAME))
+
+print(f"fp32 model: {os.path.getsize(source_model) / 1e6:.1f} MB -> int8 model: {os.path.getsize(target_model) / 1e6:.1f} MB")
+print(f"Wrote {target_model}. Set EMBEDDING_BACKEND=onnx (and EMBEDDING_ONNX_MODEL_DIR={args.output} if not the default).")
@@ -0,0 +1,120 @@
+import sys
+import os
+import argparse
+import gc
+import resource
+import time
+
+# Add the parent directory to sys.path to allow imports from 'core'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+
+from app import create_app
+from core.embeddings import build_embedding_function
+from core.retrieval import item_chunk_records
+
+# Compares a candidate embedding backend against the reference one on real KB
+# content before switching EMBEDDING_BACKEND: recall@k of the candidate's
+# top-k chunks against the reference's top-k (KB titles are used as queries),
+# cosine similarity between both backends' vectors for the same chunk, query
+# embedding latency and the memory each backend adds to the process.
+#   python scripts/check_embedding_recall.py
+#   python scripts/check_embedding_recall.py --company-id 3 --k 5 --min-recall 0.9
+#   python scripts/check_embedding_recall.py --reference sentence_transformers --candidate onnx --limit 500
+
+
+def rss_mb():
+    """Current resident set size in MB (Linux), falling back to the peak RSS."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+
+
+def load_backend(app, backend):
+    gc.collect()
+    before = rss_mb()
+    started = time.perf_counter()
+    embedding_function = build_embedding_function({**app.config, 'EMBEDDING_BACKEND': backend})
+    embedding_function(["warm up"])
+    return embedding_function, time.perf_counter() - started, rss_mb() - before
+
+
+def embed(embedding_function, texts):
+    return np.asarray(embedding_function(texts), dtype=np.float32)
+
+
+def query_latencies_ms(embedding_function, queries):
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        embedding_function([query])
+        latencies.append((time.perf_counter() - started) * 1000)
+    return np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+def top_k(document_vectors, query_vectors, k):
+    scores = query_vectors @ document_vectors.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check recall and speed of an embedding backend against a reference.")
+    parser.add_argument('--reference', default='sentence_transformers', help="Reference EMBEDDING_BACKEND")
+    parser.add_argument('--candidate', default='onnx', help="Candidate EMBEDDING_BACKEND")
+    parser.add_argument('--company-id', type=int, help="Only use this company's KB items (default: all)")
+    parser.add_argument('--limit', type=int, default=1000, help="Maximum KB items to load")
+    parser.add_argument('--k', type=int, default=5, help="Recall cut-off")
+    parser.add_argument('--min-recall', type=float, help="Exit 1 if recall@k is below this value")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        from core.models import KnowledgeItem
+        query = KnowledgeItem.query.order_by(KnowledgeItem.id)
+        if args.company_id:
+            query = query.filter_by(company_id=args.company_id)
+        items = query.limit(args.limit).all()
+        documents, queries = [], []
+        for item in items:
+            documents.extend(item_chunk_records(item)[1])
+            if item.title:
+                queries.append(item.title)
+
+    if not documents or not queries:
+        sys.exit("No KB items to compare.")
+    k = min(args.k, len(documents))
+    print(f"{len(documents)} chunks from {len(items)} KB items, {len(queries)} title queries, k={k}")
+
+    results = {}
+    for backend in (args.reference, args.candidate):
+        embedding_function, load_seconds, rss_delta = load_backend(app, backend)
+        document_vectors = embed(embedding_function, documents)
+        query_vectors = embed(embedding_function, queries)
+        p50, p95 = query_latencies_ms(embedding_function, queries[:200])
+        results[backend] = {"documents": document_vectors, "queries": query_vectors}
+        print(f"{backend:<22} load {load_seconds:6.2f}s  +{rss_delta:7.1f} MB RSS  "
+              f"query p50 {p50:6.2f} ms  p95 {p95:6.2f} ms")
+        del embedding_function
+
+    reference, candidate = results[args.reference], results[args.candidate]
+    if reference["documents"].shape[1] == candidate["documents"].shape[1]:
+        cosine = np.sum(reference["documents"] * candidate["documents"], axis=1)
+        print(f"Cosine(reference, candidate) per chunk: mean {cosine.mean():.4f}, min {cosine.min():.4f}")
+    else:
+        print("Backends have different dimensions; vectors are not interchangeable (re-index when switching).")
+
+    expected = top_k(reference["documents"], reference["queries"], k)
+    actual = top_k(candidate["documents"], candidate["queries"], k)
+    recall = np.mean([len(set(e) & set(a)) / k for e, a in zip(expected, actual)])
+    top1 = np.mean(expected[:, 0] == actual[:, 0])
+    print(f"recall@{k}: {recall:.4f}  top-1 agreement: {top1:.4f}")
+
+    if args.min_recall is not None and recall < args.min_recall:
+        sys.exit(f"recall@{k} {recall:.4f} is below --min-recall {args.min_recall}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import sys
+import os
+
+# Add the parent directory to sys.path to allow imports from 'core'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import text
+from app import create_app, db
+from core.models import User, Ticket, ChatMessage, KnowledgeItem
+
+# Runs EXPLAIN on the app's hot queries and fails if any of them falls back to a
+# full table scan. Run after scripts/migrate_db.py. Usage: python scripts/check_query_plans.py
+
+def hot_queries():
+    """Representative versions of the queries issued on every chat turn / ticket page."""
+    return {
+        "chat history for session": ChatMessage.query.filter_by(session_id='s', company_id=1)
+            .order_by(ChatMessage.timestamp.desc()).limit(10),
+        "ticket conversation": ChatMessage.query.filter_by(ticket_id=1).order_by(ChatMessage.timestamp.asc()),
+        "agent ticket queue": Ticket.query.filter(
+            Ticket.company_id == 1,
+            (Ticket.agent_id == 2) | (Ticket.agent_id == None),
+            Ticket.status.in_(['Open', 'In Progress', 'Pending Customer'])
+        ).order_by(Ticket.updated_at.desc(), Ticket.id.desc()).limit(26),
+        "customer tickets": Ticket.query.filter_by(customer_id=3, company_id=1)
+            .order_by(Ticket.updated_at.desc(), Ticket.id.desc()).limit(26),
+        "customer open ticket (handoff)": Ticket.query.filter(
+            Ticket.customer_id == 3, Ticket.company_id == 1, Ticket.status.notin_(['Closed', 'Resolved'])
+        ).order_by(Ticket.created_at.desc()).limit(1),
+        "admin ticket list": Ticket.query.filter_by(company_id=1)
+            .order_by(Ticket.updated_at.desc(), Ticket.id.desc()).limit(26),
+        "login by email": User.query.filter_by(email='user@example.com').limit(1),
+        "company knowledge items": KnowledgeItem.query.filter_by(company_id=1),
+    }
+
+
+def full_scan_lines(dialect, plan_lines):
+    if dialect == 'sqlite':
+        # "SCAN <table>" without an index is a full scan; "SEARCH ... USING INDEX" is fine.
+        return [line for line in plan_lines if line.strip().startswith('SCAN') and 'USING' not in line]
+    return [line for line in plan_lines if 'Seq Scan' in line]
+
+
+def explain(connection, dialect, query):
+    compiled = query.statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True})
+    if dialect == 'sqlite':
+        rows = connection.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).fetchall()
+        return [row[-1] for row in rows]
+    rows = connection.execute(text(f"EXPLAIN {compiled}")).fetchall()
+    return [row[0] for row in rows]
+
+
+if __name__ == '__main__':
+    app = create_app()
+    failures = 0
+    with app.app_context():
+        dialect = db.engine.dialect.name
+        with db.engine.connect() as connection:
+            if dialect == 'postgresql':
+                # Small tables make the planner prefer seq scans; ask whether an index path exists at all.
+                connection.execute(text("SET enable_seqscan = off"))
+            for name, query in hot_queries().items():
+                plan = explain(connection, dialect, query)
+                scans = full_scan_lines(dialect, plan)
+                print(f"[{'FAIL' if scans else ' OK '}] {name}")
+                for line in plan:
+                    print(f"        {line}")
+                failures += bool(scans)
+    if failures:
+        print(f"{failures} hot queries use a full table scan. Did you run scripts/migrate_db.py?")
+        sys.exit(1)
+    print("All hot queries are index-backed.")
@@ -0,0 +1,56 @@
+import sys
+import os
+import argparse
+
+# Add the parent directory to sys.path to allow imports from 'core'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app, db
+from core.models import Company
+from core.knowledge_base import init_chroma_client, get_chroma_embedding_function, get_company_collection, mark_kb_changed
+from core.kb_ingest import load_records_from_path, insert_knowledge_items, index_pending_items
+
+# Bulk-imports knowledge items for one company and indexes them in ChromaDB.
+# Safe to re-run: duplicates are skipped and indexing resumes with any items
+# that were inserted but not yet embedded.
+#   python scripts/import_kb.py --company-id 1 faqs.csv
+#   python scripts/import_kb.py --company-id 1 --item-type troubleshooting_guide docs/guides/
+
+parser = argparse.ArgumentParser(description="Bulk import knowledge items (CSV, JSONL or a directory of markdown files).")
+parser.add_argument('path', nargs='?', help="CSV/JSONL file or directory of .md files (omit to only resume indexing)")
+parser.add_argument('--company-id', type=int, required=True)
+parser.add_argument('--item-type', default=None, help="Default item type when the source doesn't specify one")
+parser.add_argument('--batch-size', type=int, default=None, help="Documents per embedding batch / Chroma upsert")
+parser.add_argument('--no-index', action='store_true', help="Only insert SQL rows; index later")
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    company = db.session.get(Company, args.company_id)
+    if not company:
+        sys.exit(f"Company {args.company_id} not found.")
+
+    if args.path:
+        records = load_records_from_path(args.path, args.item_type)
+        print(f"Parsed {len(records)} items from {args.path}")
+        inserted, skipped = insert_knowledge_items(company.id, records, batch_size=app.config['KB_IMPORT_INSERT_BATCH_SIZE'])
+        print(f"Inserted {inserted} items, skipped {skipped} duplicates.")
+
+    if not args.no_index:
+        chroma_client = init_chroma_client()
+        st_embedding_function = get_chroma_embedding_function()
+        collection = get_company_collection(chroma_client, company.id, st_embedding_function)
+        if not collection:
+            sys.exit("ChromaDB collection unavailable; rows are saved, re-run to index them.")
+
+        def print_progress(done, total, elapsed):
+            rate = done / elapsed if elapsed else 0
+            print(f"  indexed {done}/{total} ({rate:.1f} items/s)", flush=True)
+
+        stats = index_pending_items(company.id, collection, st_embedding_function,
+                                    batch_size=args.batch_size or app.config['KB_IMPORT_EMBED_BATCH_SIZE'],
+                                    progress=print_progress)
+        if stats['indexed']:
+            mark_kb_changed(company.id) # Drops cached answers, refreshes ticket suggestions
+        print(f"Indexed {stats['indexed']} items in {stats['seconds']}s ({stats['items_per_second']} items/s).")
@@ -0,0 +1,91 @@
+import sys
+import os
+import argparse
+import json
+import time
+
+# Add the parent directory to sys.path to allow imports from 'core'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app, db
+from core.models import Company, Ticket, TicketSimilarity
+from core.jobs import enqueue_job
+from core.knowledge_base import init_chroma_client, get_chroma_embedding_function, chroma_registry
+from core.ticket_similarity import get_ticket_collection, index_tickets, ticket_collection_name
+
+# Backfills each company's ticket embedding index (company_<id>_tickets) used for
+# duplicate detection and similar tickets, oldest ticket first, so every ticket is
+# checked for duplicates against the ones before it. Tickets already indexed with
+# the same text are skipped, so it is safe to re-run. Use --rebuild after changing
+# the embedding model; --cluster then runs the open-ticket clustering job inline
+# so /tickets/clusters has a fresh result.
+#   python scripts/index_tickets.py
+#   python scripts/index_tickets.py --company-id 3 --rebuild --cluster
+
+parser = argparse.ArgumentParser(description="Build or update the per-company ticket embedding index.")
+parser.add_argument('--company-id', type=int, action='append', help="Only these companies (repeatable; default: all)")
+parser.add_argument('--batch-size', type=int, default=None, help="Tickets per embedding batch / Chroma upsert")
+parser.add_argument('--rebuild', action='store_true', help="Drop each company's ticket collection and re-embed every ticket")
+parser.add_argument('--cluster', action='store_true', help="Cluster each company's open tickets afterwards")
+args = parser.parse_args()
+
+app = create_app()
+app.config['BACKGROUND_JOBS_ENABLED'] = False # --cluster runs its job inline, before the script exits
+
+with app.app_context():
+    query = Company.query.order_by(Company.id)
+    if args.company_id:
+        query = query.filter(Company.id.in_(args.company_id))
+    companies = [(company.id, company.name) for company in query.all()] # The session is cleared between batches
+    if not companies:
+        sys.exit("No matching companies.")
+
+    batch_size = args.batch_size or app.config['KB_IMPORT_EMBED_BATCH_SIZE']
+    chroma_client = init_chroma_client()
+    embedding_function = get_chroma_embedding_function()
+    failed = False
+    for company_id, company_name in companies:
+        if args.rebuild:
+            try:
+                chroma_client.delete_collection(ticket_collection_name(company_id))
+            except ValueError: # Never created
+                pass
+            chroma_registry.clear() # Drop the cached handle to the deleted collection
+            chroma_client = init_chroma_client()
+            embedding_function = get_chroma_embedding_function()
+            TicketSimilarity.query.filter(TicketSimilarity.ticket_id.in_(
+                db.session.query(Ticket.id).filter(Ticket.company_id == company_id))).delete(synchronize_session=False)
+            db.session.commit()
+        collection = get_ticket_collection(company_id, chroma_client, embedding_function)
+        if not collection:
+            print(f"Company {company_id}: ticket collection unavailable, skipped.")
+            failed = True
+            continue
+
+        started = time.perf_counter()
+        totals = {"indexed": 0, "unchanged": 0, "duplicates": 0}
+        last_id = 0
+        while True:
+            tickets = Ticket.query.filter(Ticket.company_id == company_id, Ticket.id > last_id)\
+                                  .order_by(Ticket.id).limit(batch_size).all()
+            if not tickets:
+                break
+            last_id = tickets[-1].id
+            stats = index_tickets(tickets, company_id, collection=collection, embedding_function=embedding_function)
+            for key in totals:
+                totals[key] += stats[key]
+            db.session.expunge_all()
+        totals["seconds"] = round(time.perf_counter() - started, 2)
+        print(f"Company {company_id} ({company_name}): {json.dumps(totals)}", flush=True)
+
+        if args.cluster:
+            job = enqueue_job('cluster_tickets', company_id=company_id)
+            if job.status != 'succeeded':
+                print(f"Company {company_id}: clustering failed: {job.last_error}")
+                failed = True
+                continue
+            result = json.loads(job.result)
+            print(f"Company {company_id}: {len(result['clusters'])} cluster(s) covering {result['clustered_tickets']} "
+                  f"of {result['open_tickets']} open ticket(s)", flush=True)
+    if failed:
+        sys.exit(1)
@@ -6,6 +6,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from app import create_app, db # Adjusted import
 from core.models import User, Company # Import models
+from core.migrations import stamp_migrations
 from werkzeug.security import generate_password_hash
 
 app = create_app()
@@ -15,6 +16,7 @@ with app.app_context():
     db.drop_all()
     print("Creating all tables...")
     db.create_all()
+    stamp_migrations() # create_all already built every index, so nothing is pending
     print("Database initialized.")
 
     # Optional: Create a default super admin or test company/users
@@ -0,0 +1,26 @@
+import sys
+import os
+
+# Add the parent directory to sys.path to allow imports from 'core'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app, db
+from core.migrations import MIGRATIONS, applied_versions, apply_migrations
+
+# Applies pending schema migrations (indexes, new columns) to an existing database
+# without dropping data. Usage: python scripts/migrate_db.py [--status]
+app = create_app()
+
+with app.app_context():
+    print(f"Database: {db.engine.url.render_as_string(hide_password=True)}")
+    db.create_all() # Creates any brand-new tables; existing tables are left untouched
+    if '--status' in sys.argv:
+        applied = applied_versions()
+        for version, description, _ in MIGRATIONS:
+            print(f"  [{'x' if version in applied else ' '}] {version}: {description}")
+    else:
+        applied_now = apply_migrations(logger=app.logger)
+        if applied_now:
+            print(f"Applied migrations: {', '.join(str(v) for v in applied_now)}")
+        else:
+            print("Database schema is up to date.")
@@ -0,0 +1,96 @@
+import sys
+import os
+import argparse
+import json
+import subprocess
+from collections import defaultdict
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Profiles a cold start of the serverless entry point (api/index.py) in a fresh
+# interpreter: import time by module (python -X importtime), create_app time,
+# the first /auth/login request, and which heavy ML modules got loaded on the way.
+#   python scripts/profile_startup.py
+#   python scripts/profile_startup.py --top 40 --by package
+#   python scripts/profile_startup.py --check   # exit 1 if startup imports the ML stack
+
+HEAVY_MODULES = ['chromadb', 'sentence_transformers', 'torch', 'transformers', 'onnxruntime', 'numpy', 'openai']
+
+# Runs in the child interpreter; prints one JSON line with timings and loaded heavy modules.
+CHILD_SCRIPT = r"""
+import json, sys, time
+started = time.perf_counter()
+import api.index
+imported = time.perf_counter()
+client = api.index.app.test_client()
+response = client.get('/auth/login')
+first_request = time.perf_counter()
+print("PROFILE_STARTUP " + json.dumps({
+    "import_and_create_app_ms": round((imported - started) * 1000, 1),
+    "first_login_request_ms": round((first_request - imported) * 1000, 1),
+    "login_status": response.status_code,
+    "heavy_modules_loaded": [m for m in %r if m in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def parse_importtime(stderr):
+    """Parses `-X importtime` lines into [(module, self_us, cumulative_us)]."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) == 3:
+            rows.append((parts[2].strip(), int(parts[0]), int(parts[1])))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile cold-start import time of the serverless entry point.")
+    parser.add_argument('--top', type=int, default=25, help="Rows to show")
+    parser.add_argument('--by', choices=['module', 'package'], default='module',
+                        help="Rank single modules by cumulative time, or top-level packages by self time")
+    parser.add_argument('--check', action='store_true', help="Exit 1 if any heavy ML module is imported at startup")
+    parser.add_argument('--json', help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=PROJECT_ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD_SCRIPT], cwd=PROJECT_ROOT, env=env,
+                            capture_output=True, text=True)
+    summary_line = next((line for line in result.stdout.splitlines() if line.startswith('PROFILE_STARTUP ')), None)
+    if result.returncode != 0 or summary_line is None:
+        sys.stderr.write(result.stderr[-4000:])
+        sys.exit(f"Startup failed (exit code {result.returncode}).")
+    summary = json.loads(summary_line[len('PROFILE_STARTUP '):])
+    rows = parse_importtime(result.stderr)
+
+    if args.by == 'package':
+        totals = defaultdict(int)
+        for module, self_us, _ in rows:
+            totals[module.split('.')[0]] += self_us
+        ranked = sorted(totals.items(), key=lambda item: -item[1])[:args.top]
+        print(f"{'package':<40}{'self ms':>10}")
+        for package, self_us in ranked:
+            print(f"{package:<40}{self_us / 1000:>10.1f}")
+    else:
+        ranked = sorted(rows, key=lambda row: -row[2])[:args.top]
+        print(f"{'module':<50}{'self ms':>10}{'cumulative ms':>15}")
+        for module, self_us, cumulative_us in ranked:
+            print(f"{module:<50}{self_us / 1000:>10.1f}{cumulative_us / 1000:>15.1f}")
+
+    print(f"\nImport + create_app: {summary['import_and_create_app_ms']} ms "
+          f"(sum of module self times {sum(row[1] for row in rows) / 1000:.1f} ms)")
+    print(f"First GET /auth/login: {summary['first_login_request_ms']} ms (HTTP {summary['login_status']})")
+    print(f"Heavy modules loaded: {', '.join(summary['heavy_modules_loaded']) or 'none'}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({**summary, "modules": [{"module": m, "self_us": s, "cumulative_us": c} for m, s, c in rows]}, f, indent=2)
+
+    if args.check and summary['heavy_modules_loaded']:
+        sys.exit(f"Cold start imports heavy modules: {', '.join(summary['heavy_modules_loaded'])}")
+
+
+if __name__ == '__main__':
+    main()
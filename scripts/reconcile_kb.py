@@ -0,0 +1,53 @@
+import sys
+import os
+import argparse
+import json
+
+# Add the parent directory to sys.path to allow imports from 'core'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from core.models import Company
+from core.knowledge_base import init_chroma_client, get_chroma_embedding_function, get_company_collection, mark_kb_changed
+from core.kb_sync import reconcile_company_kb
+
+# Diffs each company's KnowledgeItem rows against the chunks in its company_<id>_kb
+# Chroma collection (by content hash) and repairs only the differences: missing or
+# stale items are re-embedded, chunks of deleted items removed, vector_id fixed.
+# Suitable for cron; the KB admin page queues the same work as a background job.
+#   python scripts/reconcile_kb.py --dry-run
+#   python scripts/reconcile_kb.py --company-id 1
+
+parser = argparse.ArgumentParser(description="Repair differences between knowledge items and their ChromaDB vectors.")
+parser.add_argument('--company-id', type=int, default=None, help="Only this company (default: all companies)")
+parser.add_argument('--dry-run', action='store_true', help="Report differences without changing anything")
+parser.add_argument('--batch-size', type=int, default=None, help="Items per embedding batch / Chroma upsert")
+args = parser.parse_args()
+
+app = create_app()
+
+with app.app_context():
+    query = Company.query.order_by(Company.id)
+    if args.company_id:
+        query = query.filter(Company.id == args.company_id)
+    companies = query.all()
+    if not companies:
+        sys.exit("No matching companies.")
+
+    chroma_client = init_chroma_client()
+    st_embedding_function = get_chroma_embedding_function()
+    failed = False
+    for company in companies:
+        collection = get_company_collection(chroma_client, company.id, st_embedding_function)
+        if not collection:
+            print(f"Company {company.id}: ChromaDB collection unavailable, skipped.")
+            failed = True
+            continue
+        stats = reconcile_company_kb(company.id, collection, st_embedding_function,
+                                     batch_size=args.batch_size or app.config['KB_IMPORT_EMBED_BATCH_SIZE'],
+                                     dry_run=args.dry_run)
+        print(f"Company {company.id} ({company.name}): {json.dumps(stats)}")
+        if not args.dry_run and (stats["reembedded"] or stats["deleted_chunks"]):
+            mark_kb_changed(company.id)
+    if failed:
+        sys.exit(1)
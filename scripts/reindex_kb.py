@@ -0,0 +1,64 @@
+import sys
+import os
+import argparse
+import json
+
+# Add the parent directory to sys.path to allow imports from 'core'
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app
+from core.models import Company
+from core.kb_reindex import reindex_companies
+
+# Re-embeds every company's knowledge base into a new versioned Chroma collection
+# (company_<id>_kb_v<timestamp>) and switches the company to it once it is complete,
+# so live chat never reads a half-built index. Run it after changing the embedding
+# model or backend. Embedding runs across a process pool; per-company throughput is
+# reported as each company finishes. Old collections are kept for rollback unless
+# --drop-old is given.
+#   python scripts/reindex_kb.py --processes 4
+#   python scripts/reindex_kb.py --company-id 3 --company-id 7 --drop-old --output reindex.json
+
+
+def print_progress(stats):
+    if "error" in stats and stats.get("switched"):
+        print(f"Company {stats['company_id']}: switched to {stats['collection']} but the catch-up failed ({stats['error']}); "
+              f"a KB reconcile was run.", flush=True)
+        return
+    if "error" in stats:
+        print(f"Company {stats['company_id']}: FAILED ({stats['error']}); still serving its previous collection.", flush=True)
+        return
+    print(f"Company {stats['company_id']} ({stats['company']}): {stats['items']} items / {stats['chunks']} chunks "
+          f"in {stats['seconds']}s ({stats['items_per_second']} items/s, {stats['chunks_per_second']} chunks/s), "
+          f"{stats['catch_up_repairs']} catch-up repairs; now on {stats['collection']} (was {stats['previous_collection']})",
+          flush=True)
+
+
+if __name__ == '__main__': # Embedding workers are spawned processes that re-import this module
+    parser = argparse.ArgumentParser(description="Blue/green re-index of company knowledge bases.")
+    parser.add_argument('--company-id', type=int, action='append', help="Only these companies (repeatable; default: all)")
+    parser.add_argument('--processes', type=int, default=max((os.cpu_count() or 2) - 1, 1),
+                        help="Embedding worker processes (0 embeds in this process)")
+    parser.add_argument('--batch-size', type=int, default=None, help="Items per embedding batch / Chroma upsert")
+    parser.add_argument('--drop-old', action='store_true', help="Delete each company's previous collection after switching")
+    parser.add_argument('--output', help="Write per-company JSON results to this file")
+    args = parser.parse_args()
+    app = create_app()
+    app.config['BACKGROUND_JOBS_ENABLED'] = False # Follow-up jobs run inline, before the script exits
+    with app.app_context():
+        query = Company.query.order_by(Company.id)
+        if args.company_id:
+            query = query.filter(Company.id.in_(args.company_id))
+        companies = query.all()
+        if not companies:
+            sys.exit("No matching companies.")
+        print(f"Re-indexing {len(companies)} companies with {args.processes} embedding processes ...", flush=True)
+        results = reindex_companies(app, companies, processes=args.processes,
+                                    batch_size=args.batch_size or app.config['KB_IMPORT_EMBED_BATCH_SIZE'],
+                                    drop_old=args.drop_old, progress=print_progress)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {args.output}")
+        if any("error" in stats for stats in results):
+            sys.exit(1)